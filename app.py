@@ -1,28 +1,26 @@
 # file: app.py
 import streamlit as st
-from thore_client import ThoreAPIClient, SUMMARY_FILE
-from thore_steps import step1_create_policy, step_get_policyterm_id, step1_1_get_policy_details
-from thore_steps_extended import (
-    step1_1_1_verisk_location,
-    step1_1_2_verisk_location,
-    step1_1_3_verisk_aplus_request,
-    step1_1_4_verisk_aplus_save,
-    step1_2_patch_pending,
-    step1_2_1rule_overrides,
-    step2_convert_quote,
-    step2_1_patch_application,
-    step3_rule_overrides,
-    step3_run_enforcer,
-    step3_1_transaction_bind,
-    step3_1_1_transaction_update_binder,
-    step3_2_transaction_issue
-)
-from summary_utils import append_summary, load_summary
+from thore_client import ThoreAPIClient, attach_app_log
+from thore_runner import run_policy, run_sharded, run_concurrent
+from thore_queue import SQLiteWorkQueue, QUEUE_FILE, enqueue_run, wait_for_run
+from thore_workflow import DEFAULT_WORKFLOW, get_compiled_workflow
+from thore_profile import RunProfiler, PROFILE_DIR
+from summary_utils import ResultStore, EXPORT_FORMATS, EXPORT_COMPRESSIONS
+from thore_runs import RunOutput, cleanup_runs
+from thore_precompute import precompute_batch
+from thore_warmpool import QuoteWarmPool
+from thore_deadletter import DeadLetterStore, DEADLETTER_FILE
+from thore_autotune import ConcurrencyAutotuner, AUTOTUNE_FILE
+from thore_state import STATE_FILE
+from thore_preflight import preflight, dry_run
+from thore_tenants import ClientRegistry, load_tenants, run_tenants
 from datetime import datetime, timezone
 import logging
 import io
-# import os
+import os
+import time
 
+attach_app_log()
 logger = logging.getLogger(__name__)
 
 # # Create a Streamlit log area
@@ -50,6 +48,23 @@ logger = logging.getLogger(__name__)
 # logger.addHandler(streamlit_handler)
 # logger.setLevel(logging.INFO)
 
+def get_warm_pool(user_input, size):
+    """
+    The session's warm pool for this run, restarted when the effective date
+    or size changes or it went idle (see QuoteWarmPool.idle_timeout).
+    """
+    pool = st.session_state.get("warm_pool")
+    if pool and (pool.effective_date != user_input["effectiveDate"] or pool.size != size or pool.stopped):
+        pool.stop()
+        pool.client.close()
+        pool = None
+    if pool is None:
+        pool_client = ThoreAPIClient()
+        pool_client.authenticate()
+        pool = st.session_state["warm_pool"] = QuoteWarmPool(pool_client, user_input, size).start()
+    return pool.touch()
+
+
 st.set_page_config(page_title="WaterStreet Policy Automation", layout="centered")
 st.title("WaterStreet Policy Automation")
 # Get current UTC date
@@ -69,6 +84,65 @@ with st.form("policy_form"):
       if (not phone.isdigit() or len(phone) != 10):
         st.warning("Phone number must be numeric and must be 10 digits.")
     num_policies = st.number_input("Number of Policies to Create", min_value=1, step=1)
+    worker_processes = st.number_input(
+        "Worker processes (1 = run in this process)",
+        min_value=1, max_value=os.cpu_count() or 1, value=1, step=1)
+    concurrency = st.number_input(
+        "Concurrent policies per process",
+        min_value=1, max_value=50, value=1, step=1,
+        help="Policies in flight at once on one client; their lookups are batched.")
+    autotune = st.checkbox(
+        "Tune concurrency automatically",
+        help="Starts at 2 policies in flight and ramps up while throughput rises, backing off when 5xx/409 "
+             "responses or p95 request latency climb. The number above becomes the maximum. "
+             f"The chosen level and throughput curve are written to {AUTOTUNE_FILE} in the run directory.")
+    target_p95 = st.number_input(
+        "Autotune p95 request latency target in seconds",
+        min_value=0.5, value=5.0, step=0.5, disabled=not autotune)
+    use_http2 = st.checkbox(
+        "Use HTTP/2 (multiplexed)",
+        help="Sends concurrent requests as streams over a few connections instead of one socket each. "
+             "Needs httpx[http2]; servers without HTTP/2 are spoken to over HTTP/1.1. THORE_HTTP2=1 turns it "
+             "on for every client.")
+    tenants = load_tenants()
+    tenant_names = st.multiselect(
+        "Tenants",
+        options=[tenant.name for tenant in tenants],
+        help="Spreads the batch over these agencies/products/environments in proportion to their concurrency, "
+             "each on its own authenticated client, all at once. Configured as [[tenants]] in the secrets. "
+             "None selected runs against the default agency.") if tenants else []
+    synthetic = st.checkbox(
+        "Synthetic applicants and properties",
+        help="Gives every policy its own generated applicant and dwelling (address, limits, construction, "
+             "geolocation) instead of repeating the form's applicant and the default property, so load "
+             "numbers are not flattered by server-side caching. The same seed always yields the same batch.")
+    synthetic_seed = st.number_input("Synthetic data seed", min_value=0, value=0, step=1, disabled=not synthetic)
+    dry_run_mode = st.checkbox(
+        "Dry run against the local stand-in",
+        help="Runs the whole batch in this process against an in-memory stand-in of the API (thore_standin.py) "
+             "that validates every payload. Nothing is sent to the API.")
+    use_queue = st.checkbox(
+        "Distribute through the work queue",
+        help=f"Policies are queued in {QUEUE_FILE}; start workers with `python thore_queue.py worker`.")
+    profile_run = st.checkbox(
+        "Profile this run",
+        help=f"Writes a cProfile dump, flamegraph stacks and per-step CPU time to {PROFILE_DIR}/. "
+             "Only runs inside this process (not queue or multi-process runs) are profiled.")
+    trace_requests = st.checkbox(
+        "Trace requests",
+        help="Writes a span per policy, step and HTTP request (DNS, connect, TLS, time to first byte, "
+             "transfer) to traces.jsonl in the run directory, in OTLP/JSON.")
+    budget_minutes = st.number_input(
+        "Run time budget in minutes (0 = no limit)",
+        min_value=0, value=0, step=5,
+        help="Policies that cannot finish within the budget are cut off and reported as timed out. "
+             "Steps also have their own deadlines in the workflow definition.")
+    warm_pool_size = st.number_input(
+        "Warm pool of pre-created quotes (0 = off)",
+        min_value=0, max_value=50, value=0, step=1,
+        help="Keeps this many quotes created in the background for the effective date, so policies start "
+             "at the Pending PATCH. The pool stays warm between runs of this session and stops creating "
+             "quotes after 15 minutes without a run. In-process runs only.")
 
     steps = [
     "Step 1: To Quote",
@@ -81,6 +155,11 @@ with st.form("policy_form"):
     options=steps,
     default=steps)
 
+    workflow_path = st.text_input(
+        "Workflow definition",
+        value=DEFAULT_WORKFLOW,
+        help="JSON/YAML file listing the steps of each stage; enable or disable steps such as Verisk there.")
+
     # Validation flags
     step_order_invalid = False
 
@@ -121,6 +200,13 @@ if submitted:
     if len(steps_to_run) == 0:
         missing_fields.append("Steps to run")
 
+    # Compile the workflow up front so a bad definition fails before any API call
+    workflow_error = None
+    try:
+        get_compiled_workflow(workflow_path, tuple(steps_to_run))
+    except Exception as e:
+        workflow_error = str(e)
+
     if missing_fields:
         st.error(f"Please fill out all mandatory fields: {', '.join(missing_fields)}")
     elif "@" not in email:
@@ -129,6 +215,8 @@ if submitted:
         st.error("Phone number must be numeric and must be 10 digits.")
     elif step_order_invalid:
         st.error("Please fix the step order before proceeding.")
+    elif workflow_error:
+        st.error(f"Invalid workflow definition: {workflow_error}")
     else:
         st.success("All inputs are valid!")
         user_input = {
@@ -139,97 +227,180 @@ if submitted:
             "phone": phone,
             "numPolicies": num_policies,
         }
+        if synthetic:
+            user_input["syntheticSeed"] = int(synthetic_seed)
+
+        # Every payload of the batch is built and validated locally before any API call
+        check = preflight(user_input, steps_to_run, int(num_policies), workflow_path)
+        if not check["ok"]:
+            st.error("Preflight found problems, nothing was sent to the API:\n\n"
+                     + "\n".join(f"- {problem}" for problem in check["problems"]))
+            st.stop()
+        st.caption(f"Preflight passed in {check['seconds']}s ({check['requests']} stand-in requests).")
+
+        # Each run gets its own output directory (results, exports, profile, log shards)
+        cleanup_runs()
+        run = RunOutput(trace=trace_requests, state_path=None if dry_run_mode else STATE_FILE).open()
+
+        # Results go to disk as they arrive; only a page is ever held in memory
+        store = ResultStore(run.results_path)
+        dead_letters = DeadLetterStore()
+        run_deadline = time.time() + budget_minutes * 60 if budget_minutes else None
+        progress = st.progress(0.0)
+        tally = {"finished": 0, "completed": 0}
+
+        def report(outcome):
+            tally["finished"] += 1
+            n = outcome["policyRun"]
+            # failures are classified and kept for re-drive (see thore_deadletter)
+            if not dry_run_mode:
+                dead_letters.add(run.run_id, outcome, run.dir)
+            if outcome["status"] == "bind_failed":
+                st.warning(f"⚠️ Policy #{n} Bind failed: {outcome['message']}")
+            elif outcome["status"] == "issue_failed":
+                st.warning(f"⚠️ Policy #{n} Issue failed: {outcome['message']}")
+            elif outcome["status"] == "timed_out":
+                st.warning(f"⏱️ Policy #{n} timed out in {outcome.get('step')}: {outcome['message']}")
+            elif outcome["status"] == "error":
+                st.error(f"❌ Policy #{n} failed due to an unexpected error. Check logs for details.")
+            elif outcome["status"] != "completed":
+                # any other on_failure status of the workflow definition, e.g. the default "failed"
+                st.warning(f"⚠️ Policy #{n} {outcome['status']} at {outcome.get('step')}: {outcome['message']}")
+            else:
+                store.append(outcome["result"])
+                tally["completed"] += 1
+            # one progress line instead of a success message per policy
+            progress.progress(
+                tally["finished"] / int(num_policies),
+                text=f"✅ {tally['completed']} of {int(num_policies)} policies completed (last: #{n})")
 
-        client = ThoreAPIClient()
-        client.authenticate()
-
-        all_results = []
-        # st.session_state.all_results = []
-
-        for i in range(int(num_policies)):
-            st.write(f"Running Policy #{i+1} ...")
-            try:
-                if "Step 1: To Quote" in steps_to_run:
-                    instance_id = step1_create_policy(client, user_input)
-                    policyterm_id = step_get_policyterm_id(client, instance_id)
-                    step3_data = step1_1_get_policy_details(client, instance_id)
-                    # step1_1_1_verisk_location(client, instance_id)
-                    # step1_1_2_verisk_location(client, instance_id)
-                    # step1_1_3_verisk_aplus_request(client, instance_id)
-                    # step1_1_4_verisk_aplus_save(client, instance_id)
-                    step1_2_patch_pending(client, step3_data, user_input)
-                    # step1_2_1rule_overrides(client, instance_id, step3_data["resourceIdentifier"])
-                if "Step 2: To Application" in steps_to_run:
-                    step2_convert_quote(client, instance_id)
-                    step2_1_patch_application(client, step3_data, user_input)
-                if "Step 3: To Bound" in steps_to_run:
-                    enforcer_data = step3_run_enforcer(client, instance_id)
-                    run_overrides = False  # default to no overrides
-    
-                    if not enforcer_data:
-                        logger.warning("⚠️ No valid enforcer response — running rule overrides as fallback.")
-                        run_overrides = True
+        client = None
+        try:
+            if dry_run_mode:
+                st.write(f"Dry run: {int(num_policies)} policies against the local stand-in ...")
+                for outcome in dry_run(user_input, steps_to_run, int(num_policies), int(concurrency), workflow_path):
+                    report(outcome)
+            elif tenant_names:
+                selected = [tenant for tenant in tenants if tenant.name in tenant_names]
+                registry = ClientRegistry(http2=use_http2 or None)
+                st.write(f"Running {int(num_policies)} policies across {len(selected)} tenants: "
+                         + ", ".join(f"{tenant.name} ({tenant.concurrency} at a time)" for tenant in selected))
+                by_tenant = {}
+                try:
+                    for outcome in run_tenants(registry, selected, user_input, steps_to_run, int(num_policies),
+                                               workflow_path, run_deadline=run_deadline):
+                        counts = by_tenant.setdefault(outcome["tenant"], {})
+                        counts[outcome["status"]] = counts.get(outcome["status"], 0) + 1
+                        report(outcome)
+                finally:
+                    registry.close()
+                st.write("Outcomes by tenant:", by_tenant)
+            elif use_queue:
+                queue = SQLiteWorkQueue()
+                run_id = enqueue_run(queue, user_input, steps_to_run, int(num_policies), workflow_path=workflow_path,
+                                     run_id=run.run_id, run_dir=run.dir, run_deadline=run_deadline,
+                                     state_path=run.state_path)
+                st.write(f"Queued run {run_id}: {int(num_policies)} policies waiting for workers ...")
+                for outcome in wait_for_run(queue, run_id):
+                    report(outcome)
+            elif worker_processes > 1 and num_policies > 1:
+                st.write(f"Running {int(num_policies)} policies across {int(worker_processes)} processes ...")
+                for outcome in run_sharded(user_input, steps_to_run, int(num_policies), int(worker_processes), workflow_path,
+                                           run_dir=run.dir, run_deadline=run_deadline, trace_path=run.trace_path,
+                                           state_path=run.state_path, run_id=run.run_id):
+                    report(outcome)
+            else:
+                profiler = RunProfiler(run.run_id, run.profile_dir).start() if profile_run else None
+                policy_fn = profiler.wrap(run_policy) if profiler else run_policy
+                warm_pool = get_warm_pool(user_input, int(warm_pool_size)) if warm_pool_size else None
+                autotuner = None
+                if autotune and concurrency > 1 and num_policies > 1:
+                    autotuner = ConcurrencyAutotuner(max_concurrency=int(concurrency), target_p95=float(target_p95))
+                if concurrency > 1 and num_policies > 1:
+                    client = ThoreAPIClient(pool_size=int(concurrency), http2=use_http2 or None)
+                    client.authenticate()
+                    client.warm_pool = warm_pool
+                    if autotuner:
+                        st.write(f"Running {int(num_policies)} policies, tuning concurrency up to {int(concurrency)} ...")
                     else:
-                        try:
-                            item = enforcer_data["value"]["item"]
-                            http_status = item.get("httpStatusCode")
-                            type_value = item.get("type", "").lower()
-    
-                            # Conditions to trigger overrides
-                            if http_status != 200 or type_value in ["accept+", "reject", "reject+"]:
-                                logger.info(
-                                    f"ℹ️ Enforcer returned httpStatusCode={http_status}, type={type_value}. Triggering RuleOverrides."
-                                )
-                                run_overrides = True
-                            else:
-                                logger.info(
-                                    f"✅ Enforcer success: httpStatusCode={http_status}, type={type_value}. Skipping RuleOverrides."
-                                )
-                                logger.info("✅ Step 3 Quadrins Enforcer completed successfully.")
-    
-                        except Exception as e:
-                            logger.warning(f"⚠️ Failed to parse Enforcer response structure: {e}")
-                            run_overrides = True  # fail-safe
-    
-                    if run_overrides:
-                        step3_rule_overrides(client, instance_id, step3_data["resourceIdentifier"])
-                        logger.info(f"✅ Step 3 RuleOverride completed.")
-                    # step3_rule_overrides(client, instance_id, step3_data["resourceIdentifier"])
-                    bind_result = step3_1_transaction_bind(client, instance_id)
-                    if not bind_result["success"]:
-                        st.warning(f"⚠️ Policy #{i+1} Bind failed: {bind_result['message']}")
-                        logger.warning(f"Bind failed: {bind_result['message']}")
-                        continue  # skip remaining steps for this policy
-                    
-                if "Step 4: To Issue" in steps_to_run:
-                    # step3_1_1_transaction_update_binder(client, instance_id)
-                    issue_result = step3_2_transaction_issue(client, policyterm_id)
-                    if not issue_result["success"]:
-                        st.warning(f"⚠️ Policy #{i+1} Issue failed: {issue_result['message']}")
-                        logger.warning(f"Issue failed: {issue_result['message']}")
-                        continue  # move on to next policy
-    
-                result_entry = {
-                    "policyRun": i + 1,
-                    "instanceId": step3_data["instanceId"],
-                    "policyNumber": step3_data.get("policyNumber"),
-                    "transactionNumber": step3_data.get("transactionNumber"),
-                    "resourceIdentifier": step3_data.get("resourceIdentifier"),
-                }
-                append_summary(result_entry)
-                all_results.append(result_entry)
-                # st.session_state.all_results.append(result_entry)
-    
-                st.success(f"✅ Policy #{i+1} completed successfully.")
-            except Exception as e:
-                logger.exception(f"❌ Unexpected error for policy #{i+1}")
-                st.error(f"❌ Policy #{i+1} failed due to an unexpected error. Check logs for details.")
-                continue
-
-        st.subheader("Run Summary")
-        st.json(all_results)
-        # st.json(st.session_state.all_results)
-
-        # Offer download
-        with open(SUMMARY_FILE, "rb") as f:
-            st.download_button("Download JSON Summary", f, file_name="thore_run_summary.json", mime="application/json")
+                        st.write(f"Running {int(num_policies)} policies, {int(concurrency)} at a time ...")
+                    for outcome in run_concurrent(client, user_input, steps_to_run, int(num_policies), int(concurrency),
+                                                  workflow_path, policy_fn=policy_fn, run_deadline=run_deadline,
+                                                  autotuner=autotuner):
+                        report(outcome)
+                else:
+                    client = ThoreAPIClient(http2=use_http2 or None)
+                    client.authenticate()
+                    client.warm_pool = warm_pool
+                    applicants = precompute_batch(user_input, int(num_policies))
+
+                    for i in range(int(num_policies)):
+                        st.write(f"Running Policy #{i+1} ...")
+                        report(policy_fn(client, applicants.row(i), steps_to_run, i + 1, workflow_path=workflow_path,
+                                         run_deadline=run_deadline))
+
+                if autotuner:
+                    autotuner.write_report(os.path.join(run.dir, AUTOTUNE_FILE))
+                    st.subheader("Concurrency")
+                    st.write(f"Chosen concurrency: {autotuner.chosen} (finished at {autotuner.limit})")
+                    if autotuner.curve:
+                        st.line_chart({
+                            "responses/s": [point["throughput"] for point in autotuner.curve],
+                            "concurrency": [point["concurrency"] for point in autotuner.curve],
+                        })
+                if warm_pool:
+                    st.caption(f"Warm pool: {warm_pool.stats}, {warm_pool.ready()} quotes ready for the next run")
+                if profiler:
+                    files = profiler.stop()
+                    st.subheader("Profile")
+                    st.dataframe(profiler.step_table())
+                    st.write("Profile files: " + ", ".join(f"`{path}`" for path in files.values()))
+        finally:
+            if client is not None:
+                # an HTTP/2 transport holds an event loop thread and connections until closed
+                client.close()
+            run_log = run.close()
+
+        st.caption(f"Run {run.run_id}: output in `{run.dir}`, merged log `{run_log}`")
+        step_timings = run.state.store.step_timings(run.run_id) if run.state else None
+        if step_timings:
+            st.write("Step timings (seconds):")
+            st.dataframe([{"step": step, **timing} for step, timing in step_timings.items()])
+        failures = dead_letters.counts(run.run_id)
+        if failures:
+            st.write("Failures by category:", failures)
+            if failures.get("open"):
+                st.info(f"Retry the transient failures from their failed step with "
+                        f"`python thore_deadletter.py --db {DEADLETTER_FILE} redrive --run {run.run_id}`.")
+
+        st.session_state["results_path"] = store.path
+        st.session_state.pop("export_path", None)
+
+# Survives reruns (e.g. paging), reading one page of the stored results at a time
+if st.session_state.get("results_path") and os.path.exists(st.session_state["results_path"]):
+    store = ResultStore(st.session_state["results_path"], fresh=False)
+    st.subheader("Run Summary")
+    page_size = 100
+    pages = max(1, -(-len(store) // page_size))
+    page = st.number_input(f"Page (of {pages}, {len(store)} policies)", min_value=1, max_value=pages, value=1, step=1)
+    st.json([record._asdict() for record in store.page(int(page) - 1, page_size)])
+
+    # Offer download; the export is streamed from the store to a compressed file first
+    export_format = st.selectbox("Export format", EXPORT_FORMATS)
+    export_compression = st.selectbox(
+        "Compression", list(EXPORT_COMPRESSIONS), index=1, format_func=lambda c: c or "none",
+        help="Parquet uses it as its column codec. zstd needs the zstandard package, Parquet needs pyarrow.")
+    if st.button("Prepare export"):
+        try:
+            st.session_state["export_path"] = store.export(export_format, export_compression)
+        except RuntimeError as e:
+            st.error(str(e))
+    export_path = st.session_state.get("export_path")
+    if export_path and os.path.exists(export_path):
+        def read_export(path=export_path) -> bytes:
+            # read only when the button is clicked, not on every rerun
+            with open(path, "rb") as f:
+                return f.read()
+
+        st.download_button(f"Download {os.path.basename(export_path)}", read_export,
+                           file_name=os.path.basename(export_path), mime="application/octet-stream")
@@ -1,33 +1,228 @@
 # file: summary_utils.py
+import csv
+import gzip
+import io
 import json
 import os
 import logging
-from typing import Dict, Any, List
-from thore_client import SUMMARY_FILE
+from array import array
+from itertools import islice
+from typing import Dict, Any, List, Iterator, NamedTuple, Optional
+from thore_client import SUMMARY_FILE, RESULTS_FILE
 
 logger = logging.getLogger(__name__)
 
-def append_summary(entry: Dict[str, Any]) -> None:
-    """Append one policy's result to the JSON summary file."""
-    try:
-        data: List[Dict[str, Any]] = []
-        if SUMMARY_FILE and os.path.exists(SUMMARY_FILE):
-            with open(SUMMARY_FILE, "r", encoding="utf-8") as f:
-                try:
-                    data = json.load(f) or []
-                except json.JSONDecodeError:
-                    data = []
-        data.append(entry)
-        with open(SUMMARY_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
-        logger.info(f"Summary updated for policy {entry.get('policyNumber')}")
-    except Exception as e:
-        logger.error(f"Failed to update summary: {e}")
-
-
-def load_summary() -> List[Dict[str, Any]]:
-    try:
-        with open(SUMMARY_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return []
+# ----------------------------
+# Memory-bounded result store
+# ----------------------------
+
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_FORMATS = ("jsonl", "csv", "json", "parquet")
+# compression -> file suffix
+EXPORT_COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+class PolicyResult(NamedTuple):
+    """Compact result record; stored on disk as a JSON array in field order."""
+    policyRun: int
+    instanceId: Optional[int]
+    policyNumber: Optional[str]
+    transactionNumber: Optional[int]
+    resourceIdentifier: Optional[str]
+    policytermId: Optional[int] = None  # absent from stores written before it was recorded
+
+    @classmethod
+    def from_entry(cls, entry: Dict[str, Any]) -> "PolicyResult":
+        return cls(*(_as_int(entry.get(field)) if field in _INT_FIELDS else entry.get(field)
+                     for field in cls._fields))
+
+
+_INT_FIELDS = ("policyRun", "instanceId", "transactionNumber", "policytermId")
+
+
+def _as_int(value: Any) -> Optional[int]:
+    """Integer fields as int; digit strings (CSV cells, older stores) are converted."""
+    if isinstance(value, str):
+        return int(value) if value.strip().isdigit() else None
+    return value
+
+
+class ResultStore:
+    """
+    Append-only JSON Lines file of PolicyResult rows. Only the byte offset of
+    each row stays in memory (8 bytes per policy), so runs of any size keep
+    the Streamlit process flat; the UI reads pages and exports stream rows.
+    Opening an existing file with fresh=False re-indexes it, e.g. after a
+    Streamlit rerun.
+    """
+
+    def __init__(self, path: str = RESULTS_FILE, fresh: bool = True):
+        self.path = path
+        self._offsets = array("q")
+        if fresh or not os.path.exists(path):
+            open(path, "w").close()
+        else:
+            with open(path, "rb") as f:
+                offset = f.tell()
+                for line in iter(f.readline, b""):
+                    if line.strip():
+                        self._offsets.append(offset)
+                    offset = f.tell()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def append(self, entry: Dict[str, Any]) -> PolicyResult:
+        record = PolicyResult.from_entry(entry)
+        line = (json.dumps(list(record), separators=(",", ":")) + "\n").encode("utf-8")
+        with open(self.path, "ab") as f:
+            self._offsets.append(f.tell())
+            f.write(line)
+        return record
+
+    def page(self, number: int, size: int = 100) -> List[PolicyResult]:
+        """Rows of 0-based page `number` in completion order."""
+        start = number * size
+        if start >= len(self._offsets):
+            return []
+        rows = []
+        with open(self.path, "rb") as f:
+            f.seek(self._offsets[start])
+            for _ in range(min(size, len(self._offsets) - start)):
+                rows.append(PolicyResult(*json.loads(f.readline())))
+        return rows
+
+    def __iter__(self) -> Iterator[PolicyResult]:
+        with open(self.path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    yield PolicyResult(*json.loads(line))
+
+    def chunks(self, size: int = EXPORT_CHUNK_ROWS) -> Iterator[List[PolicyResult]]:
+        return _batched(iter(self), size)
+
+    def export(self, fmt: str = "jsonl", compression: Optional[str] = "gzip",
+               path: Optional[str] = None) -> str:
+        """
+        Stream the rows to a file in `fmt` (json, jsonl, csv or parquet) with
+        `compression` (None, gzip or zstd), EXPORT_CHUNK_ROWS rows at a time.
+        zstd needs the zstandard package and parquet needs pyarrow; parquet
+        applies the compression as its column codec. Returns the file path.
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {fmt!r}; use one of {', '.join(EXPORT_FORMATS)}")
+        if compression not in EXPORT_COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r}; use one of {EXPORT_COMPRESSIONS}")
+        if path is None:
+            # thore_run_summary.<fmt>[.gz|.zst] next to the store
+            stem = os.path.join(os.path.dirname(self.path), os.path.splitext(os.path.basename(SUMMARY_FILE))[0])
+            suffix = "" if fmt == "parquet" or not compression else EXPORT_COMPRESSIONS[compression]
+            path = f"{stem}.{fmt}{suffix}"
+        if os.path.abspath(path) == os.path.abspath(self.path):
+            raise ValueError("Export path must differ from the result store file")
+
+        if fmt == "parquet":
+            self._export_parquet(path, compression)
+        else:
+            with _open_text(path, compression) as f:
+                if fmt == "csv":
+                    writer = csv.writer(f)
+                    writer.writerow(PolicyResult._fields)
+                    for chunk in self.chunks():
+                        writer.writerows(chunk)
+                else:
+                    lines = (json.dumps(record._asdict()) for record in self)
+                    if fmt == "jsonl":
+                        for chunk in _batched(lines, EXPORT_CHUNK_ROWS):
+                            f.write("\n".join(chunk) + "\n")
+                    else:
+                        f.write("[")
+                        for i, chunk in enumerate(_batched(lines, EXPORT_CHUNK_ROWS)):
+                            f.write((",\n  " if i else "\n  ") + ",\n  ".join(chunk))
+                        f.write("\n]\n" if len(self) else "]\n")
+        logger.info(f"Exported {len(self)} results to {path} ({fmt}, {compression or 'uncompressed'})")
+        return path
+
+    def _export_parquet(self, path: str, compression: Optional[str]) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("pyarrow is required for Parquet export (pip install pyarrow)")
+        schema = pa.schema([
+            ("policyRun", pa.int64()),
+            ("instanceId", pa.int64()),
+            ("policyNumber", pa.string()),
+            ("transactionNumber", pa.int64()),
+            ("resourceIdentifier", pa.string()),
+            ("policytermId", pa.int64()),
+        ])
+        with pq.ParquetWriter(path, schema, compression=compression or "none") as writer:
+            for chunk in self.chunks():
+                columns = list(zip(*chunk))
+                # stores written before transactionNumber was an int may hold it as a string
+                writer.write_table(pa.table(
+                    {name: [_as_int(v) for v in values] if name in _INT_FIELDS else list(values)
+                     for name, values in zip(PolicyResult._fields, columns)}, schema=schema))
+
+
+def read_results(path: str) -> Iterator[PolicyResult]:
+    """
+    Stream the rows of any run summary: a ResultStore file, a json, jsonl or
+    csv export (optionally .gz/.zst) or the legacy JSON summary.
+    """
+    base, ext = os.path.splitext(path)
+    compression = {".gz": "gzip", ".zst": "zstd"}.get(ext)
+    fmt = os.path.splitext(base)[1] if compression else ext
+    with _open_read(path, compression) as f:
+        if fmt == ".csv":
+            for row in csv.DictReader(f):
+                yield PolicyResult.from_entry({k: v or None for k, v in row.items()})
+        elif fmt == ".json":
+            for entry in json.load(f) or []:
+                yield PolicyResult.from_entry(entry)
+        else:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    yield PolicyResult(*row) if isinstance(row, list) else PolicyResult.from_entry(row)
+
+
+
+
+# ----------------------------
+# Export helpers
+# ----------------------------
+
+def _batched(items: Iterator[Any], size: int) -> Iterator[List[Any]]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _open_text(path: str, compression: Optional[str]):
+    if compression == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=6)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstandard is required for zstd export (pip install zstandard)")
+        raw = zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb"), closefd=True)
+        return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def _open_read(path: str, compression: Optional[str]):
+    if compression == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstandard is required to read zstd summaries (pip install zstandard)")
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
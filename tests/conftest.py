@@ -0,0 +1,23 @@
+# file: tests/conftest.py
+import os
+import sys
+import tempfile
+
+from streamlit import config
+
+# thore_client reads st.secrets at import time; point Streamlit at test secrets so the
+# suite runs without a .streamlit/secrets.toml (nothing here talks to a real server)
+TEST_SECRETS = """
+USERNAME = "test"
+PASSWORD = "test"
+BASE_URL = "http://thore.test"
+APPLICATION_KEY = "test"
+"""
+
+_secrets_dir = tempfile.mkdtemp(prefix="thore-test-")
+_secrets_path = os.path.join(_secrets_dir, "secrets.toml")
+with open(_secrets_path, "w", encoding="utf-8") as f:
+    f.write(TEST_SECRETS)
+config.set_option("secrets.files", [_secrets_path])
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,40 @@
+# file: tests/test_replay.py
+import pytest
+
+import thore_batch
+from thore_client import ThoreAPIClient
+from thore_replay import CassetteWriter, RecordingTransport, ReplayTransport, _key
+from thore_runner import run_concurrent
+from thore_standin import StandInTransport
+
+STEPS = ["Step 1: To Quote", "Step 2: To Application", "Step 3: To Bound", "Step 4: To Issue"]
+USER_INPUT = {"effectiveDate": "2026-11-01", "firstName": "Replay", "lastName": "Test", "email": "replay@example.com",
+              "phone": "5555550100", "numPolicies": 10}
+
+
+def _run(transport, policies=10, concurrency=5):
+    client = ThoreAPIClient(pool_size=concurrency, max_attempts=1, transport=transport)
+    client.authenticate()
+    try:
+        return list(run_concurrent(client, USER_INPUT, STEPS, policies, concurrency))
+    finally:
+        client.close()
+
+
+def test_key_sorts_batched_ids():
+    assert _key("get", "/v1/x?limit=3&ids=12,3,7") == _key("GET", "/v1/x?limit=3&ids=3,7,12")
+
+
+@pytest.mark.parametrize("filter_query", [False, True])
+def test_concurrent_run_replays_offline(tmp_path, monkeypatch, filter_query):
+    monkeypatch.setattr(thore_batch, "FILTER_QUERY", filter_query)
+    cassette = str(tmp_path / "cassette.jsonl.gz")
+    writer = CassetteWriter(cassette)
+    recorded = _run(RecordingTransport(StandInTransport(), writer))
+    writer.close()
+    assert [o["status"] for o in recorded] == ["completed"] * 10
+
+    replayed = _run(ReplayTransport(cassette, loop=False))
+
+    assert [o["status"] for o in replayed] == ["completed"] * 10
+    assert sorted(o["result"]["instanceId"] for o in replayed) == sorted(o["result"]["instanceId"] for o in recorded)
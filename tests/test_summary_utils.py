@@ -0,0 +1,46 @@
+# file: tests/test_summary_utils.py
+import json
+
+import pytest
+
+from summary_utils import ResultStore, read_results
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def _result(n):
+    return {"policyRun": n, "instanceId": 900000 + n, "policyNumber": f"HOATX{n}", "transactionNumber": 1,
+            "resourceIdentifier": f"r{n}", "policytermId": 800000 + n}
+
+
+def test_parquet_export_with_int_transaction_numbers(tmp_path):
+    store = ResultStore(str(tmp_path / "results.jsonl"))
+    for n in range(1, 4):
+        store.append(_result(n))
+
+    path = store.export("parquet", None, str(tmp_path / "summary.parquet"))
+
+    table = pq.read_table(path)
+    assert table.schema.field("transactionNumber").type == pa.int64()
+    assert table.column("transactionNumber").to_pylist() == [1, 1, 1]
+    assert table.column("policyRun").to_pylist() == [1, 2, 3]
+
+
+def test_parquet_export_of_a_store_with_string_transaction_numbers(tmp_path):
+    results = tmp_path / "results.jsonl"
+    results.write_text(json.dumps([1, 900001, "HOATX1", "2", "r1", None]) + "\n")
+    store = ResultStore(str(results), fresh=False)
+
+    path = store.export("parquet", "gzip", str(tmp_path / "summary.parquet"))
+
+    assert pq.read_table(path).column("transactionNumber").to_pylist() == [2]
+
+
+def test_csv_export_reads_back_as_ints(tmp_path):
+    store = ResultStore(str(tmp_path / "results.jsonl"))
+    store.append(_result(1))
+
+    path = store.export("csv", None, str(tmp_path / "summary.csv"))
+
+    assert list(read_results(path)) == list(store)
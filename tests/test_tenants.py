@@ -0,0 +1,32 @@
+# file: tests/test_tenants.py
+import json
+
+import pytest
+
+from thore_tenants import ClientRegistry, Tenant, run_tenants
+from thore_workflow import DEFAULT_WORKFLOW
+
+STEPS = ["Step 1: To Quote", "Step 2: To Application", "Step 3: To Bound", "Step 4: To Issue"]
+
+
+def test_other_product_needs_its_own_workflow():
+    with pytest.raises(ValueError, match="DP3TX"):
+        Tenant.from_dict({"name": "dp3", "agency_id": 52, "product": "DP3TX"})
+
+    tenant = Tenant.from_dict({"name": "dp3", "agency_id": 52, "product": "DP3TX", "workflow": DEFAULT_WORKFLOW})
+
+    assert tenant.workflow == DEFAULT_WORKFLOW
+    assert Tenant.from_dict({"name": "hoa", "agency_id": 49}).workflow is None
+
+
+def test_tenant_workflow_without_the_stages_fails_before_any_policy(tmp_path):
+    workflow = tmp_path / "dp3tx.json"
+    workflow.write_text(json.dumps({"name": "dp3tx", "steps": [{"name": "create_policy", "stage": "Quote"}]}))
+    tenant = Tenant("dp3", product="DP3TX", workflow=str(workflow))
+    started = []
+
+    with pytest.raises(ValueError, match="has no Step 1: To Quote"):
+        list(run_tenants(ClientRegistry(), [tenant], {}, STEPS, 2,
+                         policy_fn=lambda *args, **kwargs: started.append(args)))
+
+    assert started == []
@@ -0,0 +1,157 @@
+# file: thore_autotune.py
+import json
+import logging
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+import requests
+
+from thore_versions import is_version_conflict
+
+logger = logging.getLogger(__name__)
+
+AUTOTUNE_FILE = "autotune.json"
+
+# ----------------------------
+# Adaptive concurrency
+# ----------------------------
+
+class ConcurrencyAutotuner:
+    """
+    Picks how many policies run at once from what the sandbox is doing now.
+
+    Every request attempt of the client reports its status and latency
+    (client.on_response, timed around _request's sends). Every `window`
+    seconds the tuner compares the window with the previous one:
+
+    - error rate (5xx, no response, 409s other than version conflicts,
+      which versioned_patch resolves by refetching) above max_error_rate or p95
+      request latency above target_p95: back off to limit * backoff;
+    - otherwise, while throughput (successful responses per second) still
+      rises by more than min_gain: ramp up, doubling until the first
+      back-off and by `step` after it;
+    - otherwise hold.
+
+    The level with the best throughput in a healthy window is `chosen`;
+    report() returns it with the per-window curve.
+    """
+
+    def __init__(self, start: int = 2, min_concurrency: int = 1, max_concurrency: int = 20,
+                 target_p95: float = 5.0, max_error_rate: float = 0.05, window: float = 10.0,
+                 step: int = 1, backoff: float = 0.7, min_gain: float = 0.05):
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.limit = min(max(start, self.min_concurrency), self.max_concurrency)
+        self.target_p95 = target_p95
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.step = step
+        self.backoff = backoff
+        self.min_gain = min_gain
+        self.curve: List[Dict[str, Any]] = []
+        self._slow_start = True
+        self._last_throughput: Optional[float] = None
+        self._best: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._reset(self._started)
+
+    def _reset(self, now: float) -> None:
+        self._window_start = now
+        self._latencies: List[float] = []
+        self._errors = 0
+        self._completed = 0
+
+    def attach(self, client) -> None:
+        client.on_response = self.observe
+
+    @staticmethod
+    def detach(client) -> None:
+        client.on_response = None
+
+    def observe(self, status_code: Optional[int], seconds: float, resp: Optional[requests.Response] = None) -> None:
+        """One request attempt finished (status None: no response)."""
+        with self._lock:
+            self._latencies.append(seconds)
+            if status_code is None or status_code >= 500 or (status_code == 409 and not is_version_conflict(resp)):
+                self._errors += 1
+            self._maybe_adjust()
+
+    def record_outcome(self, outcome: Dict[str, Any]) -> int:
+        """One policy finished; returns the concurrency to run at now."""
+        with self._lock:
+            if outcome.get("status") == "completed":
+                self._completed += 1
+            self._maybe_adjust()
+            return self.limit
+
+    @property
+    def chosen(self) -> int:
+        with self._lock:
+            return self._best["concurrency"] if self._best else self.limit
+
+    def _maybe_adjust(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.window or not self._latencies:
+            return
+        requests = len(self._latencies)
+        latencies = sorted(self._latencies)
+        p95 = latencies[min(requests - 1, int(0.95 * requests))]
+        error_rate = self._errors / requests
+        throughput = (requests - self._errors) / elapsed
+
+        before = self.limit
+        if error_rate > self.max_error_rate or p95 > self.target_p95:
+            self.limit = max(self.min_concurrency, int(self.limit * self.backoff))
+            self._slow_start = False
+            reason = "errors" if error_rate > self.max_error_rate else "latency"
+        elif self._last_throughput is None or throughput > self._last_throughput * (1 + self.min_gain):
+            grow = self.limit if self._slow_start else self.step
+            self.limit = min(self.max_concurrency, self.limit + grow)
+            reason = "ramp"
+        else:
+            reason = "plateau"
+        healthy = reason in ("ramp", "plateau")
+        if healthy and (self._best is None or throughput > self._best["throughput"]):
+            self._best = {"concurrency": before, "throughput": throughput}
+
+        self.curve.append({
+            "t": round(now - self._started, 2),
+            "concurrency": before,
+            "next": self.limit,
+            "throughput": round(throughput, 3),
+            "policiesPerSecond": round(self._completed / elapsed, 3),
+            "p95": round(p95, 3),
+            "errorRate": round(error_rate, 4),
+            "requests": requests,
+            "decision": reason,
+        })
+        if self.limit != before:
+            logger.info(f"🎚️ Concurrency {before} -> {self.limit} ({reason}): {throughput:.2f} responses/s, "
+                        f"p95 {p95:.2f}s, {error_rate:.1%} errors")
+        self._last_throughput = throughput
+        self._reset(now)
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "chosen": self._best["concurrency"] if self._best else self.limit,
+                "final": self.limit,
+                "settings": {
+                    "minConcurrency": self.min_concurrency,
+                    "maxConcurrency": self.max_concurrency,
+                    "targetP95": self.target_p95,
+                    "maxErrorRate": self.max_error_rate,
+                    "window": self.window,
+                },
+                "curve": list(self.curve),
+            }
+
+    def write_report(self, path: str) -> str:
+        report = self.report()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"🎚️ Chose concurrency {report['chosen']}; throughput curve written to {path}")
+        return path
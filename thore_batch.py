@@ -0,0 +1,154 @@
+# file: thore_batch.py
+import contextvars
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from typing import Dict, Any, List, Tuple, Optional
+
+from thore_client import ThoreAPIClient, DeadlineExceeded, time_left
+from thore_steps import step_get_policyterm_id, step1_1_get_policy_details, policy_details_from_instance
+
+logger = logging.getLogger(__name__)
+
+# THORE_BATCH_FILTER_QUERY=1 fetches the details of a batch with one ids= list query. The
+# parameter is not confirmed for the real API yet, so it is off unless asked for.
+FILTER_QUERY = os.getenv("THORE_BATCH_FILTER_QUERY", "").lower() in ("1", "true", "yes", "on")
+
+# ----------------------------
+# Batched PolicyTerm / policy detail lookups
+# ----------------------------
+
+class BatchResolver:
+    """
+    Coalesces the post-create lookups (PolicyTerm ID and policy details) of
+    policies running concurrently on one client.
+
+    Callers block on policyterm_id()/details(); requests arriving within
+    `window` seconds (or until max_batch are waiting) are flushed together.
+    Duplicate requests for the same instance share one lookup. With
+    use_filter_query (default THORE_BATCH_FILTER_QUERY), details for the
+    whole batch are first asked for with a single list query filtered on
+    instance IDs, sent once without retries; anything it does not return
+    (and all PolicyTerm lookups) is fetched with concurrent GETs
+    multiplexed over the client's shared connection pool. Results fan back
+    out to each waiter. Every lookup runs in a copy of its (first) caller's
+    context, so the caller's deadline, poll policy, run ID and version
+    tracking apply to it.
+    """
+
+    def __init__(self, client: ThoreAPIClient, window: float = 0.05, max_batch: int = 50,
+                 use_filter_query: Optional[bool] = None):
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self.use_filter_query = FILTER_QUERY if use_filter_query is None else use_filter_query
+        self._pending: Dict[Tuple[str, int], Tuple[Future, contextvars.Context]] = {}
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._executor = ThreadPoolExecutor(max_workers=max_batch, thread_name_prefix="thore-batch")
+        self.stats = {"lookups": 0, "coalesced": 0, "batches": 0, "requests": 0}
+        self.users = 0  # run_jobs calls sharing this resolver (see thore_runner)
+
+    def policyterm_id(self, instance_id: int) -> int:
+        return self._wait(self._submit("policyterm", instance_id), "PolicyTerm lookup")
+
+    def details(self, instance_id: int) -> Dict[str, Any]:
+        return self._wait(self._submit("details", instance_id), "policy details lookup")
+
+    @staticmethod
+    def _wait(future: Future, label: str):
+        """Wait for a lookup no longer than the caller's deadline."""
+        left = time_left()
+        try:
+            return future.result(timeout=None if left is None else max(0.0, left))
+        except FuturesTimeout:
+            raise DeadlineExceeded(f"Deadline passed waiting for batched {label}")
+
+    def close(self) -> None:
+        self._flush()
+        self._executor.shutdown(wait=True)
+
+    def _submit(self, kind: str, instance_id: int) -> Future:
+        batch = None
+        with self._lock:
+            self.stats["lookups"] += 1
+            key = (kind, instance_id)
+            if key in self._pending:
+                self.stats["coalesced"] += 1
+                return self._pending[key][0]
+            future = Future()
+            self._pending[key] = (future, contextvars.copy_context())
+            if len(self._pending) >= self.max_batch:
+                batch = self._take()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            self._run_batch(batch)
+        return future
+
+    def _take(self) -> Dict[Tuple[str, int], Tuple[Future, contextvars.Context]]:
+        """Detach the pending batch; caller holds the lock."""
+        batch, self._pending = self._pending, {}
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self) -> None:
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._run_batch(batch)
+
+    def _count(self, stat: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[stat] += n
+
+    def _run_batch(self, batch: Dict[Tuple[str, int], Tuple[Future, contextvars.Context]]) -> None:
+        self._count("batches")
+        detail_ids = [instance_id for kind, instance_id in batch if kind == "details"]
+        logger.info(f"Resolving batch of {len(batch)} lookups ({len(detail_ids)} policy details)")
+
+        if self.use_filter_query and len(detail_ids) > 1:
+            # the shared query runs under the first waiter's context; each waiter still has its own deadline
+            context = batch[("details", detail_ids[0])][1].copy()
+            for instance_id, details in context.run(self._query_details, detail_ids).items():
+                batch.pop(("details", instance_id))[0].set_result(details)
+
+        self._count("requests", len(batch))
+        for (kind, instance_id), (future, context) in batch.items():
+            lookup = step_get_policyterm_id if kind == "policyterm" else step1_1_get_policy_details
+            self._executor.submit(context.run, self._resolve, future, lookup, instance_id)
+
+    def _resolve(self, future: Future, lookup, instance_id: int) -> None:
+        try:
+            future.set_result(lookup(self.client, instance_id))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _query_details(self, instance_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """One filtered list query for many instances; returns what it found."""
+        ids = ",".join(str(i) for i in sorted(instance_ids))  # a stable URL whatever order lookups arrived in
+        url = (
+            f"{self.client.base_url}/v1/entityInstances/{self.client.entity_type}"
+            f"?limit={len(instance_ids)}&ids={ids}"
+        )
+        self._count("requests")
+        try:
+            # once, without _request's retries: a server that rejects the parameter falls back at once
+            resp = self.client._send("GET", url, headers=self.client.headers())
+            items = resp.json()
+        except Exception as e:
+            logger.warning(f"Batch details query failed, falling back to per-instance GETs: {e}")
+            return {}
+
+        wanted = set(instance_ids)
+        found = {}
+        for item in items if isinstance(items, list) else []:
+            if item.get("id") in wanted and item.get("resourceIdentifier"):
+                found[item["id"]] = policy_details_from_instance(item["id"], item)
+        logger.info(f"Batch details query returned {len(found)}/{len(instance_ids)} instances")
+        return found
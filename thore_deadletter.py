@@ -0,0 +1,326 @@
+# file: thore_deadletter.py
+import argparse
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Iterator, Optional, Sequence
+
+from thore_client import ThoreAPIClient, RESULTS_FILE
+from thore_failures import TRANSIENT, FAILURE_CATEGORIES
+from thore_runner import run_policy, run_jobs
+from thore_tenants import ClientRegistry, load_tenants
+from summary_utils import ResultStore
+
+logger = logging.getLogger(__name__)
+
+DEADLETTER_FILE = "thore_deadletter.db"
+MAX_REDRIVES = 3
+# Seconds after which a row still marked redriving (its re-drive process died) may be claimed again
+REDRIVE_LEASE = 3600
+
+# ----------------------------
+# Dead-letter store
+# ----------------------------
+
+class DeadLetterStore:
+    """
+    One row per failed policy with its classified failure (see
+    thore_failures) and the state to resume it from the failed step.
+
+    status: open (waiting), redriving (claimed by a re-drive), resolved
+    (a re-drive completed it) or dead (not retryable, or out of re-drives).
+    A redriving row not updated for lease_seconds is claimable again.
+    """
+    _COLUMNS = ("id, run_id, policy_run, run_dir, step, category, http_status, rule_ids, message, resume, "
+                "status, redrives")
+
+    def __init__(self, path: str = DEADLETTER_FILE, lease_seconds: float = REDRIVE_LEASE):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS failures (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    run_id TEXT NOT NULL,
+                    policy_run INTEGER NOT NULL,
+                    run_dir TEXT,
+                    step TEXT,
+                    category TEXT NOT NULL,
+                    http_status INTEGER,
+                    rule_ids TEXT,
+                    message TEXT,
+                    resume TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'open',
+                    redrives INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT,
+                    updated_at TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_failures_status ON failures (status, category)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_failures_run ON failures (run_id, status)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit mode; transactions are opened explicitly where needed
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def add(self, run_id: str, outcome: Dict[str, Any], run_dir: Optional[str] = None) -> Optional[int]:
+        """Record a failed outcome of run_policy; completed outcomes are ignored."""
+        failure = outcome.get("failure")
+        if outcome.get("status") == "completed" or not failure or not outcome.get("resume"):
+            return None
+        status = "open" if failure["retryable"] else "dead"
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO failures (run_id, policy_run, run_dir, step, category, http_status, rule_ids, message,
+                                      resume, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (run_id, outcome["policyRun"], run_dir, failure["step"], failure["category"], failure["httpStatus"],
+                 json.dumps(failure["ruleIds"]), failure["message"], json.dumps(outcome["resume"]), status,
+                 self._now(), self._now()),
+            )
+        logger.info(f"☠️ Policy #{outcome['policyRun']} of run {run_id} dead-lettered: "
+                    f"{failure['category']} at {failure['step']}")
+        return cursor.lastrowid
+
+    def claim(self, categories: Sequence[str] = (TRANSIENT,), run_id: Optional[str] = None,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Atomically mark open failures of `categories`, and redriving ones
+        whose lease expired, as redriving and return them.
+        """
+        placeholders = ", ".join("?" for _ in categories)
+        query = (f"SELECT {self._COLUMNS} FROM failures WHERE (status = 'open' OR "
+                 f"(status = 'redriving' AND updated_at < ?)) AND category IN ({placeholders})")
+        expired = (datetime.now(timezone.utc) - timedelta(seconds=self.lease_seconds)).isoformat()
+        params: List[Any] = [expired] + list(categories)
+        if run_id:
+            query += " AND run_id = ?"
+            params.append(run_id)
+        query += " ORDER BY id"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(query, params).fetchall()
+            conn.executemany(
+                "UPDATE failures SET status = 'redriving', redrives = redrives + 1, updated_at = ? WHERE id = ?",
+                [(self._now(), row[0]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        stale = sum(1 for row in rows if row[10] == "redriving")
+        if stale:
+            logger.warning(f"Reclaimed {stale} failures whose re-drive stopped without a result")
+        return [self._record(row) for row in rows]
+
+    def release(self, failure_ids: Sequence[int]) -> None:
+        """Put claimed failures back to open without counting the claim as a re-drive."""
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE failures SET status = 'open', redrives = redrives - 1, updated_at = ? "
+                "WHERE id = ? AND status = 'redriving'",
+                [(self._now(), failure_id) for failure_id in failure_ids],
+            )
+
+    def resolve(self, failure_id: int, outcome: Dict[str, Any], max_redrives: int = MAX_REDRIVES) -> str:
+        """Store the outcome of a re-drive; returns the row's new status."""
+        failure = outcome.get("failure")
+        with self._connect() as conn:
+            if outcome.get("status") == "completed" or not failure:
+                conn.execute("UPDATE failures SET status = 'resolved', updated_at = ? WHERE id = ?",
+                             (self._now(), failure_id))
+                return "resolved"
+            redrives = conn.execute("SELECT redrives FROM failures WHERE id = ?", (failure_id,)).fetchone()[0]
+            status = "open" if failure["retryable"] and redrives < max_redrives else "dead"
+            conn.execute(
+                """
+                UPDATE failures SET status = ?, step = ?, category = ?, http_status = ?, rule_ids = ?, message = ?,
+                    resume = ?, updated_at = ? WHERE id = ?
+                """,
+                (status, failure["step"], failure["category"], failure["httpStatus"], json.dumps(failure["ruleIds"]),
+                 failure["message"], json.dumps(outcome["resume"]), self._now(), failure_id),
+            )
+        return status
+
+    def counts(self, run_id: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """{status: {category: n}}"""
+        query = "SELECT status, category, COUNT(*) FROM failures"
+        params: List[Any] = []
+        if run_id:
+            query += " WHERE run_id = ?"
+            params.append(run_id)
+        with self._connect() as conn:
+            rows = conn.execute(query + " GROUP BY status, category", params).fetchall()
+        counts: Dict[str, Dict[str, int]] = {}
+        for status, category, n in rows:
+            counts.setdefault(status, {})[category] = n
+        return counts
+
+    def failures(self, run_id: Optional[str] = None, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = f"SELECT {self._COLUMNS} FROM failures WHERE 1 = 1"
+        params: List[Any] = []
+        if run_id:
+            query += " AND run_id = ?"
+            params.append(run_id)
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        with self._connect() as conn:
+            rows = conn.execute(query + " ORDER BY id", params).fetchall()
+        return [self._record(row) for row in rows]
+
+    @staticmethod
+    def _record(row) -> Dict[str, Any]:
+        return {
+            "id": row[0],
+            "runId": row[1],
+            "policyRun": row[2],
+            "runDir": row[3],
+            "step": row[4],
+            "category": row[5],
+            "httpStatus": row[6],
+            "ruleIds": json.loads(row[7]) if row[7] else [],
+            "message": row[8],
+            "resume": json.loads(row[9]),
+            "status": row[10],
+            "redrives": row[11],
+        }
+
+
+# ----------------------------
+# Re-drive
+# ----------------------------
+
+def redrive(client: ThoreAPIClient, store: DeadLetterStore, categories: Sequence[str] = (TRANSIENT,),
+            run_id: Optional[str] = None, concurrency: int = 4, limit: Optional[int] = None,
+            max_redrives: int = MAX_REDRIVES, registry: Optional[ClientRegistry] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Run the open failures of `categories` again from their failed step,
+    `concurrency` at a time, with their saved state and idempotency keys.
+    Failures of a tenant run (resume["tenant"]) re-drive on that tenant's
+    client from `registry` (see thore_tenants); the rest on `client`.
+    Failures of a tenant no longer configured, or that cannot authenticate,
+    are left open. Completed policies are appended to their run's results
+    file. Yields each re-drive outcome with deadLetterId and the row's new
+    status. Claimed failures without an outcome (an error, or the caller
+    stopping early) are put back to open.
+    """
+    failures = store.claim(categories, run_id, limit)
+    logger.info(f"Re-driving {len(failures)} failures ({', '.join(categories)})")
+    if not failures:
+        return
+    unresolved = {failure["id"] for failure in failures}
+    by_tenant: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for failure in failures:
+        by_tenant.setdefault(failure["resume"].get("tenant"), []).append(failure)
+
+    needs_tenants = any(name is not None for name in by_tenant)
+    own_registry = registry is None and needs_tenants
+    registry = ClientRegistry() if own_registry else registry
+    stores: Dict[str, ResultStore] = {}
+    try:
+        tenants = {tenant.name: tenant for tenant in load_tenants()} if needs_tenants else {}
+        for name, group in by_tenant.items():
+            if name is None:
+                tenant_client = client
+            elif name in tenants:
+                try:
+                    tenant_client = registry.client(tenants[name], pool_size=concurrency)
+                except Exception as e:
+                    logger.error(f"❌ Tenant {name} unavailable ({e}); leaving its {len(group)} failures open")
+                    continue
+            else:
+                logger.error(f"❌ Tenant {name!r} is not configured; leaving its {len(group)} failures open")
+                continue
+            yield from _redrive_group(tenant_client, store, group, concurrency, max_redrives, stores, unresolved)
+    finally:
+        if unresolved:
+            store.release(sorted(unresolved))
+        if own_registry:
+            registry.close()
+
+
+def _redrive_group(client: ThoreAPIClient, store: DeadLetterStore, failures: List[Dict[str, Any]], concurrency: int,
+                   max_redrives: int, stores: Dict[str, ResultStore], unresolved: set) -> Iterator[Dict[str, Any]]:
+    by_id = {failure["id"]: failure for failure in failures}
+    jobs = []
+    for failure in failures:
+        resume = failure["resume"]
+        jobs.append({
+            "dead_letter_id": failure["id"],
+            "user_input": resume["userInput"], "steps_to_run": resume["stepsToRun"],
+            "policy_run": failure["policyRun"], "workflow_path": resume["workflowPath"],
+            "seed": dict(resume["state"], scratch=resume.get("scratch") or {}), "resume_from": resume["step"],
+        })
+
+    for outcome in run_jobs(client, jobs, concurrency, _redrive_one):
+        failure = by_id[outcome["deadLetterId"]]
+        status = store.resolve(failure["id"], outcome, max_redrives)
+        unresolved.discard(failure["id"])
+        if status == "resolved" and outcome["result"] and failure["runDir"]:
+            results_path = os.path.join(failure["runDir"], RESULTS_FILE)
+            if results_path not in stores and os.path.exists(results_path):
+                stores[results_path] = ResultStore(results_path, fresh=False)
+            if results_path in stores:
+                stores[results_path].append(outcome["result"])
+        yield dict(outcome, deadLetterStatus=status)
+
+
+def _redrive_one(client: ThoreAPIClient, dead_letter_id: int, **job) -> Dict[str, Any]:
+    return dict(run_policy(client, **job), deadLetterId=dead_letter_id)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Dead-lettered policy failures")
+    parser.add_argument("--db", default=DEADLETTER_FILE, help="dead-letter database file")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    status = sub.add_parser("status", help="failure counts by status and category")
+    status.add_argument("--run", dest="run_id")
+
+    listing = sub.add_parser("list", help="list failures")
+    listing.add_argument("--run", dest="run_id")
+    listing.add_argument("--status", default=None)
+
+    again = sub.add_parser("redrive", help="retry failures from their failed step")
+    again.add_argument("--run", dest="run_id")
+    again.add_argument("--category", action="append", choices=FAILURE_CATEGORIES,
+                       help=f"categories to retry (repeatable, default {TRANSIENT})")
+    again.add_argument("--concurrency", type=int, default=4)
+    again.add_argument("--limit", type=int, default=None)
+    again.add_argument("--max-redrives", type=int, default=MAX_REDRIVES)
+
+    args = parser.parse_args()
+    store = DeadLetterStore(args.db)
+    if args.command == "status":
+        print(json.dumps(store.counts(args.run_id), indent=2))
+    elif args.command == "list":
+        for failure in store.failures(args.run_id, args.status):
+            failure.pop("resume")
+            print(json.dumps(failure))
+    else:
+        client = ThoreAPIClient(pool_size=max(1, args.concurrency))
+        client.authenticate()
+        tally: Dict[str, int] = {}
+        for outcome in redrive(client, store, args.category or [TRANSIENT], args.run_id, args.concurrency,
+                               args.limit, args.max_redrives):
+            tally[outcome["deadLetterStatus"]] = tally.get(outcome["deadLetterStatus"], 0) + 1
+        print(json.dumps(tally, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# file: thore_failures.py
+import json
+import logging
+from typing import Dict, Any, List, Optional
+
+import requests
+from thore_client import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Failure categories
+# ----------------------------
+# transient      5xx, 408/429, connection errors: worth retrying as is
+# business_rule  409 and other 4xx rejections, with the violated rule IDs
+# parse          a response that could not be read (bad JSON, missing fields)
+# timeout        cut off by the run budget or a step deadline
+# unknown        anything else
+
+TRANSIENT = "transient"
+BUSINESS_RULE = "business_rule"
+PARSE = "parse"
+TIMEOUT = "timeout"
+UNKNOWN = "unknown"
+FAILURE_CATEGORIES = (TRANSIENT, BUSINESS_RULE, PARSE, TIMEOUT, UNKNOWN)
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def rule_ids(error_json: Any) -> List[str]:
+    """IDs of the rules a 409 body reports as violated (messages[].ruleId / code)."""
+    ids = []
+    messages = error_json.get("messages") if isinstance(error_json, dict) else None
+    for message in messages if isinstance(messages, list) else []:
+        if isinstance(message, dict):
+            rule = message.get("ruleId") or message.get("code") or message.get("id")
+            if rule is not None and str(rule) not in ids:
+                ids.append(str(rule))
+    return ids
+
+
+def http_failure(resp: Optional[requests.Response]) -> Dict[str, Any]:
+    """Fields a step adds to its {"success": False, ...} result for an HTTP error."""
+    if resp is None:
+        return {}
+    fields: Dict[str, Any] = {"httpStatus": resp.status_code}
+    if resp.status_code < 500:
+        try:
+            fields["ruleIds"] = rule_ids(resp.json())
+        except ValueError:
+            pass
+    return fields
+
+
+def exception_failure(e: BaseException) -> Dict[str, Any]:
+    """Fields describing an exception that failed a step (see classify_failure)."""
+    fields: Dict[str, Any] = {"error": type(e).__name__}
+    response = getattr(e, "response", None)
+    if isinstance(response, requests.Response):
+        fields.update(http_failure(response))
+    return fields
+
+
+def classify_failure(failure: Dict[str, Any], exc: Optional[BaseException] = None) -> Dict[str, Any]:
+    """
+    Structured record of a failed policy: category, retryable, step,
+    message, httpStatus and ruleIds when known. `failure` is the dict
+    execute_workflow returned (status, message, step and the step's
+    httpStatus/ruleIds), or the outcome of a policy that raised `exc`.
+    """
+    record = {
+        "step": failure.get("step"),
+        "message": failure.get("message", ""),
+        "httpStatus": failure.get("httpStatus"),
+        "ruleIds": failure.get("ruleIds") or [],
+        "error": failure.get("error"),
+    }
+    if exc is not None:
+        record.update(exception_failure(exc))
+    record["category"] = _category(failure.get("status"), record, exc)
+    record["retryable"] = record["category"] == TRANSIENT
+    return record
+
+
+def _category(status: Optional[str], record: Dict[str, Any], exc: Optional[BaseException]) -> str:
+    if status == "timed_out":
+        return TIMEOUT
+    http_status = record.get("httpStatus")
+    if http_status is not None:
+        if http_status in TRANSIENT_STATUS_CODES or http_status >= 500:
+            return TRANSIENT
+        if 400 <= http_status < 500:
+            return BUSINESS_RULE
+    # walk the exception and what it was raised from (steps wrap parse errors in RuntimeError)
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, DeadlineExceeded):
+            return TIMEOUT
+        if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+            return TRANSIENT
+        if isinstance(exc, (json.JSONDecodeError, requests.JSONDecodeError, KeyError, IndexError, TypeError)):
+            return PARSE
+        exc = exc.__cause__ or exc.__context__
+    if record.get("error") in ("ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout"):
+        return TRANSIENT
+    return UNKNOWN
@@ -0,0 +1,268 @@
+# file: thore_http2.py
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import threading
+import time
+from http import HTTPStatus
+from typing import Dict, Any, List, Optional, Callable
+
+import requests
+
+from thore_client import ThoreAPIClient, build_response
+
+logger = logging.getLogger(__name__)
+
+# THORE_HTTP2=1 gives every client without an explicit transport the HTTP/2 one;
+# THORE_HTTP2=h2c also speaks HTTP/2 to plain http URLs (prior knowledge, no fallback)
+HTTP2_ENV = "THORE_HTTP2"
+# Connections per origin the HTTP/2 transport may open; each multiplexes many streams
+HTTP2_MAX_CONNECTIONS = int(os.getenv("THORE_HTTP2_CONNECTIONS", "4"))
+
+# ----------------------------
+# HTTP/2 transport
+# ----------------------------
+# ThoreAPIClient sends through requests (HTTP/1.1): every in-flight request
+# holds its own socket, so N concurrent policies need N connections and N
+# TLS handshakes. httpx with h2 multiplexes concurrent requests as streams
+# over a few connections instead. HTTP/2 is negotiated via ALPN on https;
+# servers without it (and plain http, where httpx never upgrades) are
+# spoken to over HTTP/1.1 by the same transport.
+
+
+def http2_enabled() -> bool:
+    return os.getenv(HTTP2_ENV, "").lower() in ("1", "true", "yes", "on", "h2c")
+
+
+def http2_available() -> bool:
+    try:
+        import httpx  # noqa: F401
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def h2c_available() -> bool:
+    """Whether the benchmark can serve the local stand-in over h2c (needs hypercorn)."""
+    return importlib.util.find_spec("hypercorn") is not None
+
+
+class HTTP2Transport:
+    """
+    ThoreAPIClient transport over one shared httpx.AsyncClient with HTTP/2
+    enabled. With prior_knowledge, plain http URLs are spoken to over
+    HTTP/2 as well (h2c) and HTTP/1.1 is off. The client lives on its own
+    event loop thread and callers block on their request there: httpcore's
+    sync HTTP/2 connection encodes headers without a lock, so threads
+    sharing it corrupt the HPACK state. Responses are converted to
+    requests.Response and httpx errors to the requests exceptions the
+    client retries on. Bodies are read whole, so the stream/ignore/headers
+    body policies only save the decoding, not the transfer.
+    """
+
+    def __init__(self, max_connections: int = HTTP2_MAX_CONNECTIONS, pool_size: int = 10,
+                 prior_knowledge: bool = False):
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError("The HTTP/2 transport needs httpx (pip install 'httpx[http2]')")
+        self._httpx = httpx
+        # HTTP/1.1 fallback connections still need one socket per in-flight request
+        limits = httpx.Limits(max_connections=max(max_connections, pool_size),
+                              max_keepalive_connections=max(max_connections, pool_size))
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="thore-http2", daemon=True)
+        self._thread.start()
+        self.client = self._run(self._open(limits, prior_knowledge))
+        self._lock = threading.Lock()
+        self.versions: Dict[str, int] = {}  # negotiated protocol -> responses
+
+    async def _open(self, limits, prior_knowledge: bool):
+        return self._httpx.AsyncClient(http1=not prior_knowledge, http2=True, limits=limits)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def __call__(self, method: str, url: str, *, timeout: Optional[float] = None, stream: bool = False,
+                 headers: Optional[Dict[str, str]] = None, json: Any = None, data: Any = None,
+                 params: Any = None, **kwargs) -> requests.Response:
+        httpx = self._httpx
+        try:
+            resp = self._run(self.client.request(method, url, headers=headers, json=json, content=data,
+                                                 params=params, timeout=timeout))
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(f"{method} {url}: {e}") from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(f"{method} {url}: {e}") from e
+        with self._lock:
+            self.versions[resp.http_version] = self.versions.get(resp.http_version, 0) + 1
+
+        converted = build_response(resp.status_code, dict(resp.headers), resp.content, str(resp.url))
+        # HTTP/2 has no reason phrase; raise_for_status messages still want one
+        converted.reason = resp.reason_phrase or HTTPStatus(resp.status_code).phrase
+        converted.elapsed = resp.elapsed
+        return converted
+
+    def close(self) -> None:
+        if self._loop.is_closed():
+            return
+        self._run(self.client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+
+
+def http2_transport(session: requests.Session, pool_size: int = 10) -> Callable[..., requests.Response]:
+    """The HTTP/2 transport, or session.request (HTTP/1.1) when httpx/h2 are not installed."""
+    if not http2_available():
+        logger.warning("⚠️ HTTP/2 was requested but httpx[http2] is not installed; using HTTP/1.1")
+        return session.request
+    return HTTP2Transport(pool_size=pool_size, prior_knowledge=os.getenv(HTTP2_ENV, "").lower() == "h2c")
+
+
+# ----------------------------
+# Benchmark
+# ----------------------------
+
+def _serve_standin(h2c: bool):
+    """A stand-in on a free local port: (standin, url, stop). h2c serves it with hypercorn over HTTP/1.1 and h2c."""
+    from thore_standin import StandIn, asgi_app, serve
+    standin = StandIn()
+    if not h2c:
+        server = serve(port=0, standin=standin)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address[:2]
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+        return standin, f"http://{host}:{port}", stop
+
+    try:
+        from hypercorn.asyncio import serve as hypercorn_serve
+        from hypercorn.config import Config
+    except ImportError:
+        raise RuntimeError("Serving the stand-in over HTTP/2 needs hypercorn (pip install hypercorn)")
+    import socket
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.loglevel = "WARNING"
+    loop = asyncio.new_event_loop()
+    stopping = asyncio.Event()
+    ready = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        loop.run_until_complete(hypercorn_serve(asgi_app(standin), config, shutdown_trigger=stopping.wait))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait()
+    for _ in range(50):  # until the listener is up
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    standin.connections = 0  # not the probe
+
+    def stop():
+        loop.call_soon_threadsafe(stopping.set)
+        thread.join(timeout=5)
+    return standin, f"http://127.0.0.1:{port}", stop
+
+
+def benchmark(transport_name: str, url: str, user_input: Dict[str, Any], steps: List[str], policies: int,
+              concurrency: int, connections: Callable[[], int], prior_knowledge: bool = False) -> Dict[str, Any]:
+    """Run a batch with one transport against url; requests per second, latency and sockets opened."""
+    from thore_runner import run_concurrent
+
+    if transport_name == "http2":
+        transport = HTTP2Transport(pool_size=concurrency, prior_knowledge=prior_knowledge)
+        client = ThoreAPIClient(pool_size=concurrency, max_attempts=1, transport=transport)
+    else:
+        transport = None
+        client = ThoreAPIClient(pool_size=concurrency, max_attempts=1)
+    client.base_url = url
+    latencies: List[float] = []
+    client.on_response = lambda status, seconds, resp: latencies.append(seconds)
+
+    opened = connections()
+    start = time.perf_counter()
+    client.authenticate()
+    tally: Dict[str, int] = {}
+    for outcome in run_concurrent(client, user_input, steps, policies, concurrency):
+        tally[outcome["status"]] = tally.get(outcome["status"], 0) + 1
+    seconds = time.perf_counter() - start
+    if transport is not None:
+        transport.close()
+    client.session.close()
+
+    latencies.sort()
+    protocols = dict(transport.versions) if transport else {"HTTP/1.1": len(latencies)}
+    warning = None
+    if transport_name == "http2" and "HTTP/2" not in protocols:
+        warning = "no request used HTTP/2; this run measured HTTP/1.1 (use --h2c or an HTTP/2 server)"
+        logger.warning(f"⚠️ {warning}")
+    return {
+        "transport": transport_name,
+        "protocols": protocols,
+        "statuses": tally,
+        "requests": len(latencies),
+        "seconds": round(seconds, 3),
+        "requestsPerSecond": round(len(latencies) / seconds, 1) if seconds else None,
+        "p50Ms": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        "p95Ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2) if latencies else None,
+        "connectionsOpened": connections() - opened,
+        "warning": warning,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the HTTP/1.1 and HTTP/2 transports")
+    parser.add_argument("--url", help="API base URL (default: a local stand-in on a free port)")
+    parser.add_argument("--policies", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--effective-date", default=time.strftime("%Y-%m-%d"))
+    parser.add_argument("--transports", nargs="+", default=["http1", "http2"], choices=["http1", "http2"])
+    parser.add_argument("--h2c", action=argparse.BooleanOptionalAction, default=None,
+                        help="serve the local stand-in with hypercorn and speak HTTP/2 to it without TLS "
+                             "(the plain stand-in server only speaks HTTP/1.1); on by default for the "
+                             "local stand-in when hypercorn is installed")
+    args = parser.parse_args()
+    if args.h2c is None:
+        args.h2c = args.url is None and h2c_available()
+    if args.url is None and not args.h2c and "http2" in args.transports:
+        logger.warning("⚠️ The stand-in only speaks HTTP/1.1 without --h2c (pip install hypercorn); "
+                       "the http2 run will measure HTTP/1.1")
+
+    standin, stop = None, None
+    url = args.url
+    if url is None:
+        standin, url, stop = _serve_standin(args.h2c)
+    # sockets opened are counted by the local stand-in; unknown against a remote URL
+    connections = (lambda: standin.connections) if standin else (lambda: 0)
+
+    user_input = {"effectiveDate": args.effective_date, "firstName": "Bench", "lastName": "Mark",
+                  "email": "bench@example.com", "phone": "5555550100", "numPolicies": args.policies}
+    steps = ["Step 1: To Quote", "Step 2: To Application", "Step 3: To Bound", "Step 4: To Issue"]
+    try:
+        results = [benchmark(name, url, user_input, steps, args.policies, args.concurrency, connections,
+                             prior_knowledge=args.h2c)
+                   for name in args.transports]
+    finally:
+        if stop:
+            stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
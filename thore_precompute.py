@@ -0,0 +1,102 @@
+# file: thore_precompute.py
+import logging
+import re
+from datetime import datetime
+from typing import Dict, Any, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Per-policy applicant fields the step payloads read from ctx["userInput"]
+APPLICANT_FIELDS = (
+    "effectiveDate",      # YYYY-MM-DD as entered
+    "effectiveDateIso",   # create payload format
+    "effectiveDateTime",  # PATCH payload format
+    "firstName",
+    "lastName",
+    "displayName",
+    "phone",              # digits only
+    "email",              # trimmed, lower-case domain
+)
+# Also present on synthetic rows (see thore_synthetic): "birthDate" and "property"
+
+_NON_DIGITS = re.compile(r"\D")
+
+# ----------------------------
+# Batch precompute
+# ----------------------------
+
+class ApplicantColumns:
+    """
+    Derived applicant fields of a whole batch, one list per field.
+    Built in one pass before any policy runs; workers only call row(i).
+    """
+    __slots__ = ("columns", "size")
+
+    def __init__(self, columns: Dict[str, List[Any]]):
+        self.columns = columns
+        self.size = len(columns["effectiveDate"])
+
+    def __len__(self) -> int:
+        return self.size
+
+    def row(self, index: int) -> Dict[str, Any]:
+        return {name: column[index] for name, column in self.columns.items()}
+
+    @classmethod
+    def build(cls, applicants: Sequence[Dict[str, Any]]) -> "ApplicantColumns":
+        # Distinct dates are parsed once for the whole batch
+        dates = {
+            d: datetime.strptime(d, "%Y-%m-%d")
+            for d in {a["effectiveDate"] for a in applicants}
+        }
+        iso = {d: dt.strftime("%Y-%m-%dT00:00:00.000-06:00") for d, dt in dates.items()}
+        with_time = {d: f"{d}T06:00:00Z" for d in dates}
+
+        effective = [a["effectiveDate"] for a in applicants]
+        first = [a["firstName"].strip() for a in applicants]
+        last = [a["lastName"].strip() for a in applicants]
+        columns = {
+            "effectiveDate": effective,
+            "effectiveDateIso": [iso[d] for d in effective],
+            "effectiveDateTime": [with_time[d] for d in effective],
+            "firstName": first,
+            "lastName": last,
+            "displayName": [f"{f} {l}" for f, l in zip(first, last)],
+            "phone": [_NON_DIGITS.sub("", a["phone"]) for a in applicants],
+            "email": [_normalize_email(a["email"]) for a in applicants],
+        }
+        return cls(columns)
+
+
+def _normalize_email(email: str) -> str:
+    local, at, domain = email.strip().rpartition("@")
+    return f"{local}{at}{domain.lower()}" if at else domain
+
+
+def precompute_batch(user_input: Dict[str, Any], num_policies: int) -> ApplicantColumns:
+    """
+    Columns for num_policies policies of the same applicant (the form's
+    batch). With user_input["syntheticSeed"], every policy gets its own
+    generated applicant and property instead (see thore_synthetic).
+    """
+    seed = user_input.get("syntheticSeed")
+    if seed is not None and num_policies > 0:
+        from thore_synthetic import synthetic_columns
+        columns = synthetic_columns(ApplicantColumns.build([user_input]).row(0), num_policies, int(seed))
+        logger.info(f"Generated synthetic applicants and properties for {num_policies} policies (seed {seed})")
+        return ApplicantColumns(columns)
+    if num_policies > 0:
+        # one distinct applicant: derive once, repeat the references
+        derived = ApplicantColumns.build([user_input]).row(0)
+        columns = {name: [value] * num_policies for name, value in derived.items()}
+    else:
+        columns = {name: [] for name in APPLICANT_FIELDS}
+    logger.info(f"Precomputed applicant fields for {num_policies} policies")
+    return ApplicantColumns(columns)
+
+
+def applicant_row(user_input: Dict[str, Any]) -> Dict[str, Any]:
+    """Derived fields of one policy; rows that were already precomputed pass through."""
+    if "effectiveDateIso" in user_input:
+        return user_input
+    return ApplicantColumns.build([user_input]).row(0)
@@ -0,0 +1,173 @@
+# file: thore_preflight.py
+import argparse
+import contextvars
+import json
+import logging
+import time
+from typing import Dict, Any, List, Iterator, Optional
+
+from thore_client import ThoreAPIClient
+from thore_precompute import precompute_batch
+from thore_runner import run_policy, run_concurrent
+from thore_schemas import FORM_SCHEMA, APPLICANT_SCHEMA, validate
+from thore_standin import StandIn, StandInTransport
+from thore_workflow import DEFAULT_WORKFLOW, get_compiled_workflow
+
+logger = logging.getLogger(__name__)
+
+# Applicant rows preflight checks (spread evenly over the batch) and how many
+# distinct ones it dry-runs; synthetic batches make every row distinct
+PREFLIGHT_ROWS = 2000
+PREFLIGHT_DRY_RUNS = 5
+
+# ----------------------------
+# Preflight
+# ----------------------------
+# Before a batch spends any API calls: the form input and the derived
+# applicant rows (up to PREFLIGHT_ROWS) are checked against thore_schemas,
+# the workflow selection is compiled, seeds are checked for the IDs their
+# workflow starts from, and one policy per distinct applicant row (up to
+# PREFLIGHT_DRY_RUNS) is run through the real step code against the local
+# stand-in (thore_standin), which validates every payload the steps build.
+# A broken batch fails here in milliseconds.
+
+def standin_client(pool_size: int = 10, standin: Optional[StandIn] = None) -> ThoreAPIClient:
+    """An authenticated client whose requests are answered by a StandIn (no network)."""
+    client = ThoreAPIClient(pool_size=pool_size, max_attempts=1, transport=StandInTransport(standin))
+    client.authenticate()
+    return client
+
+
+def preflight(user_input: Dict[str, Any], steps_to_run: List[str], num_policies: int,
+              workflow_path: str = DEFAULT_WORKFLOW,
+              seeds: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Check a batch before it runs. Returns {"ok", "problems", "policies"
+    (dry-run policies), "requests" (stand-in requests), "seconds"}; each
+    problem names where it was found (form, applicant, workflow, seed or
+    the failing step) and what is wrong.
+    """
+    start = time.perf_counter()
+    problems: List[str] = []
+    report = {"ok": False, "problems": problems, "policies": 0, "requests": 0}
+
+    problems.extend(f"form {p}" for p in validate(user_input, FORM_SCHEMA))
+    try:
+        workflow = get_compiled_workflow(workflow_path, tuple(steps_to_run))
+    except (ValueError, KeyError, OSError) as e:
+        problems.append(f"workflow: {e}")
+        workflow = []
+    if not workflow and not problems:
+        problems.append(f"workflow: no steps selected from {workflow_path}")
+    if problems:
+        return dict(report, seconds=round(time.perf_counter() - start, 4))
+
+    applicants = precompute_batch(user_input, num_policies)
+    distinct: Dict[str, int] = {}
+    for i in range(0, len(applicants), max(1, len(applicants) // PREFLIGHT_ROWS)):
+        key = json.dumps(applicants.row(i), sort_keys=True)
+        if key not in distinct:
+            distinct[key] = i
+            problems.extend(f"applicant #{i + 1} {p}" for p in validate(applicants.row(i), APPLICANT_SCHEMA))
+
+    seeds = seeds or []
+    for i, seed in enumerate(seeds):
+        # follow-on workflows start from the seeded policy (see thore_transactions.load_policy_terms)
+        ids = [(seed or {}).get(key) for key in ("instanceId", "policytermId")]
+        if not any(isinstance(value, int) and value > 0 for value in ids):
+            problems.append(f"seed #{i + 1}: needs an instanceId or policytermId, got {seed!r}")
+    if problems:
+        return dict(report, seconds=round(time.perf_counter() - start, 4))
+
+    # one dry run per distinct applicant, outside the caller's run (no run log, trace or state records)
+    standin = StandIn()
+    client = standin_client(standin=standin)
+    for index in list(distinct.values())[:PREFLIGHT_DRY_RUNS]:
+        seed = seeds[index] if index < len(seeds) else None
+        outcome = contextvars.Context().run(run_policy, client, applicants.row(index), steps_to_run, index + 1,
+                                            workflow_path=workflow_path, seed=seed)
+        report["policies"] += 1
+        if outcome["status"] != "completed":
+            failure = outcome.get("failure") or {}
+            detail = f"{failure['error']}: " if failure.get("error") else ""
+            problems.append(f"policy #{index + 1} at {outcome.get('step')}: {detail}{outcome['message']}")
+    for rejected in standin.problems:
+        problems.extend(f"{rejected['kind']} payload {p}" for p in rejected["problems"])
+
+    report.update(ok=not problems, requests=standin.requests, seconds=round(time.perf_counter() - start, 4))
+    if problems:
+        logger.warning(f"🛫 Preflight found {len(problems)} problem(s): {'; '.join(problems[:5])}")
+    else:
+        logger.info(f"🛫 Preflight passed: {report['policies']} dry-run policies, {report['requests']} requests "
+                    f"in {report['seconds']}s")
+    return report
+
+
+# ----------------------------
+# Dry run
+# ----------------------------
+
+def dry_run(user_input: Dict[str, Any], steps_to_run: List[str], num_policies: int, concurrency: int = 1,
+            workflow_path: str = DEFAULT_WORKFLOW, seeds: Optional[List[Dict[str, Any]]] = None,
+            standin: Optional[StandIn] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Run the whole batch against the local stand-in, exactly as a real run
+    would (run_concurrent when concurrency > 1), yielding each outcome.
+    Rejected payloads are kept on standin.problems.
+    """
+    client = standin_client(max(1, concurrency), standin)
+    if concurrency > 1 and num_policies > 1:
+        yield from run_concurrent(client, user_input, steps_to_run, num_policies, concurrency, workflow_path,
+                                  seeds=seeds)
+        return
+    applicants = precompute_batch(user_input, num_policies)
+    seeds = seeds or [None] * num_policies
+    for i in range(num_policies):
+        yield run_policy(client, applicants.row(i), steps_to_run, i + 1, workflow_path=workflow_path, seed=seeds[i])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check a batch before running it against the API")
+    parser.add_argument("--effective-date", required=True, help="YYYY-MM-DD")
+    parser.add_argument("--first-name", required=True)
+    parser.add_argument("--last-name", required=True)
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--phone", required=True)
+    parser.add_argument("--policies", type=int, default=1)
+    parser.add_argument("--workflow", default=DEFAULT_WORKFLOW)
+    parser.add_argument("--steps", nargs="+", default=[
+        "Step 1: To Quote", "Step 2: To Application", "Step 3: To Bound", "Step 4: To Issue"])
+    parser.add_argument("--dry-run", action="store_true",
+                        help="also run the whole batch against the local stand-in")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--synthetic-seed", type=int,
+                        help="generate an applicant and property per policy (see thore_synthetic)")
+    args = parser.parse_args()
+
+    user_input = {
+        "effectiveDate": args.effective_date,
+        "firstName": args.first_name,
+        "lastName": args.last_name,
+        "email": args.email,
+        "phone": args.phone,
+        "numPolicies": args.policies,
+    }
+    if args.synthetic_seed is not None:
+        user_input["syntheticSeed"] = args.synthetic_seed
+    report = preflight(user_input, args.steps, args.policies, args.workflow)
+    if report["ok"] and args.dry_run:
+        start = time.perf_counter()
+        standin = StandIn()
+        tally: Dict[str, int] = {}
+        for outcome in dry_run(user_input, args.steps, args.policies, args.concurrency, args.workflow,
+                               standin=standin):
+            tally[outcome["status"]] = tally.get(outcome["status"], 0) + 1
+        report["dryRun"] = {"statuses": tally, "requests": standin.requests,
+                            "rejectedPayloads": len(standin.problems),
+                            "seconds": round(time.perf_counter() - start, 4)}
+    print(json.dumps(report, indent=2))
+    raise SystemExit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# file: thore_profile.py
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from typing import Dict, Any, List, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = "profiles"
+
+# ----------------------------
+# Run profiler
+# ----------------------------
+
+class RunProfiler:
+    """
+    Opt-in profiler for one run. wrap(run_policy) returns a drop-in
+    replacement that profiles each policy pipeline:
+
+    - a stack sampler sees every thread running a wrapped policy and counts
+      collapsed stacks (root;...;leaf), ready for flamegraph.pl/speedscope;
+    - with deterministic, cProfile also records exact call counts and times
+      (one policy at a time on interpreters that allow a single profiler);
+    - per-step wall and CPU seconds are summed from each outcome's timings.
+
+    stop() writes <run>.prof, <run>.collapsed and <run>.steps.json to out_dir.
+    """
+
+    def __init__(self, run_name: Optional[str] = None, out_dir: str = PROFILE_DIR,
+                 sampling_interval: float = 0.005, deterministic: bool = True):
+        self.run_name = run_name or time.strftime("run-%Y%m%d-%H%M%S")
+        self.out_dir = out_dir
+        self.sampling_interval = sampling_interval
+        self.deterministic = deterministic
+        self.stacks: Counter = Counter()
+        self.steps: Dict[str, Dict[str, float]] = {}
+        self.files: Dict[str, str] = {}
+        self._stats: Optional[pstats.Stats] = None
+        self._threads: set = set()  # idents of threads running a wrapped policy
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started = 0.0
+
+    def start(self) -> "RunProfiler":
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name="thore-profiler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def wrap(self, policy_fn: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        @wraps(policy_fn)
+        def profiled(*args, **kwargs):
+            ident = threading.get_ident()
+            profile = cProfile.Profile() if self.deterministic else None
+            if profile is not None:
+                try:
+                    profile.enable()
+                except ValueError:
+                    # another policy holds the interpreter's profiler; sampling still covers this one
+                    profile = None
+            with self._lock:
+                self._threads.add(ident)
+            try:
+                outcome = policy_fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._threads.discard(ident)
+                if profile is not None:
+                    profile.disable()
+                    self._merge(profile)
+            self.record_outcome(outcome)
+            return outcome
+        return profiled
+
+    def record_outcome(self, outcome: Dict[str, Any]) -> None:
+        with self._lock:
+            for step, (wall, cpu) in (outcome.get("timings") or {}).items():
+                totals = self.steps.setdefault(step, {"calls": 0, "wall": 0.0, "cpu": 0.0})
+                totals["calls"] += 1
+                totals["wall"] += wall
+                totals["cpu"] += cpu
+
+    def step_table(self) -> List[Dict[str, Any]]:
+        """Per-step totals, most CPU first; network wait is wall minus CPU."""
+        with self._lock:
+            rows = [
+                {
+                    "step": step,
+                    "calls": t["calls"],
+                    "wallSeconds": round(t["wall"], 3),
+                    "cpuSeconds": round(t["cpu"], 3),
+                    "waitSeconds": round(t["wall"] - t["cpu"], 3),
+                    "cpuShare": round(t["cpu"] / t["wall"], 3) if t["wall"] else 0.0,
+                }
+                for step, t in self.steps.items()
+            ]
+        return sorted(rows, key=lambda row: row["cpuSeconds"], reverse=True)
+
+    def stop(self) -> Dict[str, str]:
+        """Stop sampling and write the profile files; returns their paths."""
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, self.run_name)
+
+        if self._stats is not None:
+            self._stats.dump_stats(base + ".prof")
+            self.files["prof"] = base + ".prof"
+
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.files["collapsed"] = base + ".collapsed"
+
+        with open(base + ".steps.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "run": self.run_name,
+                "seconds": round(time.perf_counter() - self._started, 3),
+                "samples": sum(self.stacks.values()),
+                "samplingInterval": self.sampling_interval,
+                "steps": self.step_table(),
+            }, f, indent=2)
+        self.files["steps"] = base + ".steps.json"
+
+        logger.info(f"📊 Profile of {self.run_name} written to {self.out_dir}: {', '.join(self.files.values())}")
+        return self.files
+
+    def _merge(self, profile: cProfile.Profile) -> None:
+        profile.create_stats()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.sampling_interval):
+            with self._lock:
+                threads = set(self._threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[";".join(stack)] += 1
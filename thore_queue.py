@@ -0,0 +1,356 @@
+# file: thore_queue.py
+import argparse
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Iterator, Optional, Tuple
+
+from thore_client import ThoreAPIClient
+from thore_failures import classify_failure
+from thore_runner import run_policy
+from thore_steps_extended import scratch_state
+from thore_workflow import DEFAULT_WORKFLOW, get_compiled_workflow
+from thore_runs import attach_worker_log, detach_worker_log
+from thore_precompute import precompute_batch
+from thore_state import STATE, RunState, StateStore
+
+logger = logging.getLogger(__name__)
+
+QUEUE_FILE = "thore_queue.db"
+# Claims of one job (the first run plus re-claims after expired leases) before it is dead-lettered
+MAX_ATTEMPTS = 3
+
+# ----------------------------
+# SQLite-backed work queue
+# ----------------------------
+
+class SQLiteWorkQueue:
+    """
+    Shared work list of policy specs. The coordinator enqueues one job per
+    policy; worker processes on the same host claim jobs, report checkpoints
+    while they run and store the outcome. The file must be on a local disk:
+    WAL mode uses shared memory between the processes, which NFS/SMB mounts
+    do not provide, so workers on other machines cannot share it.
+    A claimed job whose lease expires is handed to the next worker, which
+    resumes it after its last checkpoint; after max_attempts claims it is
+    given up on (status dead).
+    """
+
+    def __init__(self, path: str = QUEUE_FILE, lease_seconds: int = 900, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    run_id TEXT NOT NULL,
+                    policy_run INTEGER NOT NULL,
+                    spec TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    leased_until REAL,
+                    checkpoint_step TEXT,
+                    checkpoint TEXT,
+                    outcome TEXT,
+                    finished_seq INTEGER,
+                    updated_at TEXT
+                )
+                """
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "finished_seq" not in columns:  # queue files from before outcomes were read incrementally
+                conn.execute("ALTER TABLE jobs ADD COLUMN finished_seq INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, leased_until)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_run ON jobs (run_id, status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (run_id, finished_seq)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit mode; transactions are opened explicitly where needed
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def enqueue(self, run_id: str, specs: List[Dict[str, Any]]) -> int:
+        """Add one job per spec (each spec needs a policyRun)."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO jobs (run_id, policy_run, spec, updated_at) VALUES (?, ?, ?, ?)",
+                [(run_id, spec["policyRun"], json.dumps(spec), self._now()) for spec in specs],
+            )
+            conn.execute("COMMIT")
+        logger.info(f"Enqueued {len(specs)} jobs for run {run_id}")
+        return len(specs)
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Atomically lease the next pending (or abandoned) job, or return None."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """
+                SELECT id, run_id, spec, checkpoint_step, checkpoint, attempts FROM jobs
+                WHERE status = 'pending' OR (status = 'running' AND leased_until < ?)
+                ORDER BY id LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                """
+                UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1,
+                    leased_until = ?, updated_at = ? WHERE id = ?
+                """,
+                (worker_id, now + self.lease_seconds, self._now(), row[0]),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return {
+            "jobId": row[0],
+            "runId": row[1],
+            "spec": json.loads(row[2]),
+            "checkpointStep": row[3],
+            "checkpoint": json.loads(row[4]) if row[4] else None,
+            "attempts": row[5] + 1,
+        }
+
+    def checkpoint(self, job_id: int, step: str, state: Dict[str, Any]) -> None:
+        """Record the last completed step and renew the lease."""
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE jobs SET checkpoint_step = ?, checkpoint = ?, leased_until = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (step, json.dumps(state), time.time() + self.lease_seconds, self._now(), job_id),
+            )
+
+    def complete(self, job_id: int, outcome: Dict[str, Any], status: Optional[str] = None) -> None:
+        """Store the outcome (status done, failed, or as given) in the order jobs finish."""
+        status = status or ("done" if outcome.get("status") == "completed" else "failed")
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """
+                UPDATE jobs SET status = ?, outcome = ?, leased_until = NULL, updated_at = ?,
+                    finished_seq = (SELECT COALESCE(MAX(finished_seq), 0) + 1 FROM jobs)
+                WHERE id = ?
+                """,
+                (status, json.dumps(outcome), self._now(), job_id),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def counts(self, run_id: str) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE run_id = ? GROUP BY status", (run_id,)
+            ).fetchall()
+        return {status: n for status, n in rows}
+
+    def outcomes(self, run_id: str, after: int = 0) -> List[Dict[str, Any]]:
+        """
+        Finished outcomes for a run in the order they finished, only those
+        after finishedSeq `after` (the last one seen) if given.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT id, finished_seq, outcome FROM jobs
+                WHERE run_id = ? AND finished_seq > ?
+                ORDER BY finished_seq
+                """,
+                (run_id, after),
+            ).fetchall()
+        return [dict(json.loads(outcome), jobId=job_id, finishedSeq=seq) for job_id, seq, outcome in rows]
+
+
+# ----------------------------
+# Coordinator
+# ----------------------------
+
+def enqueue_run(queue: SQLiteWorkQueue, user_input: Dict[str, Any], steps_to_run: List[str],
+                num_policies: int, run_id: Optional[str] = None, workflow_path: str = DEFAULT_WORKFLOW,
+                run_dir: Optional[str] = None, run_deadline: Optional[float] = None,
+                seeds: Optional[List[Dict[str, Any]]] = None, state_path: Optional[str] = None) -> str:
+    """
+    Enqueue one job per policy and return the run ID. With run_dir, workers
+    log each job of this run to their own shard in run_dir/logs (paths are
+    stored absolute, so workers started elsewhere on the host find them). Jobs still
+    queued at run_deadline (wall-clock) are reported as timed out by workers.
+    seeds[i] pre-fills the ctx of policy i + 1 (see run_policy). With
+    state_path, workers record the run's policies in that state store.
+    """
+    run_id = run_id or uuid.uuid4().hex[:12]
+    run_dir = os.path.abspath(run_dir) if run_dir else None
+    state_path = os.path.abspath(state_path) if state_path else None
+    applicants = precompute_batch(user_input, num_policies)
+    seeds = seeds or [None] * num_policies
+    specs = [
+        {"policyRun": i + 1, "userInput": applicants.row(i), "stepsToRun": list(steps_to_run), "workflowPath": workflow_path,
+         "runDir": run_dir, "runDeadline": run_deadline, "seed": seeds[i], "statePath": state_path}
+        for i in range(num_policies)
+    ]
+    queue.enqueue(run_id, specs)
+    return run_id
+
+
+def wait_for_run(queue: SQLiteWorkQueue, run_id: str, poll_interval: float = 2.0) -> Iterator[Dict[str, Any]]:
+    """Yield each policy outcome as workers report it, until the run is drained."""
+    last = 0
+    while True:
+        for outcome in queue.outcomes(run_id, last):
+            last = outcome["finishedSeq"]
+            yield outcome
+        counts = queue.counts(run_id)
+        if not counts.get("pending") and not counts.get("running"):
+            return
+        time.sleep(poll_interval)
+
+
+# ----------------------------
+# Worker
+# ----------------------------
+
+def _resume_point(spec: Dict[str, Any], checkpoint_step: Optional[str]) -> Tuple[List[str], Optional[str]]:
+    """
+    (stages to run, step to resume at) for a job whose last completed step
+    is checkpoint_step. No stages are left when that was the final step:
+    the policy only has to be reported from its checkpointed state.
+    """
+    stages = list(spec["stepsToRun"])
+    if checkpoint_step is None:
+        return stages, None
+    names = [step.name for step in get_compiled_workflow(spec.get("workflowPath", DEFAULT_WORKFLOW), tuple(stages))]
+    if checkpoint_step not in names:
+        logger.warning(f"Checkpointed step {checkpoint_step} is not in the workflow any more; starting over")
+        return stages, None
+    following = names[names.index(checkpoint_step) + 1:]
+    return (stages, following[0]) if following else ([], None)
+
+
+def _abandoned(job: Dict[str, Any], resume_from: Optional[str], max_attempts: int) -> Dict[str, Any]:
+    """Failed outcome of a job given up on, resumable from its checkpoint like any other failure."""
+    spec = job["spec"]
+    state = dict(job["checkpoint"] or spec.get("seed") or {})
+    message = f"Lease expired {max_attempts} times (last checkpoint: {job['checkpointStep'] or 'none'})"
+    outcome = {"policyRun": spec["policyRun"], "status": "error", "message": message, "step": resume_from,
+               "result": None, "timings": state.get("timings", {})}
+    outcome["failure"] = classify_failure(outcome)
+    outcome["resume"] = {
+        "userInput": spec["userInput"], "stepsToRun": spec["stepsToRun"],
+        "workflowPath": spec.get("workflowPath", DEFAULT_WORKFLOW), "step": resume_from,
+        "state": {k: v for k, v in state.items() if k != "scratch"}, "scratch": state.get("scratch") or {},
+    }
+    return outcome
+
+
+def run_worker(queue: SQLiteWorkQueue, worker_id: Optional[str] = None,
+               idle_timeout: Optional[float] = None, poll_interval: float = 2.0) -> int:
+    """
+    Pull jobs until the queue stays empty for idle_timeout seconds
+    (forever if None). Returns the number of jobs processed.
+    A job re-claimed after its lease expired resumes after its last
+    checkpoint, with that checkpoint's state and idempotency keys, so steps
+    already done (e.g. the create) are not sent again. Past the queue's
+    max_attempts it is stored as dead with a failed outcome instead, which
+    the coordinator dead-letters like any other failure.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    client = ThoreAPIClient()
+    client.authenticate()
+    logger.info(f"Worker {worker_id} started on {queue.path}")
+
+    stores: Dict[str, StateStore] = {}
+    processed = 0
+    idle_since = time.time()
+    while True:
+        job = queue.claim(worker_id)
+        if job is None:
+            if idle_timeout is not None and time.time() - idle_since >= idle_timeout:
+                logger.info(f"Worker {worker_id} idle, exiting after {processed} jobs")
+                return processed
+            time.sleep(poll_interval)
+            continue
+
+        spec = job["spec"]
+        stages, resume_from = _resume_point(spec, job["checkpointStep"])
+        if stages and job["attempts"] > queue.max_attempts:
+            logger.error(f"☠️ Policy #{spec['policyRun']} of run {job['runId']} given up after "
+                         f"{queue.max_attempts} expired leases")
+            queue.complete(job["jobId"], _abandoned(job, resume_from, queue.max_attempts), status="dead")
+            continue
+        if job["checkpointStep"]:
+            logger.info(f"Worker {worker_id} resuming policy #{spec['policyRun']} of run {job['runId']} "
+                        f"after {job['checkpointStep']} (attempt {job['attempts']})")
+
+        shard = attach_worker_log(spec["runDir"]) if spec.get("runDir") else None
+        state_token = None
+        if spec.get("statePath"):
+            if spec["statePath"] not in stores:
+                stores[spec["statePath"]] = StateStore(spec["statePath"])
+            state_token = STATE.set(RunState(stores[spec["statePath"]], job["runId"]))
+        try:
+            logger.info(f"Worker {worker_id} running policy #{spec['policyRun']} of run {job['runId']}")
+            outcome = run_policy(
+                client,
+                spec["userInput"],
+                stages,
+                spec["policyRun"],
+                # the scratch data goes with the state so a re-claim can resume mid-workflow
+                checkpoint=lambda step, state: queue.checkpoint(job["jobId"], step,
+                                                                dict(state, scratch=scratch_state())),
+                workflow_path=spec.get("workflowPath", DEFAULT_WORKFLOW),
+                run_deadline=spec.get("runDeadline"),
+                seed=job["checkpoint"] or spec.get("seed"),
+                resume_from=resume_from,
+            )
+            queue.complete(job["jobId"], outcome)
+        finally:
+            if state_token is not None:
+                STATE.reset(state_token)
+            if shard:
+                detach_worker_log(shard)
+        processed += 1
+        idle_since = time.time()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Thore policy work queue (workers on one host)")
+    parser.add_argument("--db", default=QUEUE_FILE, help="queue database file, on a local disk")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    worker = sub.add_parser("worker", help="pull and run queued policies")
+    worker.add_argument("--id", dest="worker_id")
+    worker.add_argument("--idle-timeout", type=float, default=None)
+
+    status = sub.add_parser("status", help="show job counts for a run")
+    status.add_argument("run_id")
+
+    args = parser.parse_args()
+    queue = SQLiteWorkQueue(args.db)
+    if args.command == "worker":
+        run_worker(queue, args.worker_id, args.idle_timeout)
+    else:
+        print(json.dumps(queue.counts(args.run_id), indent=2))
+
+
+if __name__ == "__main__":
+    main()
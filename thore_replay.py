@@ -0,0 +1,284 @@
+# file: thore_replay.py
+import argparse
+import atexit
+import base64
+import glob
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Tuple, Callable
+
+import requests
+
+from thore_client import BASE_URL, IS_MAIN_PROCESS, ThoreAPIClient, build_response
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_FILE = "thore_cassette.jsonl.gz"
+
+# Response headers that carry credentials; never written to a cassette
+REDACTED_HEADERS = {"token", "set-cookie", "authorization"}
+REDACTED = "REDACTED"
+
+# Instance ID filter of a batched list query (see thore_batch)
+_IDS = re.compile(r"([?&]ids=)([\d,]+)")
+
+# ----------------------------
+# Cassette helpers
+# ----------------------------
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _key(method: str, url: str) -> Tuple[str, str]:
+    """Replay key: method plus the URL without base URL and credentials, with ids= sorted."""
+    if url.startswith(BASE_URL):
+        url = url[len(BASE_URL):]
+    url = re.sub(r"(application=)[^&]*", r"\1" + REDACTED, url)
+    url = _IDS.sub(lambda m: m.group(1) + ",".join(sorted(m.group(2).split(","), key=int)), url)
+    return method.upper(), url
+
+
+def _shard_path(path: str, shard: str) -> str:
+    """thore_cassette.jsonl.gz -> thore_cassette.<shard>.jsonl.gz"""
+    directory, name = os.path.split(path)
+    stem, dot, ext = name.partition(".")
+    return os.path.join(directory, f"{stem}.{shard}{dot}{ext}")
+
+
+# ----------------------------
+# Record
+# ----------------------------
+
+class CassetteWriter:
+    """Appends one JSON line per request/response pair (thread-safe)."""
+
+    def __init__(self, path: str):
+        # Worker processes record into their own shard next to the main cassette
+        self.path = path if IS_MAIN_PROCESS else _shard_path(path, str(os.getpid()))
+        self._lock = threading.Lock()
+        self._file = _open(self.path, "a")
+        atexit.register(self.close)
+        logger.info(f"Recording HTTP traffic to {self.path}")
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def write(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+
+class RecordingTransport:
+    """Sends through the real session and records each exchange and its timing."""
+
+    def __init__(self, send: Callable[..., requests.Response], writer: CassetteWriter):
+        self.send = send
+        self.writer = writer
+
+    def __call__(self, method: str, url: str, **kwargs) -> requests.Response:
+        method_key, url_key = _key(method, url)
+        entry: Dict[str, Any] = {"method": method_key, "url": url_key}
+        start = time.perf_counter()
+        try:
+            resp = self.send(method, url, **kwargs)
+        except requests.RequestException as e:
+            entry.update(elapsed=round(time.perf_counter() - start, 4), error=type(e).__name__)
+            self.writer.write(entry)
+            raise
+        entry.update(
+            elapsed=round(time.perf_counter() - start, 4),
+            status=resp.status_code,
+            headers={
+                k: (REDACTED if k.lower() in REDACTED_HEADERS else v)
+                for k, v in resp.headers.items()
+            },
+        )
+        try:
+            entry["body"] = resp.content.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["body_b64"] = base64.b64encode(resp.content).decode("ascii")
+        self.writer.write(entry)
+        return resp
+
+
+# ----------------------------
+# Replay
+# ----------------------------
+
+class ReplayTransport:
+    """
+    Serves recorded responses for matching (method, URL) requests in recorded
+    order. speed=1 sleeps the recorded latency, speed=10 a tenth of it and
+    speed=0 not at all. With loop, a request seen more often than recorded
+    cycles through its recordings again. Batched ids= list queries group
+    instances by thread timing, so one never recorded with the same IDs is
+    answered with the instances recorded by the other list queries.
+    """
+
+    def __init__(self, path: str, speed: float = 0.0, loop: bool = True):
+        self.speed = speed
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._recorded: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        files = sorted(set(glob.glob(path) + glob.glob(_shard_path(path, "*"))))
+        for name in files:
+            with _open(name, "r") as f:
+                try:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self._recorded.setdefault((entry["method"], entry["url"]), []).append(entry)
+                except (EOFError, json.JSONDecodeError):
+                    # cassette of a run that was killed mid-write; keep what is complete
+                    logger.warning(f"Cassette {name} is truncated; using the complete entries")
+        if not self._recorded:
+            raise FileNotFoundError(f"No recorded exchanges in {path}")
+        self._queues = {key: deque(entries) for key, entries in self._recorded.items()}
+        self._listed: Dict[int, Dict[str, Any]] = {}
+        for (method, url), entries in self._recorded.items():
+            if method == "GET" and _IDS.search(url):
+                for entry in entries:
+                    items = json.loads(entry["body"]) if entry.get("status") == 200 and entry.get("body") else []
+                    for item in items if isinstance(items, list) else []:
+                        self._listed[item["id"]] = item
+        logger.info(f"Replaying {sum(len(v) for v in self._recorded.values())} exchanges from {len(files)} file(s)")
+
+    def __call__(self, method: str, url: str, **kwargs) -> requests.Response:
+        key = _key(method, url)
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue and self.loop and key in self._recorded:
+                queue = self._queues[key] = deque(self._recorded[key])
+            if not queue and key[0] == "GET" and _IDS.search(key[1]):
+                items = [self._listed[int(i)] for i in _IDS.search(key[1]).group(2).split(",")
+                         if int(i) in self._listed]
+                if items:
+                    queue = deque([{"status": 200, "headers": {"Content-Type": "application/json"},
+                                    "body": json.dumps(items)}])
+            if not queue:
+                raise LookupError(f"No recorded response for {key[0]} {key[1]}")
+            entry = queue.popleft()
+
+        if self.speed > 0:
+            time.sleep(entry.get("elapsed", 0) / self.speed)
+        if entry.get("error"):
+            error = getattr(requests.exceptions, entry["error"], requests.ConnectionError)
+            raise error(f"Replayed {entry['error']} for {method} {url}")
+        if "body_b64" in entry:
+            content = base64.b64decode(entry["body_b64"])
+        else:
+            content = entry.get("body", "").encode("utf-8")
+        return build_response(entry["status"], entry.get("headers"), content, url)
+
+
+_writers: Dict[str, CassetteWriter] = {}
+_replays: Dict[Tuple[str, float], ReplayTransport] = {}
+
+
+def transport_from_env(session: requests.Session) -> Callable[..., requests.Response]:
+    """
+    Build the transport selected by THORE_HTTP_MODE (record or replay), with
+    THORE_CASSETTE as the cassette path and THORE_REPLAY_SPEED as the replay
+    speed. Clients in one process share the cassette.
+    """
+    mode = os.getenv("THORE_HTTP_MODE", "").lower()
+    path = os.getenv("THORE_CASSETTE", CASSETTE_FILE)
+    if mode == "record":
+        if path not in _writers:
+            _writers[path] = CassetteWriter(path)
+        return RecordingTransport(session.request, _writers[path])
+    if mode == "replay":
+        speed = float(os.getenv("THORE_REPLAY_SPEED", "0"))
+        if (path, speed) not in _replays:
+            _replays[(path, speed)] = ReplayTransport(path, speed)
+        return _replays[(path, speed)]
+    raise ValueError(f"Unknown THORE_HTTP_MODE {mode!r}; use record or replay")
+
+
+# ----------------------------
+# Offline benchmark
+# ----------------------------
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the policy pipeline against a recorded cassette")
+    parser.add_argument("--cassette", default=CASSETTE_FILE)
+    parser.add_argument("--policies", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--speed", type=float, default=0.0, help="0 = no latency, 1 = recorded latency")
+    parser.add_argument("--steps", nargs="+", default=[
+        "Step 1: To Quote", "Step 2: To Application", "Step 3: To Bound", "Step 4: To Issue"])
+    parser.add_argument("--profile", action="store_true", help="profile the run (see thore_profile.py)")
+    parser.add_argument("--budget", type=float, default=None, help="run time budget in seconds")
+    parser.add_argument("--trace", default=None, help="write OTLP/JSON spans to this file")
+    parser.add_argument("--autotune", default=None, metavar="REPORT",
+                        help="tune concurrency (up to --concurrency) and write the report to this file")
+    args = parser.parse_args()
+
+    from thore_runner import run_policy, run_concurrent
+    from thore_profile import RunProfiler
+    from thore_precompute import precompute_batch
+    from thore_tracing import set_process_tracer
+    from thore_autotune import ConcurrencyAutotuner
+
+    tracer = set_process_tracer(args.trace) if args.trace else None
+
+    profiler = RunProfiler("replay-" + time.strftime("%Y%m%d-%H%M%S")).start() if args.profile else None
+    policy_fn = profiler.wrap(run_policy) if profiler else run_policy
+
+    user_input = {
+        "effectiveDate": time.strftime("%Y-%m-%d"),
+        "firstName": "Replay",
+        "lastName": "Bench",
+        "email": "replay@example.com",
+        "phone": "5555555555",
+        "numPolicies": args.policies,
+    }
+    client = ThoreAPIClient(pool_size=args.concurrency, transport=ReplayTransport(args.cassette, args.speed))
+    client.authenticate()
+
+    start = time.perf_counter()
+    run_deadline = time.time() + args.budget if args.budget else None
+    autotuner = ConcurrencyAutotuner(max_concurrency=args.concurrency) if args.autotune else None
+    if args.concurrency > 1:
+        outcomes = list(run_concurrent(client, user_input, args.steps, args.policies, args.concurrency,
+                                       policy_fn=policy_fn, run_deadline=run_deadline, autotuner=autotuner))
+    else:
+        applicants = precompute_batch(user_input, args.policies)
+        outcomes = [policy_fn(client, applicants.row(i), args.steps, i + 1, run_deadline=run_deadline)
+                    for i in range(args.policies)]
+    elapsed = time.perf_counter() - start
+    if profiler:
+        profiler.stop()
+    if tracer:
+        tracer.flush()
+    if autotuner:
+        autotuner.write_report(args.autotune)
+
+    completed = sum(1 for o in outcomes if o["status"] == "completed")
+    print(json.dumps({
+        "policies": args.policies,
+        "completed": completed,
+        "timedOut": sum(1 for o in outcomes if o["status"] == "timed_out"),
+        "seconds": round(elapsed, 3),
+        "policiesPerSecond": round(args.policies / elapsed, 2) if elapsed else None,
+        "profile": profiler.files if profiler else None,
+        "trace": args.trace,
+        "concurrency": autotuner.chosen if autotuner else args.concurrency,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# file: thore_runner.py
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from typing import Dict, Any, List, Iterator, Optional, Callable
+
+from thore_client import ThoreAPIClient, DeadlineExceeded, VERSIONS, deadline_at
+from thore_batch import BatchResolver
+from thore_runs import bind, attach_worker_log, release_inherited_logs
+from thore_precompute import precompute_batch, applicant_row
+from thore_workflow import DEFAULT_WORKFLOW, get_compiled_workflow, execute_workflow
+from thore_tracing import TRACER, span, set_process_tracer
+from thore_failures import classify_failure
+from thore_steps_extended import scratch_state, restore_scratch_state
+from thore_autotune import ConcurrencyAutotuner
+from thore_state import STATE, RunState, set_process_state
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Single policy pipeline
+# ----------------------------
+
+def run_policy(client: ThoreAPIClient, user_input: Dict[str, Any], steps_to_run: List[str], policy_run: int,
+               checkpoint: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+               workflow_path: str = DEFAULT_WORKFLOW, run_deadline: Optional[float] = None,
+               seed: Optional[Dict[str, Any]] = None, resume_from: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Run the selected stages of the workflow definition for one policy.
+    Returns an outcome dict: policyRun, status (completed, bind_failed,
+    issue_failed, timed_out or error), message, the failed step if any, per-step
+    [wall, cpu] seconds under "timings" and the summary entry under "result".
+    A failed outcome also has "failure" (see thore_failures.classify_failure)
+    and "resume", everything needed to run it again from the failed step
+    (see thore_deadletter).
+    If given, checkpoint(step, state) is called after each completed step.
+    When the run is recorded (thore_state.STATE), every completed step and
+    the outcome also go to the state store.
+    user_input may be a precomputed applicant row (see thore_precompute);
+    a raw form input is derived here. run_deadline is the wall-clock time
+    (time.time()) at which the run's budget ends; the policy is cut off with
+    status timed_out when it or a step deadline runs out. seed pre-fills the
+    ctx, e.g. the instanceId/policytermId of an existing policy for the
+    follow-on transaction workflows (see thore_transactions), or the state
+    of a failed run together with resume_from, the step to restart at.
+    """
+    outcome = {"policyRun": policy_run, "status": "completed", "message": "", "result": None}
+    workflow = get_compiled_workflow(workflow_path, tuple(steps_to_run))
+    ctx: Dict[str, Any] = {"userInput": applicant_row(user_input), **(seed or {})}
+    if "scratch" in ctx:
+        restore_scratch_state(ctx.pop("scratch"))
+    state = STATE.get()
+    if state is not None:
+        checkpoint = _recording(state, policy_run, checkpoint)
+    # instance versions seen by this policy, kept in ctx so a resumed run starts from them
+    versions_token = VERSIONS.set(ctx.setdefault("versions", {}))
+    try:
+        with span("policy", **{"thore.policy_run": policy_run}) as policy_span, deadline_at(run_deadline):
+            if policy_span:
+                outcome["traceId"] = policy_span.trace_id
+            failure = execute_workflow(client, workflow, ctx, checkpoint, resume_from)
+        if failure:
+            logger.warning(f"Policy #{policy_run} stopped at {failure['step']}: {failure['message']}")
+            outcome.update(status=failure["status"], message=failure["message"], step=failure["step"])
+            outcome["failure"] = classify_failure(failure)
+            return outcome
+
+        details = ctx["details"]
+        outcome["result"] = {
+            "policyRun": policy_run,
+            "instanceId": details["instanceId"],
+            "policyNumber": details.get("policyNumber"),
+            "transactionNumber": details.get("transactionNumber"),
+            "resourceIdentifier": details.get("resourceIdentifier"),
+            "policytermId": ctx.get("policytermId"),
+        }
+    except DeadlineExceeded as e:
+        logger.warning(f"⏱️ Policy #{policy_run} cut off in {ctx.get('step')}: {e}")
+        outcome.update(status="timed_out", message=str(e), step=ctx.get("step"))
+        outcome["failure"] = classify_failure(outcome, e)
+    except Exception as e:
+        logger.exception(f"❌ Unexpected error for policy #{policy_run} in {ctx.get('step')}")
+        outcome.update(status="error", message=str(e), step=ctx.get("step"))
+        outcome["failure"] = classify_failure(outcome, e)
+    finally:
+        VERSIONS.reset(versions_token)
+        outcome["timings"] = ctx.get("timings", {})
+        if outcome["status"] != "completed":
+            outcome["resume"] = {
+                "userInput": ctx["userInput"],
+                "stepsToRun": list(steps_to_run),
+                "workflowPath": workflow_path,
+                "step": ctx.get("step"),
+                "state": {k: v for k, v in ctx.items() if k not in ("userInput", "timings", "step")},
+                "scratch": scratch_state(),
+            }
+        if state is not None:
+            state.policy_finished(outcome)
+    return outcome
+
+
+def _recording(state: RunState, policy_run: int, checkpoint: Optional[Callable[[str, Dict[str, Any]], None]]):
+    """checkpoint that also records the step (with the thread's scratch state) in the state store."""
+    def record(step: str, step_state: Dict[str, Any]) -> None:
+        state.checkpoint(policy_run, step, dict(step_state, scratch=scratch_state()))
+        if checkpoint:
+            checkpoint(step, step_state)
+    return record
+
+
+# ----------------------------
+# Concurrent policies on one client
+# ----------------------------
+
+def run_concurrent(client: ThoreAPIClient, user_input: Dict[str, Any], steps_to_run: List[str], num_policies: int,
+                   concurrency: int, workflow_path: str = DEFAULT_WORKFLOW,
+                   policy_fn: Callable[..., Dict[str, Any]] = run_policy,
+                   run_deadline: Optional[float] = None,
+                   seeds: Optional[List[Dict[str, Any]]] = None,
+                   autotuner: Optional[ConcurrencyAutotuner] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Run policies in waves of `concurrency` threads sharing one client.
+    The PolicyTerm and detail lookups of a wave are coalesced by a
+    BatchResolver. policy_fn replaces run_policy (e.g. a profiler-wrapped
+    one). Each policy runs in the caller's context, so its log records stay
+    with the caller's run (see thore_runs). seeds[i] is the seed of policy
+    i + 1 (see run_policy). With an autotuner, `concurrency` is ignored
+    and the tuner sets how many run at once. Yields each outcome as it
+    finishes.
+    """
+    applicants = precompute_batch(user_input, num_policies)
+    seeds = seeds or [None] * num_policies
+    jobs = [
+        {"user_input": applicants.row(i), "steps_to_run": steps_to_run, "policy_run": i + 1,
+         "workflow_path": workflow_path, "run_deadline": run_deadline, "seed": seeds[i]}
+        for i in range(num_policies)
+    ]
+    yield from run_jobs(client, jobs, concurrency, policy_fn, autotuner)
+
+
+def run_jobs(client: ThoreAPIClient, jobs: List[Dict[str, Any]], concurrency: int,
+             policy_fn: Callable[..., Dict[str, Any]] = run_policy,
+             autotuner: Optional[ConcurrencyAutotuner] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Run policy_fn(client, **job) for each job dict (run_policy keyword
+    arguments) on `concurrency` threads, as run_concurrent does for a batch.
+    With an autotuner, up to autotuner.max_concurrency threads are started
+    and a job is only submitted while fewer than autotuner.limit run.
+    """
+    if autotuner is not None:
+        concurrency = autotuner.max_concurrency
+        autotuner.attach(client)
+    _acquire_resolver(client, max(2, concurrency))
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="thore-policy") as pool:
+            if autotuner is None:
+                futures = [pool.submit(bind(policy_fn), client, **job) for job in jobs]
+                for future in as_completed(futures):
+                    yield future.result()
+            else:
+                pending, running = deque(jobs), set()
+                while pending or running:
+                    while pending and len(running) < autotuner.limit:
+                        running.add(pool.submit(bind(policy_fn), client, **pending.popleft()))
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        outcome = future.result()
+                        autotuner.record_outcome(outcome)
+                        yield outcome
+    finally:
+        if autotuner is not None:
+            autotuner.detach(client)
+        _release_resolver(client)
+
+
+# Guards client.batch_resolver: tenants sharing a client run their jobs at the same time
+_resolver_lock = threading.Lock()
+
+
+def _acquire_resolver(client: ThoreAPIClient, max_batch: int) -> BatchResolver:
+    """The client's batch resolver, created by the first of the run_jobs calls using it."""
+    with _resolver_lock:
+        if client.batch_resolver is None:
+            client.batch_resolver = BatchResolver(client, max_batch=max_batch)
+        client.batch_resolver.users += 1
+        return client.batch_resolver
+
+
+def _release_resolver(client: ThoreAPIClient) -> None:
+    """Close the client's batch resolver once the last run_jobs call using it is done."""
+    with _resolver_lock:
+        resolver = client.batch_resolver
+        resolver.users -= 1
+        if resolver.users:
+            return
+        client.batch_resolver = None
+    logger.info(f"Batch resolver stats: {resolver.stats}")
+    resolver.close()
+
+
+# ----------------------------
+# Process-pool sharding
+# ----------------------------
+
+# Each worker process holds its own authenticated client (and connection pool)
+_worker_client: Optional[ThoreAPIClient] = None
+
+
+def _init_worker(run_dir: Optional[str] = None, trace_path: Optional[str] = None,
+                 state_path: Optional[str] = None, run_id: Optional[str] = None) -> None:
+    global _worker_client
+    release_inherited_logs()
+    if run_dir:
+        attach_worker_log(run_dir)
+    # a forked worker inherits the run's tracer and state; it opens its own instead
+    TRACER.set(None)
+    STATE.set(None)
+    if trace_path:
+        set_process_tracer(trace_path)
+    if state_path and run_id:
+        set_process_state(state_path, run_id)
+    _worker_client = ThoreAPIClient()
+    _worker_client.authenticate()
+    logger.info(f"Worker process {os.getpid()} authenticated.")
+
+
+def _run_in_worker(user_input: Dict[str, Any], steps_to_run: List[str], policy_run: int,
+                   workflow_path: str, run_deadline: Optional[float],
+                   seed: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return run_policy(_worker_client, user_input, steps_to_run, policy_run, workflow_path=workflow_path,
+                      run_deadline=run_deadline, seed=seed)
+
+
+def run_sharded(user_input: Dict[str, Any], steps_to_run: List[str], num_policies: int,
+                workers: Optional[int] = None, workflow_path: str = DEFAULT_WORKFLOW,
+                run_dir: Optional[str] = None, run_deadline: Optional[float] = None,
+                trace_path: Optional[str] = None,
+                seeds: Optional[List[Dict[str, Any]]] = None,
+                state_path: Optional[str] = None, run_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Spread policies 1..num_policies across a pool of worker processes.
+    Yields each policy's outcome (see run_policy) as soon as it finishes,
+    so the caller can merge them into one summary. With run_dir, each
+    worker logs to its own shard in run_dir/logs. With trace_path, each
+    worker writes its spans to a per-process shard of that file. seeds as
+    in run_concurrent. With state_path and run_id, workers record their
+    policies in that state store (see thore_state).
+    """
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, num_policies))
+    logger.info(f"Running {num_policies} policies across {workers} worker processes.")
+    applicants = precompute_batch(user_input, num_policies)
+    seeds = seeds or [None] * num_policies
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(run_dir, trace_path, state_path, run_id)) as pool:
+        futures = {
+            pool.submit(_run_in_worker, applicants.row(i), steps_to_run, i + 1, workflow_path, run_deadline,
+                        seeds[i]): i + 1
+            for i in range(num_policies)
+        }
+        for future in as_completed(futures):
+            policy_run = futures[future]
+            try:
+                yield future.result()
+            except Exception as e:
+                # The worker itself died (e.g. authentication failed)
+                logger.exception(f"❌ Worker failed for policy #{policy_run}")
+                yield {"policyRun": policy_run, "status": "error", "message": str(e), "result": None}
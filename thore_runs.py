@@ -0,0 +1,264 @@
+# file: thore_runs.py
+import argparse
+import contextvars
+import heapq
+import json
+import logging
+import os
+import shutil
+import socket
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Iterator, Optional
+
+from thore_client import SUMMARY_FILE, RESULTS_FILE, LOG_FORMAT
+from thore_tracing import TRACE_FILE, TRACER, Tracer
+from thore_state import STATE, RunState, StateStore
+
+logger = logging.getLogger(__name__)
+
+RUNS_DIR = os.getenv("THORE_RUNS_DIR", "runs")
+RUNS_KEEP = int(os.getenv("THORE_RUNS_KEEP", "50"))
+RUNS_MAX_AGE_DAYS = float(os.getenv("THORE_RUNS_MAX_AGE_DAYS", "30"))
+
+# Run whose directory receives the log records of the current thread/task
+RUN_ID: ContextVar[Optional[str]] = ContextVar("thore_run_id", default=None)
+
+# ----------------------------
+# Per-run output directory
+# ----------------------------
+# runs/<run_id>/
+#   run.json                 run metadata (started, finished, pid, host)
+#   thore_run_results.jsonl  ResultStore
+#   thore_run_summary.*      exports
+#   profiles/                RunProfiler output
+#   logs/main.log            records of this run in the coordinating process
+#   logs/worker-*.log        one shard per worker process
+#   run.log                  all shards merged by timestamp when the run closes
+#   traces.jsonl[.<pid>]     OTLP/JSON spans when traced, one shard per worker process
+
+
+class _RunFilter(logging.Filter):
+    def __init__(self, run_id: str):
+        super().__init__()
+        self.run_id = run_id
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return RUN_ID.get() == self.run_id
+
+
+class RunOutput:
+    """
+    Output directory of one run. While open, records logged in the run's
+    context (see bind) go to logs/main.log; other sessions in the same
+    process keep their own files. With trace, spans of the run's policies
+    and requests go to traces.jsonl (see thore_tracing). With state_path,
+    the run and its policies are recorded in that state store (see
+    thore_state). Use as a context manager or open()/close().
+    """
+
+    def __init__(self, run_id: Optional[str] = None, root: str = RUNS_DIR, trace: bool = False,
+                 state_path: Optional[str] = None):
+        self.run_id = run_id or f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.dir = os.path.join(root, self.run_id)
+        self.log_dir = os.path.join(self.dir, "logs")
+        self.results_path = os.path.join(self.dir, RESULTS_FILE)
+        self.summary_path = os.path.join(self.dir, SUMMARY_FILE)
+        self.profile_dir = os.path.join(self.dir, "profiles")
+        self.trace_path = os.path.join(self.dir, TRACE_FILE) if trace else None
+        self.state_path = state_path
+        self.state: Optional[RunState] = None
+        self._state_token = None
+        self._handler: Optional[logging.Handler] = None
+        self._token = None
+        self._tracer = None
+        self._tracer_token = None
+
+    def open(self) -> "RunOutput":
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._handler = logging.FileHandler(os.path.join(self.log_dir, "main.log"), encoding="utf-8")
+        self._handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        self._handler.addFilter(_RunFilter(self.run_id))
+        logging.getLogger().addHandler(self._handler)
+        self._token = RUN_ID.set(self.run_id)
+        if self.trace_path:
+            self._tracer = Tracer(self.trace_path)
+            self._tracer_token = TRACER.set(self._tracer)
+        if self.state_path:
+            self.state = RunState(StateStore(self.state_path), self.run_id)
+            self.state.store.run_started(self.run_id, {"dir": self.dir, "pid": os.getpid()})
+            self._state_token = STATE.set(self.state)
+        self._write_meta(started=_now(), pid=os.getpid(), host=socket.gethostname())
+        logger.info(f"📁 Run {self.run_id} writing to {self.dir}")
+        return self
+
+    def close(self) -> str:
+        """Detach the run log, merge the log shards and return the merged log path."""
+        if self._handler is not None:
+            logging.getLogger().removeHandler(self._handler)
+            self._handler.close()
+            self._handler = None
+        if self._token is not None:
+            RUN_ID.reset(self._token)
+            self._token = None
+        if self._tracer_token is not None:
+            TRACER.reset(self._tracer_token)
+            self._tracer.flush()
+            self._tracer_token = None
+        if self._state_token is not None:
+            STATE.reset(self._state_token)
+            self.state.store.run_finished(self.run_id)
+            self._state_token = None
+        self._write_meta(finished=_now())
+        return merge_logs(self.dir)
+
+    def __enter__(self) -> "RunOutput":
+        return self.open()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _write_meta(self, **fields) -> None:
+        path = os.path.join(self.dir, "run.json")
+        meta = read_meta(self.dir)
+        meta.update(fields, runId=self.run_id)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+
+def bind(fn):
+    """Run fn in a copy of the caller's context so its log records keep the run ID (for pool threads)."""
+    context = contextvars.copy_context()
+
+    def bound(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+    return bound
+
+
+def read_meta(run_dir: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(run_dir, "run.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# ----------------------------
+# Worker log shards
+# ----------------------------
+
+def attach_worker_log(run_dir: str) -> logging.Handler:
+    """Send this process's records to its own shard in the run's logs/ (never a shared handle)."""
+    log_dir = os.path.join(run_dir, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    shard = os.path.join(log_dir, f"worker-{socket.gethostname()}-{os.getpid()}.log")
+    handler = logging.FileHandler(shard, encoding="utf-8")
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logging.getLogger().addHandler(handler)
+    return handler
+
+
+def release_inherited_logs() -> None:
+    """
+    Drop the file handlers a forked worker inherited from its parent (the
+    process-wide rotating log, the run's log): the parent keeps writing and
+    rotating those files, so the worker must not.
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.FileHandler):
+            root.removeHandler(handler)
+            handler.close()
+
+
+def detach_worker_log(handler: logging.Handler) -> None:
+    logging.getLogger().removeHandler(handler)
+    handler.close()
+
+
+def _records(path: str) -> Iterator[str]:
+    """Log records of one shard; traceback lines stay with their record."""
+    record = ""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            # records start with the asctime date, e.g. "2025-01-31 12:00:00,123"
+            if record and line[:4].isdigit() and line[4:5] == "-":
+                yield record
+                record = ""
+            record += line
+    if record:
+        yield record
+
+
+def merge_logs(run_dir: str) -> str:
+    """Merge logs/*.log into run.log in timestamp order, streaming the shards."""
+    log_dir = os.path.join(run_dir, "logs")
+    shards = sorted(
+        os.path.join(log_dir, name) for name in os.listdir(log_dir) if name.endswith(".log")
+    ) if os.path.isdir(log_dir) else []
+    merged = os.path.join(run_dir, "run.log")
+    with open(merged, "w", encoding="utf-8") as out:
+        for record in heapq.merge(*(_records(path) for path in shards), key=lambda r: r[:23]):
+            out.write(record)
+    return merged
+
+
+# ----------------------------
+# Retention
+# ----------------------------
+
+def cleanup_runs(root: str = RUNS_DIR, keep: int = RUNS_KEEP, max_age_days: float = RUNS_MAX_AGE_DAYS,
+                 exclude: Optional[List[str]] = None) -> List[str]:
+    """
+    Delete finished run directories beyond the newest `keep` or older than
+    max_age_days. Unfinished runs are kept unless they are past the age
+    limit (left behind by a crash). Returns the removed run IDs.
+    """
+    if not os.path.isdir(root):
+        return []
+    exclude = set(exclude or [])
+    runs = sorted(
+        (entry for entry in os.scandir(root) if entry.is_dir() and entry.name not in exclude),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    cutoff = time.time() - max_age_days * 86400
+    removed = []
+    for i, entry in enumerate(runs):
+        too_old = entry.stat().st_mtime < cutoff
+        finished = "finished" in read_meta(entry.path)
+        if too_old or (i >= keep and finished):
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed.append(entry.name)
+    if removed:
+        logger.info(f"🧹 Removed {len(removed)} old run directories from {root}")
+    return removed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage per-run output directories")
+    parser.add_argument("--root", default=RUNS_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    cleanup = sub.add_parser("cleanup", help="apply the retention policy")
+    cleanup.add_argument("--keep", type=int, default=RUNS_KEEP)
+    cleanup.add_argument("--max-age-days", type=float, default=RUNS_MAX_AGE_DAYS)
+
+    merge = sub.add_parser("merge", help="merge a run's log shards into run.log")
+    merge.add_argument("run_id")
+
+    args = parser.parse_args()
+    if args.command == "cleanup":
+        print(json.dumps(cleanup_runs(args.root, args.keep, args.max_age_days), indent=2))
+    else:
+        print(merge_logs(os.path.join(args.root, args.run_id)))
+
+
+if __name__ == "__main__":
+    main()
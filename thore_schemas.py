@@ -0,0 +1,281 @@
+# file: thore_schemas.py
+import re
+from datetime import datetime
+from typing import Dict, Any, List
+
+# ----------------------------
+# Minimal schema validator
+# ----------------------------
+# A subset of JSON Schema (type, required, properties, items, minItems, enum,
+# pattern, minLength, minimum, format date/date-time), enough to catch broken
+# payloads before they reach the API without another dependency.
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def _is_type(value: Any, name: str) -> bool:
+    if name in ("integer", "number") and isinstance(value, bool):
+        return False
+    return isinstance(value, _TYPES[name])
+
+
+def _parses(value: str, fmt: str) -> bool:
+    try:
+        if fmt == "date":
+            datetime.strptime(value, "%Y-%m-%d")
+        else:
+            datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return True
+    except ValueError:
+        return False
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """Problems of value against schema, one "path: problem" string each (empty when valid)."""
+    types = schema.get("type")
+    if types is not None:
+        types = [types] if isinstance(types, str) else types
+        if not any(_is_type(value, name) for name in types):
+            return [f"{path}: expected {' or '.join(types)}, got {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: {value!r} is not one of {schema['enum']}"]
+
+    problems: List[str] = []
+    if isinstance(value, str):
+        if len(value.strip()) < schema.get("minLength", 0):
+            problems.append(f"{path}: must not be empty" if schema["minLength"] == 1
+                            else f"{path}: shorter than {schema['minLength']}")
+        if "pattern" in schema and not re.search(schema["pattern"], value):
+            problems.append(f"{path}: {value!r} does not match {schema['pattern']}")
+        if "format" in schema and not _parses(value, schema["format"]):
+            problems.append(f"{path}: {value!r} is not a valid {schema['format']}")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        if "minimum" in schema and value < schema["minimum"]:
+            problems.append(f"{path}: {value} is below {schema['minimum']}")
+    elif isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                problems.append(f"{path}.{key}: missing")
+        for key, sub in (schema.get("properties") or {}).items():
+            if key in value:
+                problems.extend(validate(value[key], sub, f"{path}.{key}"))
+    elif isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            problems.append(f"{path}: needs at least {schema['minItems']} item(s)")
+        if "items" in schema:
+            for i, item in enumerate(value):
+                problems.extend(validate(item, schema["items"], f"{path}[{i}]"))
+    return problems
+
+
+# ----------------------------
+# Building blocks
+# ----------------------------
+
+TEXT = {"type": "string", "minLength": 1}
+ID = {"type": "integer", "minimum": 1}
+DATE = {"type": "string", "format": "date"}
+DATE_TIME = {"type": "string", "format": "date-time"}
+PHONE = {"type": "string", "pattern": r"^\d{10}$"}
+EMAIL = {"type": "string", "pattern": r"^[^@\s]+@[^@\s]+\.[^@\s]+$"}
+
+NAMED_INSURED = {
+    "type": "object",
+    "required": ["type", "characteristics"],
+    "properties": {
+        "type": {"enum": ["NamedInsured"]},
+        "characteristics": {
+            "type": "object",
+            "required": ["name"],
+            "properties": {
+                "name": {"type": "object", "required": ["firstName", "lastName"],
+                         "properties": {"firstName": TEXT, "lastName": TEXT}},
+                "phones": {"type": "array", "items": {"type": "object", "required": ["number"],
+                                                      "properties": {"number": PHONE}}},
+                "emails": {"type": "array", "items": {"type": "object", "required": ["address"],
+                                                      "properties": {"address": EMAIL}}},
+            },
+        },
+    },
+}
+
+# Rule definitions and workflow actions the override payloads may name, as
+# (ruleDefinitionId, workflowActionDefinitionId) pairs
+KNOWN_RULE_OVERRIDES = {(550, 647), (565, 648), (565, 668), (566, 648), (567, 648)}
+
+# ----------------------------
+# Applicant and payload schemas
+# ----------------------------
+
+# The form input (see app.py)
+FORM_SCHEMA = {
+    "type": "object",
+    "required": ["effectiveDate", "firstName", "lastName", "email", "phone"],
+    "properties": {
+        "effectiveDate": DATE,
+        "firstName": TEXT,
+        "lastName": TEXT,
+        "email": EMAIL,
+        "phone": {"type": "string", "pattern": r"^\D*(\d\D*){10}$"},
+        "syntheticSeed": {"type": "integer", "minimum": 0},
+    },
+}
+
+# A generated property (see thore_synthetic)
+COORDINATE = {"type": "string", "pattern": r"^-?\d{1,3}\.\d{6}$"}
+PROPERTY_SCHEMA = {
+    "type": "object",
+    "required": ["address", "city", "state", "postalCode", "county", "latitude", "longitude", "dwelling",
+                 "squareFootage", "constructionType", "constructedDate", "purchaseDate"],
+    "properties": {
+        "address": TEXT,
+        "city": TEXT,
+        "state": {"enum": ["TX"]},
+        "postalCode": {"type": "string", "pattern": r"^\d{5}$"},
+        "county": TEXT,
+        "latitude": COORDINATE,
+        "longitude": COORDINATE,
+        "distanceToCoast": {"type": "string", "pattern": r"^\d+\.\d{2}$"},
+        "dwelling": {"type": "integer", "minimum": 1},
+        "squareFootage": {"type": "integer", "minimum": 1},
+        "numberOfResidents": {"type": "integer", "minimum": 1},
+        "constructionType": TEXT,
+        "constructedDate": DATE_TIME,
+        "roofInstallationDate": DATE_TIME,
+        "purchaseDate": DATE_TIME,
+    },
+}
+
+# A derived applicant row (see thore_precompute.APPLICANT_FIELDS)
+APPLICANT_SCHEMA = {
+    "type": "object",
+    "required": ["effectiveDate", "effectiveDateIso", "effectiveDateTime", "firstName", "lastName", "displayName",
+                 "phone", "email"],
+    "properties": {
+        "effectiveDate": DATE,
+        "effectiveDateIso": DATE_TIME,
+        "effectiveDateTime": DATE_TIME,
+        "firstName": TEXT,
+        "lastName": TEXT,
+        "displayName": TEXT,
+        "phone": PHONE,
+        "email": EMAIL,
+        "birthDate": DATE_TIME,
+        "property": PROPERTY_SCHEMA,
+    },
+}
+
+
+def _patch_schema(status: str, key_dates: List[str]) -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "required": ["id", "resourceIdentifier", "versionNumber", "data"],
+        "properties": {
+            "id": ID,
+            "resourceIdentifier": TEXT,
+            "versionNumber": {"type": "integer", "minimum": 1},
+            "createDate": DATE_TIME,
+            "data": {
+                "type": "object",
+                "required": ["status", "effectiveDate", "keyDates", "interests"],
+                "properties": {
+                    "status": {"enum": [status]},
+                    "effectiveDate": DATE_TIME,
+                    "keyDates": {"type": "object", "required": key_dates,
+                                 "properties": {name: DATE_TIME for name in key_dates}},
+                    "interests": {"type": "array", "minItems": 1, "items": NAMED_INSURED},
+                    "characteristics": {"type": "object",
+                                        "properties": {"termEffectiveDate": {"type": ["string", "null"],
+                                                                             "format": "date-time"}}},
+                },
+            },
+        },
+    }
+
+
+# Request bodies by payload kind (see thore_standin.payload_kind)
+PAYLOAD_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "create_policy": {
+        "type": "object",
+        "required": ["entityType", "data"],
+        "properties": {
+            "entityType": {"enum": ["PolicyTermTransaction.HOATX"]},
+            "data": {
+                "type": "object",
+                "required": ["effectiveDate", "interests", "termLength"],
+                "properties": {
+                    "effectiveDate": DATE_TIME,
+                    "interests": {"type": "array", "minItems": 1, "items": NAMED_INSURED},
+                    "termLength": {"type": "integer", "minimum": 1},
+                },
+            },
+        },
+    },
+    "patch_pending": _patch_schema("Pending", ["quoteDate", "accountingDate"]),
+    "patch_application": _patch_schema("Application", ["quoteDate", "accountingDate", "convertDate"]),
+    "patch_endorsement": {
+        "type": "object",
+        "required": ["id", "data"],
+        "properties": {
+            "id": ID,
+            "data": {"type": "object", "required": ["interests"],
+                     "properties": {"interests": {"type": "array", "minItems": 1, "items": {"type": "object"}}}},
+        },
+    },
+    "rule_override": {
+        "type": "object",
+        "required": ["instanceId", "ruleDefinitionId", "workflowActionDefinitionId", "reason", "resourceIdentifier"],
+        "properties": {
+            "instanceId": ID,
+            "ruleDefinitionId": {"enum": sorted({rule for rule, _ in KNOWN_RULE_OVERRIDES})},
+            "workflowActionDefinitionId": {"enum": sorted({action for _, action in KNOWN_RULE_OVERRIDES})},
+            "reason": TEXT,
+            "resourceIdentifier": TEXT,
+        },
+    },
+    "start_endorsement": {
+        "type": "object",
+        "required": ["effectiveDate"],
+        "properties": {"effectiveDate": DATE_TIME},
+    },
+    "start_cancellation": {
+        "type": "object",
+        "required": ["effectiveDate", "reasons"],
+        "properties": {
+            "effectiveDate": DATE_TIME,
+            "reasons": {"type": "array", "minItems": 1,
+                        "items": {"type": "object", "required": ["code"], "properties": {"code": TEXT}}},
+        },
+    },
+}
+
+
+def check_payload(kind: str, body: Any) -> List[str]:
+    """Schema problems of a request body plus the cross-field rules a schema cannot express."""
+    schema = PAYLOAD_SCHEMAS.get(kind)
+    if schema is None:
+        return []
+    problems = validate(body, schema)
+    if problems:
+        return problems
+
+    if kind == "rule_override":
+        pair = (body["ruleDefinitionId"], body["workflowActionDefinitionId"])
+        if pair not in KNOWN_RULE_OVERRIDES:
+            problems.append(f"$: rule {pair[0]} cannot be overridden with workflow action {pair[1]}")
+    elif kind in ("patch_pending", "patch_application"):
+        data = body["data"]
+        effective = data["effectiveDate"][:10]
+        term_effective = (data.get("characteristics") or {}).get("termEffectiveDate")
+        if term_effective and term_effective[:10] != effective:
+            problems.append(f"$.data.characteristics.termEffectiveDate: {term_effective[:10]} differs from "
+                            f"the effective date {effective}")
+    return problems
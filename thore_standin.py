@@ -0,0 +1,391 @@
+# file: thore_standin.py
+import argparse
+import email.utils
+import itertools
+import json
+import logging
+import re
+import threading
+import uuid
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from thore_client import build_response, server_now
+from thore_schemas import check_payload
+from thore_versions import apply_patch
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Local stand-in for the Thore API
+# ----------------------------
+# Just enough of the API for the new business, endorsement and cancellation
+# workflows, kept in memory: instances move Quote -> Pending -> Application
+# -> Bound -> Issued, actions check the status they need (409 otherwise),
+# and every request body is checked against thore_schemas (400 with the
+# problems otherwise). Every write to an instance bumps its versionNumber
+# and a PATCH must carry the current one (409 VERSION otherwise), as a field
+# of the body or as a JSON Patch "test" on /versionNumber. IDs the stand-in
+# has not seen (e.g. seeds taken from a real run) are treated as issued
+# policies.
+
+_HOATX = r"/v1/entityInstances/PolicyTermTransaction\.HOATX"
+_TERMS = r"/v1/entityInstances/PolicyTerms"
+
+# action -> (statuses it may run from, status afterwards)
+INSTANCE_ACTIONS = {
+    "RequestVeriskLocationReport": (None, None),
+    "SaveVeriskLocationReport": (None, None),
+    "RequestVeriskAPlusReport": (None, None),
+    "SaveVeriskAPlusReport": (None, None),
+    "ConvertQuoteToApplication": (("Pending",), "Application"),
+    "RequestThoreQuadrinsValidation": (("Application",), None),
+    "TransactionBind": (("Application", "Pending"), "Bound"),
+    "UpdateBinder": (("Bound",), None),
+}
+TERM_ISSUE_ACTIONS = {"IssueNewBusiness": "NewBusiness", "IssueEndorsement": "Endorsement",
+                      "IssueCancellation": "Cancellation"}
+TERM_START_ACTIONS = {"CreateEndorsement": ("Endorsement", "start_endorsement"),
+                      "CreateCancellation": ("Cancellation", "start_cancellation")}
+
+
+class StandIn:
+    """In-memory Thore API. handle() answers one request; thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(900001)
+        self.instances: Dict[int, Dict[str, Any]] = {}
+        self.terms: Dict[int, List[int]] = {}       # PolicyTerm ID -> its transaction instance IDs
+        self.parents: Dict[int, int] = {}            # instance ID -> PolicyTerm ID
+        self.problems: List[Dict[str, Any]] = []     # payloads that failed validation
+        self.requests = 0
+        self.connections = 0                         # sockets accepted when served over HTTP
+
+    # -- state --
+
+    def _new_instance(self, kind: str, data: Dict[str, Any], term_id: Optional[int] = None) -> int:
+        instance_id = next(self._ids)
+        term_id = term_id or next(self._ids)
+        transactions = self.terms.setdefault(term_id, [])
+        data = dict(data)
+        data.update(policyNumber=data.get("policyNumber") or f"HOATX{term_id}",
+                    transactionNumber=len(transactions) + 1, type=kind,
+                    status="Quote" if kind == "NewBusiness" else "Pending")
+        self.instances[instance_id] = {
+            "id": instance_id,
+            "entityType": "PolicyTermTransaction.HOATX",
+            "resourceIdentifier": uuid.uuid4().hex,
+            "versionNumber": 1,
+            "createDate": _server_iso(),
+            "data": data,
+        }
+        transactions.append(instance_id)
+        self.parents[instance_id] = term_id
+        return instance_id
+
+    def _instance(self, instance_id: int) -> Dict[str, Any]:
+        if instance_id not in self.instances:
+            # an ID from elsewhere: an issued new business policy on its own term
+            self.instances[instance_id] = {
+                "id": instance_id, "entityType": "PolicyTermTransaction.HOATX",
+                "resourceIdentifier": uuid.uuid4().hex, "versionNumber": 1, "createDate": _server_iso(),
+                "data": {"policyNumber": f"HOATX{instance_id}", "transactionNumber": 1, "type": "NewBusiness",
+                         "status": "Issued", "interests": [{"type": "NamedInsured", "characteristics": {}}]},
+            }
+            self.parents.setdefault(instance_id, instance_id)
+            self.terms.setdefault(self.parents[instance_id], []).append(instance_id)
+        return self.instances[instance_id]
+
+    def _term(self, term_id: int) -> List[int]:
+        if term_id not in self.terms:
+            self.parents[term_id] = term_id
+            self._instance(term_id)
+        return self.terms[term_id]
+
+    # -- requests --
+
+    def handle(self, method: str, url: str, body: Any = None) -> Tuple[int, Dict[str, str], Any]:
+        """(status, headers, JSON body or None) for one request."""
+        path = urlsplit(url).path
+        with self._lock:
+            self.requests += 1
+            status, headers, payload = self._route(method.upper(), path, url, body)
+        headers = dict(headers, Date=email.utils.formatdate(server_now().timestamp(), usegmt=True))
+        return status, headers, payload
+
+    def _invalid(self, kind: str, method: str, path: str, body: Any) -> Optional[Tuple[int, Dict[str, str], Any]]:
+        problems = check_payload(kind, body)
+        if not problems:
+            return None
+        self.problems.append({"kind": kind, "method": method, "path": path, "problems": problems})
+        logger.warning(f"🧪 Stand-in rejected {kind} payload: {'; '.join(problems)}")
+        return 400, {}, {"description": f"Invalid {kind} payload.",
+                         "messages": [{"code": "SCHEMA", "description": p} for p in problems]}
+
+    def _route(self, method: str, path: str, url: str, body: Any) -> Tuple[int, Dict[str, str], Any]:
+        if method == "POST" and path == "/v1/Authenticate":
+            return 200, {"token": "stand-in"}, {}
+
+        if method == "POST" and re.fullmatch(_HOATX, path):
+            return self._invalid("create_policy", method, path, body) or self._create(body)
+        if method == "GET" and re.fullmatch(_HOATX, path):
+            ids = re.search(r"[?&]ids=([\d,]+)", url)
+            wanted = [int(i) for i in ids.group(1).split(",")] if ids else list(self.instances)
+            return 200, {}, [self._instance(i) for i in wanted]
+
+        match = re.fullmatch(_HOATX + r"/(\d+)(/parents|/actions/(\w+))?", path)
+        if match:
+            instance = self._instance(int(match.group(1)))
+            if match.group(2) == "/parents" and method == "GET":
+                return 200, {}, [{"id": self.parents[instance["id"]]}]
+            if match.group(3) and method == "POST":
+                return self._instance_action(instance, match.group(3))
+            if method == "GET":
+                return 200, {}, instance
+            if method == "PATCH":
+                return self._patch(instance, method, path, body)
+
+        match = re.fullmatch(_TERMS + r"/(\d+)(/children|/actions/(\w+))", path)
+        if match:
+            term_id = int(match.group(1))
+            transactions = self._term(term_id)
+            if match.group(2) == "/children" and method == "GET":
+                return 200, {}, _page(url, [self.instances[i] for i in transactions])
+            if match.group(3) in TERM_START_ACTIONS and method == "POST":
+                kind, payload_kind = TERM_START_ACTIONS[match.group(3)]
+                rejected = self._invalid(payload_kind, method, path, body)
+                if rejected:
+                    return rejected
+                base = self.instances[transactions[0]]["data"]
+                data = {"effectiveDate": body["effectiveDate"], "interests": json.loads(json.dumps(
+                    base.get("interests") or [])), "policyNumber": base.get("policyNumber")}
+                instance_id = self._new_instance(kind, data, term_id)
+                return 201, {"Location": f"/v1/entityInstances/PolicyTermTransaction.HOATX/{instance_id}"}, {}
+            if match.group(3) in TERM_ISSUE_ACTIONS and method == "POST":
+                return self._issue(transactions, TERM_ISSUE_ACTIONS[match.group(3)])
+
+        if re.fullmatch(r"/v1/entityInstances/Organization\.Agencies/\d+/children", path) and method == "GET":
+            return 200, {}, _page(url, list(self.instances.values()))
+        if path == "/v1/entityInstanceRuleViolationOverrides" and method == "POST":
+            return self._invalid("rule_override", method, path, body) or (201, {}, {})
+
+        return 404, {}, {"description": f"Stand-in has no {method} {path}"}
+
+    def _create(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, str], Any]:
+        instance_id = self._new_instance("NewBusiness", body["data"])
+        return 201, {"Location": f"/v1/entityInstances/PolicyTermTransaction.HOATX/{instance_id}"}, {}
+
+    def _patch(self, instance: Dict[str, Any], method: str, path: str, body: Any) -> Tuple[int, Dict[str, str], Any]:
+        if isinstance(body, list):
+            # JSON Patch: its test on /versionNumber stands in for the body's versionNumber
+            tested = [op.get("value") for op in body if op.get("op") == "test" and op.get("path") == "/versionNumber"]
+            if tested and tested[-1] != instance["versionNumber"]:
+                return _version_conflict(instance, tested[-1])
+            try:
+                body = apply_patch(instance, body)
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                return 400, {}, {"description": f"Invalid JSON Patch: {e}"}
+        elif isinstance(body, dict) and body.get("versionNumber") != instance["versionNumber"]:
+            return _version_conflict(instance, body.get("versionNumber"))
+        data = instance["data"]
+        if data["type"] == "Endorsement":
+            kind = "patch_endorsement"
+        else:
+            target = ((body or {}).get("data") or {}).get("status")
+            kind = {"Pending": "patch_pending", "Application": "patch_application"}.get(target, "patch_pending")
+        rejected = self._invalid(kind, method, path, body)
+        if rejected:
+            return rejected
+        allowed = {"patch_pending": ("Quote", "Pending"), "patch_application": ("Application",),
+                   "patch_endorsement": ("Pending",)}[kind]
+        if data["status"] not in allowed:
+            return _conflict(f"Cannot {kind.replace('_', ' ')} an instance in status {data['status']}.")
+        data.update({k: v for k, v in body["data"].items() if k not in ("policyNumber", "transactionNumber", "type")})
+        instance["versionNumber"] += 1
+        return 204, {}, None
+
+    def _instance_action(self, instance: Dict[str, Any], action: str) -> Tuple[int, Dict[str, str], Any]:
+        if action not in INSTANCE_ACTIONS:
+            return 404, {}, {"description": f"Stand-in has no action {action}"}
+        requires, becomes = INSTANCE_ACTIONS[action]
+        data = instance["data"]
+        if requires and data["status"] not in requires:
+            return _conflict(f"{action} needs status {' or '.join(requires)}, instance is {data['status']}.")
+        if becomes:
+            data["status"] = becomes
+            instance["versionNumber"] += 1
+        if action.startswith("Request") and "Verisk" in action:
+            return 200, {}, {"value": {"trackingId": uuid.uuid4().hex}}
+        if action.startswith("Save"):
+            # the saved report is written onto the instance
+            instance["versionNumber"] += 1
+            return 200, {}, {"value": {"item": {"header": {"transactionId": uuid.uuid4().hex}}}}
+        if action == "RequestThoreQuadrinsValidation":
+            return 200, {}, {"value": {"item": {"httpStatusCode": 200, "type": "accept"}, "trackingId": "stand-in"}}
+        return 200, {}, {"value": {"item": {"httpStatusCode": 200}}}
+
+    def _issue(self, transactions: List[int], kind: str) -> Tuple[int, Dict[str, str], Any]:
+        bound = [i for i in transactions if self.instances[i]["data"]["type"] == kind
+                 and self.instances[i]["data"]["status"] == "Bound"]
+        if not bound:
+            return _conflict(f"No bound {kind} transaction to issue on this PolicyTerm.")
+        self.instances[bound[-1]]["data"]["status"] = "Issued"
+        self.instances[bound[-1]]["versionNumber"] += 1
+        return 200, {}, {"value": {"item": {"httpStatusCode": 200}}}
+
+
+def _page(url: str, items: List[Any]) -> List[Any]:
+    """The limit/offset slice of a children list."""
+    query = parse_qs(urlsplit(url).query)
+    offset = int(query.get("offset", ["0"])[0])
+    limit = int(query["limit"][0]) if "limit" in query else len(items)
+    return items[offset:offset + limit]
+
+
+def _conflict(description: str) -> Tuple[int, Dict[str, str], Any]:
+    return 409, {}, {"description": "Action could not be completed.",
+                     "messages": [{"code": "STATUS", "description": description}]}
+
+
+def _version_conflict(instance: Dict[str, Any], sent: Any) -> Tuple[int, Dict[str, str], Any]:
+    return 409, {}, {"description": "Action could not be completed.",
+                     "messages": [{"code": "VERSION",
+                                   "description": f"Instance {instance['id']} is at version "
+                                                  f"{instance['versionNumber']}, the request was made at {sent}."}]}
+
+
+def _server_iso() -> str:
+    return server_now().isoformat(timespec="milliseconds")
+
+
+# ----------------------------
+# As a client transport
+# ----------------------------
+
+class StandInTransport:
+    """ThoreAPIClient transport answering from a StandIn instead of the network (see thore_replay)."""
+
+    def __init__(self, standin: Optional[StandIn] = None):
+        self.standin = standin or StandIn()
+
+    def __call__(self, method: str, url: str, **kwargs) -> requests.Response:
+        body = kwargs.get("json")
+        if body is None and kwargs.get("data"):
+            body = json.loads(kwargs["data"])
+        status, headers, payload = self.standin.handle(method, url, body)
+        content = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        resp = build_response(status, dict(headers, **{"Content-Type": "application/json"}), content, url)
+        resp.reason = HTTPStatus(status).phrase
+        return resp
+
+
+# ----------------------------
+# As an HTTP server
+# ----------------------------
+
+def make_handler(standin: StandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            logger.debug(fmt % args)
+
+        def setup(self):
+            super().setup()
+            with standin._lock:
+                standin.connections += 1
+
+        def _serve(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            try:
+                body = json.loads(raw) if raw else None
+            except ValueError:
+                body = raw.decode("utf-8", errors="replace")
+            status, headers, payload = standin.handle(self.command, self.path, body)
+            content = b"" if payload is None else json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            for name, value in headers.items():
+                if name != "Date":  # send_response already sent one
+                    self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _serve
+
+    return Handler
+
+
+def asgi_app(standin: StandIn):
+    """
+    ASGI application answering from a StandIn, for servers that speak HTTP/2
+    (e.g. hypercorn; see thore_http2). Connections are counted by client address.
+    """
+    peers = set()
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                await send({"type": message["type"] + ".complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+        raw = b""
+        while True:
+            message = await receive()
+            raw += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        with standin._lock:
+            if scope.get("client") not in peers:
+                peers.add(scope.get("client"))
+                standin.connections += 1
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            body = raw.decode("utf-8", errors="replace")
+        query = scope.get("query_string", b"").decode("latin-1")
+        status, headers, payload = standin.handle(scope["method"], scope["path"] + (f"?{query}" if query else ""),
+                                                  body)
+        content = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        headers = dict(headers, **{"Content-Type": "application/json", "Content-Length": str(len(content))})
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(name.lower().encode("latin-1"), str(value).encode("latin-1"))
+                                for name, value in headers.items()]})
+        await send({"type": "http.response.body", "body": content})
+
+    return app
+
+
+def serve(host: str = "127.0.0.1", port: int = 8899, standin: Optional[StandIn] = None) -> ThreadingHTTPServer:
+    """An HTTP server for a StandIn; call serve_forever() (or run it on a thread)."""
+    standin = standin or StandIn()
+    server = ThreadingHTTPServer((host, port), make_handler(standin))
+    server.standin = standin
+    logger.info(f"🧪 Thore stand-in listening on http://{host}:{server.server_address[1]}")
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the local Thore API stand-in over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8899)
+    args = parser.parse_args()
+    server = serve(args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+# file: thore_state.py
+import argparse
+import json
+import logging
+import sqlite3
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "thore_state.db"
+
+# ----------------------------
+# Run state store
+# ----------------------------
+# One SQLite file in WAL mode for every run: readers never block the writers
+# and each checkpoint is one small transaction, so threads, worker processes
+# and queue workers all write to it directly.
+#   runs      one row per run (status, start/finish, run directory)
+#   policies  one row per policy: status, last step, IDs, error, resume state
+#   steps     one row per completed step: wall/cpu seconds and a compressed state
+#   errors    one row per failure (a re-driven policy can fail more than once)
+
+
+def _pack(value: Any) -> bytes:
+    """Compact checkpoint encoding: zlib-compressed JSON without whitespace."""
+    return zlib.compress(json.dumps(value, separators=(",", ":"), default=str).encode("utf-8"))
+
+
+def _unpack(blob: Optional[bytes]) -> Any:
+    return json.loads(zlib.decompress(blob)) if blob else None
+
+
+class StateStore:
+    """
+    Runs, policies, step states, timings and errors of every run, indexed
+    by run_id/status and instanceId for summaries, resume and dashboards.
+    """
+
+    def __init__(self, path: str = STATE_FILE):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    started_at TEXT,
+                    finished_at TEXT,
+                    meta TEXT
+                );
+                CREATE TABLE IF NOT EXISTS policies (
+                    run_id TEXT NOT NULL,
+                    policy_run INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    step TEXT,
+                    instance_id INTEGER,
+                    policyterm_id INTEGER,
+                    policy_number TEXT,
+                    message TEXT,
+                    category TEXT,
+                    wall REAL,
+                    result TEXT,
+                    resume BLOB,
+                    started_at TEXT,
+                    updated_at TEXT,
+                    PRIMARY KEY (run_id, policy_run)
+                );
+                CREATE INDEX IF NOT EXISTS idx_policies_status ON policies (run_id, status);
+                CREATE INDEX IF NOT EXISTS idx_policies_instance ON policies (instance_id);
+                CREATE TABLE IF NOT EXISTS steps (
+                    run_id TEXT NOT NULL,
+                    policy_run INTEGER NOT NULL,
+                    step TEXT NOT NULL,
+                    wall REAL,
+                    cpu REAL,
+                    state BLOB,
+                    completed_at TEXT,
+                    PRIMARY KEY (run_id, policy_run, step)
+                );
+                CREATE TABLE IF NOT EXISTS errors (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    run_id TEXT NOT NULL,
+                    policy_run INTEGER NOT NULL,
+                    step TEXT,
+                    category TEXT,
+                    http_status INTEGER,
+                    rule_ids TEXT,
+                    message TEXT,
+                    created_at TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_errors_run ON errors (run_id, category);
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit mode; every write below is a single statement or an explicit transaction
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")  # durable enough under WAL, no fsync per commit
+        return conn
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    # -- writes --
+
+    def run_started(self, run_id: str, meta: Optional[Dict[str, Any]] = None) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO runs (run_id, status, started_at, meta) VALUES (?, 'running', ?, ?)
+                ON CONFLICT (run_id) DO UPDATE SET status = 'running', meta = COALESCE(excluded.meta, meta)
+                """,
+                (run_id, self._now(), json.dumps(meta) if meta is not None else None),
+            )
+
+    def run_finished(self, run_id: str, status: str = "finished") -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE runs SET status = ?, finished_at = ? WHERE run_id = ?",
+                         (status, self._now(), run_id))
+
+    def checkpoint(self, run_id: str, policy_run: int, step: str, state: Dict[str, Any]) -> None:
+        """Record a completed step: its timing, the policy's state after it and the policy's progress."""
+        wall, cpu = (state.get("timings") or {}).get(step) or (None, None)
+        state = {k: v for k, v in state.items() if k not in ("timings", "step")}
+        now = self._now()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO steps (run_id, policy_run, step, wall, cpu, state, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (run_id, policy_run, step, wall, cpu, _pack(state), now),
+            )
+            conn.execute(
+                """
+                INSERT INTO policies (run_id, policy_run, status, step, instance_id, policyterm_id, started_at,
+                                      updated_at)
+                VALUES (?, ?, 'running', ?, ?, ?, ?, ?)
+                ON CONFLICT (run_id, policy_run) DO UPDATE SET
+                    status = 'running', step = excluded.step,
+                    instance_id = COALESCE(excluded.instance_id, instance_id),
+                    policyterm_id = COALESCE(excluded.policyterm_id, policyterm_id),
+                    updated_at = excluded.updated_at
+                """,
+                (run_id, policy_run, step, state.get("instanceId"), state.get("policytermId"), now, now),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def policy_finished(self, run_id: str, outcome: Dict[str, Any]) -> None:
+        """Record a run_policy outcome: final status, IDs, total step time and, if it failed, the error."""
+        result = outcome.get("result") or {}
+        failure = outcome.get("failure")
+        resume = outcome.get("resume")
+        wall = round(sum(timing[0] for timing in (outcome.get("timings") or {}).values()), 4) or None
+        now = self._now()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """
+                INSERT INTO policies (run_id, policy_run, status, step, instance_id, policyterm_id, policy_number,
+                                      message, category, wall, result, resume, started_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (run_id, policy_run) DO UPDATE SET
+                    status = excluded.status, step = COALESCE(excluded.step, step),
+                    instance_id = COALESCE(excluded.instance_id, instance_id),
+                    policyterm_id = COALESCE(excluded.policyterm_id, policyterm_id),
+                    policy_number = excluded.policy_number, message = excluded.message,
+                    category = excluded.category, wall = excluded.wall, result = excluded.result,
+                    resume = excluded.resume, updated_at = excluded.updated_at
+                """,
+                (run_id, outcome["policyRun"], outcome["status"], outcome.get("step"), result.get("instanceId"),
+                 result.get("policytermId"), result.get("policyNumber"), outcome.get("message"),
+                 failure["category"] if failure else None, wall, json.dumps(result) if result else None,
+                 _pack(resume) if resume else None, now, now),
+            )
+            if failure:
+                conn.execute(
+                    """
+                    INSERT INTO errors (run_id, policy_run, step, category, http_status, rule_ids, message,
+                                        created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (run_id, outcome["policyRun"], failure["step"], failure["category"], failure["httpStatus"],
+                     json.dumps(failure["ruleIds"]), failure["message"], now),
+                )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    # -- queries --
+
+    def runs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT run_id, status, started_at, finished_at FROM runs ORDER BY started_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [{"runId": r[0], "status": r[1], "startedAt": r[2], "finishedAt": r[3]} for r in rows]
+
+    def counts(self, run_id: str) -> Dict[str, int]:
+        """{policy status: n} for a run"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) FROM policies WHERE run_id = ? GROUP BY status", (run_id,)
+            ).fetchall()
+        return {status: n for status, n in rows}
+
+    def step_timings(self, run_id: str) -> Dict[str, Dict[str, Any]]:
+        """{step: {count, avgWall, maxWall, avgCpu}} over the completed steps of a run"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT step, COUNT(*), AVG(wall), MAX(wall), AVG(cpu) FROM steps
+                WHERE run_id = ? GROUP BY step ORDER BY MIN(completed_at)
+                """,
+                (run_id,),
+            ).fetchall()
+        return {
+            step: {"count": n, "avgWall": round(avg_wall or 0, 4), "maxWall": round(max_wall or 0, 4),
+                   "avgCpu": round(avg_cpu or 0, 4)}
+            for step, n, avg_wall, max_wall, avg_cpu in rows
+        }
+
+    def errors(self, run_id: str) -> Dict[str, int]:
+        """{category: n} of the failures recorded for a run"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT category, COUNT(*) FROM errors WHERE run_id = ? GROUP BY category", (run_id,)
+            ).fetchall()
+        return {category: n for category, n in rows}
+
+    def summary(self, run_id: str) -> Dict[str, Any]:
+        return {"runId": run_id, "policies": self.counts(run_id), "errors": self.errors(run_id),
+                "steps": self.step_timings(run_id)}
+
+    def policies(self, run_id: str, status: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        query = (f"SELECT {self._POLICY_COLUMNS} FROM policies WHERE run_id = ?"
+                 + (" AND status = ?" if status else "") + " ORDER BY policy_run")
+        params: List[Any] = [run_id] + ([status] if status else [])
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [self._policy(row) for row in rows]
+
+    def find_instance(self, instance_id: int) -> List[Dict[str, Any]]:
+        """Every policy row that created or touched PolicyTermTransaction instance_id."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {self._POLICY_COLUMNS} FROM policies WHERE instance_id = ? ORDER BY updated_at",
+                (instance_id,),
+            ).fetchall()
+        return [self._policy(row) for row in rows]
+
+    def last_checkpoint(self, run_id: str, policy_run: int) -> Optional[Dict[str, Any]]:
+        """{"step", "state"} of the policy's most recent completed step, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                """
+                SELECT step, state FROM steps WHERE run_id = ? AND policy_run = ?
+                ORDER BY completed_at DESC LIMIT 1
+                """,
+                (run_id, policy_run),
+            ).fetchone()
+        return {"step": row[0], "state": _unpack(row[1])} if row else None
+
+    def resume_point(self, run_id: str, policy_run: int) -> Optional[Dict[str, Any]]:
+        """The "resume" record of a failed policy (see run_policy), or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT resume FROM policies WHERE run_id = ? AND policy_run = ?",
+                               (run_id, policy_run)).fetchone()
+        return _unpack(row[0]) if row else None
+
+    _POLICY_COLUMNS = ("run_id, policy_run, status, step, instance_id, policyterm_id, policy_number, message, "
+                       "category, wall, updated_at")
+
+    @staticmethod
+    def _policy(row) -> Dict[str, Any]:
+        return {
+            "runId": row[0],
+            "policyRun": row[1],
+            "status": row[2],
+            "step": row[3],
+            "instanceId": row[4],
+            "policytermId": row[5],
+            "policyNumber": row[6],
+            "message": row[7],
+            "category": row[8],
+            "wall": row[9],
+            "updatedAt": row[10],
+        }
+
+
+# ----------------------------
+# Recording from run_policy
+# ----------------------------
+
+class RunState:
+    """
+    A StateStore bound to one run. run_policy records into the RunState in
+    STATE; a failing write is logged and never fails the policy.
+    """
+
+    def __init__(self, store: StateStore, run_id: str):
+        self.store = store
+        self.run_id = run_id
+
+    def checkpoint(self, policy_run: int, step: str, state: Dict[str, Any]) -> None:
+        try:
+            self.store.checkpoint(self.run_id, policy_run, step, state)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record step {step} of policy #{policy_run} in {self.store.path}: {e}")
+
+    def policy_finished(self, outcome: Dict[str, Any]) -> None:
+        try:
+            self.store.policy_finished(self.run_id, outcome)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record policy #{outcome['policyRun']} in {self.store.path}: {e}")
+
+
+# State store of the current run, if it is recorded (set by RunOutput, per process in workers)
+STATE: ContextVar[Optional[RunState]] = ContextVar("thore_state", default=None)
+
+
+def set_process_state(path: str, run_id: str) -> RunState:
+    """Record this process's policies into the store at path (worker processes)."""
+    state = RunState(StateStore(path), run_id)
+    STATE.set(state)
+    return state
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Query the run state store")
+    parser.add_argument("--db", default=STATE_FILE, help="state database file")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    runs = sub.add_parser("runs", help="most recent runs")
+    runs.add_argument("--limit", type=int, default=20)
+
+    summary = sub.add_parser("summary", help="policy counts, errors and step timings of a run")
+    summary.add_argument("run_id")
+
+    listing = sub.add_parser("policies", help="policies of a run")
+    listing.add_argument("run_id")
+    listing.add_argument("--status", default=None)
+    listing.add_argument("--limit", type=int, default=None)
+
+    instance = sub.add_parser("instance", help="policies that touched a PolicyTermTransaction instance")
+    instance.add_argument("instance_id", type=int)
+
+    args = parser.parse_args()
+    store = StateStore(args.db)
+    if args.command == "runs":
+        print(json.dumps(store.runs(args.limit), indent=2))
+    elif args.command == "summary":
+        print(json.dumps(store.summary(args.run_id), indent=2))
+    elif args.command == "policies":
+        for policy in store.policies(args.run_id, args.status, args.limit):
+            print(json.dumps(policy))
+    else:
+        print(json.dumps(store.find_instance(args.instance_id), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,35 +3,41 @@ import json
 import logging
 import re
 import time
-from datetime import datetime, timezone
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, Iterator, Optional, Tuple
 
 import requests
-from thore_client import ThoreAPIClient, format_effective_date
+from thore_client import ThoreAPIClient, poll_until, build_response, check_deadline, server_now
 
 logger = logging.getLogger(__name__)
 
+# Children fetched per page by recovery lookups (see iter_children)
+CHILDREN_PAGE_SIZE = 100
+
 # ----------------------------
 # Step 1 – Create Policy
 # ----------------------------
 
-def step1_create_policy(client: ThoreAPIClient, user_input: Dict[str, Any]) -> int:
+def step1_create_policy(client: ThoreAPIClient, user_input: Dict[str, Any],
+                        idempotency_key: Optional[str] = None) -> int:
     """
     Create a new policy term transaction.
     Returns the created instance ID (integer).
+    With an idempotency_key, a retried POST first looks for the instance
+    an earlier (timed out) attempt may already have created.
     """
 
     url = (
-        f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX"
-        "?parentTypeGroup=Organization.Agencies&parentId=49&productName=HOATX"
+        f"{client.base_url}/v1/entityInstances/{client.entity_type}"
+        f"?parentTypeGroup=Organization.Agencies&parentId={client.agency_id}&productName={client.product}"
     )
 
     body = {
         "id": 0,
-        "entityType": "PolicyTermTransaction.HOATX",
+        "entityType": client.entity_type,
         "versionNumber": None,
         "data": {
-            "effectiveDate": format_effective_date(user_input["effectiveDate"]),
+            "effectiveDate": user_input["effectiveDateIso"],
             "interests": [
                 {
                     "type": "NamedInsured",
@@ -55,12 +61,26 @@ def step1_create_policy(client: ThoreAPIClient, user_input: Dict[str, Any]) -> i
     }
 
     headers = client.headers()
-    resp = client._request("POST", url, headers=headers, json=body)
+    recover = None
+    if idempotency_key:
+        started = server_now(client.base_url)
+
+        def recover():
+            existing_id = find_created_policy(client, body["data"], started)
+            if existing_id is None:
+                return None
+            location = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{existing_id}"
+            return build_response(201, {"Location": location}, url=url)
+
+    # Only the Location header is needed from the 201; the body is drained unread
+    resp = client._request("POST", url, headers=headers, json=body, idempotency_key=idempotency_key, recover=recover,
+                           body="ignore")
 
     # Wait for the POST to complete (expect 201)
     while resp.status_code != 201:
         logger.info(f"Waiting for policy creation... status {resp.status_code}")
         time.sleep(3)
+        check_deadline("policy creation")
 
     location = resp.headers.get("Location") or resp.headers.get("location")
     if not location:
@@ -71,11 +91,81 @@ def step1_create_policy(client: ThoreAPIClient, user_input: Dict[str, Any]) -> i
     if not match:
         raise RuntimeError("Could not parse instance ID from Location header.")
     instance_id = int(match.group(1))
+    client.known_instances.add(instance_id)
 
     logger.info(f"✅ Step 1 completed: Policy created with instanceId={instance_id}")
     return instance_id
 
 
+def find_created_policy(client: ThoreAPIClient, data: Dict[str, Any], created_after: datetime) -> Optional[int]:
+    """
+    The earliest policy term transaction under the agency created at or
+    after created_after with the create's effective date and named insured,
+    and not already owned by a policy of this client; it is claimed for the
+    caller (see claim_instance). Creates of one batch share their body, so
+    any such instance is as good as the lost one. Workers of other
+    processes are not coordinated with: if two of them retry the same
+    applicant's create in the same window, both may adopt one instance.
+    Returns its instance ID, or None.
+    """
+    url = (
+        f"{client.base_url}/v1/entityInstances/Organization.Agencies/{client.agency_id}/children"
+        f"?childTypeGroup={client.entity_type}"
+    )
+    wanted = (str(data["effectiveDate"])[:10], _insured_name(data))
+    matches = []
+    try:
+        for item in iter_children(client, url):
+            try:
+                created = datetime.fromisoformat(item["createDate"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            item_data = item.get("data") or {}
+            if (created >= created_after.replace(microsecond=0) and item.get("id") not in client.known_instances
+                    and (str(item_data.get("effectiveDate"))[:10], _insured_name(item_data)) == wanted):
+                matches.append((created, item["id"]))
+    except Exception as e:
+        logger.warning(f"Could not look up previously created policies: {e}")
+        return None
+
+    for _, instance_id in sorted(matches):
+        if client.claim_instance(instance_id):
+            logger.info(f"Found policy {instance_id} created by an earlier attempt")
+            return instance_id
+    return None
+
+
+def _insured_name(data: Dict[str, Any]) -> Optional[Tuple[Any, Any]]:
+    for interest in data.get("interests") or []:
+        if not isinstance(interest, dict):
+            continue
+        name = (interest.get("characteristics") or {}).get("name") or {}
+        if interest.get("type") == "NamedInsured" and name:
+            return name.get("firstName"), name.get("lastName")
+    return None
+
+
+def iter_children(client: ThoreAPIClient, url: str, page_size: int = CHILDREN_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Every child listed by a .../children url, page_size at a time with
+    limit/offset. Stops at a short page, or at a page with nothing new
+    (a server ignoring offset sends the first page again).
+    """
+    seen = set()
+    offset = 0
+    while True:
+        page = client._send("GET", f"{url}&limit={page_size}&offset={offset}", headers=client.headers()).json()
+        items = [item for item in page if isinstance(item, dict)] if isinstance(page, list) else []
+        new = [item for item in items if item.get("id") not in seen]
+        if not new:
+            return
+        seen.update(item.get("id") for item in new)
+        yield from new
+        if len(items) < page_size:
+            return
+        offset += page_size
+
+
 def step_get_policyterm_id(client, instance_id):
     """
     Retrieves the PolicyTerm ID associated with a PolicyTermTransaction instance.
@@ -88,22 +178,15 @@ def step_get_policyterm_id(client, instance_id):
         int: The PolicyTerm ID.
     """
     url = (
-        f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX/"
+        f"{client.base_url}/v1/entityInstances/{client.entity_type}/"
         f"{instance_id}/parents?limit=100&parentTypeGroup=PolicyTerms"
     )
 
     headers = client.headers()
     logger.info(f"Fetching PolicyTerm for instance_id={instance_id} ...")
 
-    resp = client._request("GET", url, headers=headers)
-
     # Retry loop in case of latency or delayed propagation
-    retries = 5
-    while resp.status_code != 200 and retries > 0:
-        logger.warning(f"PolicyTerm not ready (status {resp.status_code}). Retrying...")
-        time.sleep(3)
-        resp = client._request("GET", url, headers=headers)
-        retries -= 1
+    resp = poll_until(client, "GET", url, (200,), "PolicyTerm not ready, retrying", max_polls=5, headers=headers)
 
     if resp.status_code != 200:
         raise RuntimeError(
@@ -140,27 +223,27 @@ def step1_1_get_policy_details(client: ThoreAPIClient, instance_id: int) -> Dict
     Returns dict with resourceIdentifier, policyNumber, transactionNumber.
     """
 
-    url = f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX/{instance_id}"
+    url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}"
     headers = client.headers()
 
-    resp = client._request("GET", url, headers=headers)
+    resp = poll_until(client, "GET", url, (200,), "Waiting for policy details", headers=headers)
 
-    while resp.status_code != 200:
-        logger.info(f"Waiting for policy details... status {resp.status_code}")
-        time.sleep(3)
-        resp = client._request("GET", url, headers=headers)
+    result = policy_details_from_instance(instance_id, resp.json())
 
-    data = resp.json()
+    logger.info(f"✅ Step 1.1 completed: {json.dumps(result, indent=2)}")
+    return result
+
+
+def policy_details_from_instance(instance_id: int, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Extract the key fields used by later steps from a PolicyTermTransaction instance."""
     resource_identifier = data.get("resourceIdentifier")
     policy_number = data.get("data", {}).get("policyNumber")
     transaction_number = data.get("data", {}).get("transactionNumber")
 
-    result = {
+    return {
         "instanceId": instance_id,
         "resourceIdentifier": resource_identifier,
         "policyNumber": policy_number,
         "transactionNumber": transaction_number,
+        "versionNumber": data.get("versionNumber"),
     }
-
-    logger.info(f"✅ Step 1.1 completed: {json.dumps(result, indent=2)}")
-    return result
@@ -1,28 +1,57 @@
 import json
 import logging
+import threading
 import time
-from datetime import datetime, timezone
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from urllib.parse import urlencode, quote
 
-from thore_client import ThoreAPIClient
-import email.utils
+from thore_client import (ThoreAPIClient, DeadlineExceeded, poll_until, status_recovery, bump_version, response_version)
+from thore_failures import http_failure, exception_failure
+from thore_synthetic import DEFAULT_PROPERTY, DEFAULT_BIRTH_DATE, property_of, verisk_location_data
+from thore_versions import versioned_patch
 import requests
 
 logger = logging.getLogger(__name__)
 
-def _utc_now_iso():
-    """Return current UTC datetime in ISO format with milliseconds and -05:00 offset."""
-    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "-05:00"
-
-def step1_1_1_verisk_location(client: ThoreAPIClient, instance_id: int):
-    global shared_data
-    shared_data = {}
-    url = f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX/{instance_id}/actions/RequestVeriskLocationReport?address=17426 STRALOCH LN&city=RICHMOND&state=TX&postalCode=77407&includeReports=ppc,latlong,actualDtc"
-    resp = client._request("POST", url, headers=client.headers())
-    while resp.status_code != 200:
-        logger.info(f"Waiting verisklocationreport... {resp.status_code}")
-        time.sleep(3)
-        resp = client._request("POST", url, headers=client.headers())
+# Scratch data handed from one step to the next (dates, Verisk tracking IDs).
+# Kept per thread so policies running concurrently in one process don't mix.
+_local = threading.local()
+
+
+def _shared() -> Dict[str, Any]:
+    if not hasattr(_local, "data"):
+        _local.data = {}
+    return _local.data
+
+
+def scratch_state() -> Dict[str, Any]:
+    """Copy of this thread's scratch data, kept with a failed policy so it can be resumed."""
+    return dict(_shared())
+
+
+def restore_scratch_state(data: Dict[str, Any]) -> None:
+    _local.data = dict(data)
+
+
+def _utc_now_iso(client: ThoreAPIClient):
+    """Return the client's server time at -05:00 in ISO format with milliseconds (see ThoreAPIClient._now_iso)."""
+    return client._now_iso()
+
+
+def _today_iso(client: ThoreAPIClient):
+    """Midnight starting the server's current -05:00 day, e.g. 2025-10-24T00:00:00.000-05:00."""
+    return _utc_now_iso(client)[:10] + "T00:00:00.000-05:00"
+
+def step1_1_1_verisk_location(client: ThoreAPIClient, instance_id: int, idempotency_key: Optional[str] = None,
+                              prop: Optional[Dict[str, Any]] = None):
+    shared_data = _local.data = {}
+    prop = prop or DEFAULT_PROPERTY
+    query = urlencode({"address": prop["address"], "city": prop["city"], "state": prop["state"],
+                       "postalCode": prop["postalCode"], "includeReports": "ppc,latlong,actualDtc"},
+                      quote_via=quote, safe=",")
+    url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}/actions/RequestVeriskLocationReport?{query}"
+    resp = poll_until(client, "POST", url, (200,), "Waiting verisklocationreport", headers=client.headers(),
+                      idempotency_key=idempotency_key)
     try:
         data = resp.json()
     except Exception as e:
@@ -40,14 +69,11 @@ def step1_1_1_verisk_location(client: ThoreAPIClient, instance_id: int):
         "tracking_id": tracking_id
     })
 
-def step1_1_2_verisk_location(client: ThoreAPIClient, instance_id: int):
-    global shared_data
-    url = f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX/{instance_id}/actions/SaveVeriskLocationReport?trackingId={shared_data["tracking_id"]}"
-    resp = client._request("POST", url, headers=client.headers())
-    while resp.status_code != 200:
-        logger.info(f"Waiting saveverisklocationreport... {resp.status_code}")
-        time.sleep(3)
-        resp = client._request("POST", url, headers=client.headers())
+def step1_1_2_verisk_location(client: ThoreAPIClient, instance_id: int, idempotency_key: Optional[str] = None):
+    shared_data = _shared()
+    url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}/actions/SaveVeriskLocationReport?trackingId={shared_data['tracking_id']}"
+    resp = poll_until(client, "POST", url, (200,), "Waiting saveverisklocationreport", headers=client.headers(),
+                      idempotency_key=idempotency_key)
     try:
         data = resp.json()
     except Exception as e:
@@ -57,17 +83,13 @@ def step1_1_2_verisk_location(client: ThoreAPIClient, instance_id: int):
         raise RuntimeError(f"No save veriskreport found for instance_id={instance_id}")
     logger.info(f"✅ Step completed: SaveVeriskLocationReport")
 
-def step1_1_3_verisk_aplus_request(client: ThoreAPIClient, instance_id: int):
-    global shared_data
-    url = f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX/{instance_id}/actions/RequestVeriskAPlusReport"
-    resp = client._request("POST", url, headers=client.headers())
+def step1_1_3_verisk_aplus_request(client: ThoreAPIClient, instance_id: int, idempotency_key: Optional[str] = None):
+    shared_data = _shared()
+    url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}/actions/RequestVeriskAPlusReport"
+    resp = poll_until(client, "POST", url, (200,), "Waiting veriskAPlusReport", headers=client.headers(),
+                      idempotency_key=idempotency_key)
     logger.info(f"A+ REQUEST RESPONSE: {resp.text}")
 
-    while resp.status_code != 200:
-        logger.info(f"Waiting veriskAPlusReport... {resp.status_code}")
-        time.sleep(3)
-        resp = client._request("POST", url, headers=client.headers())
-
     try:
         data = resp.json()
     except Exception as e:
@@ -91,20 +113,17 @@ def step1_1_3_verisk_aplus_request(client: ThoreAPIClient, instance_id: int):
     })
 
 
-def step1_1_4_verisk_aplus_save(client: ThoreAPIClient, instance_id: int):
-    global shared_data
+def step1_1_4_verisk_aplus_save(client: ThoreAPIClient, instance_id: int, idempotency_key: Optional[str] = None):
+    shared_data = _shared()
 
     url = (
-        f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX/"
+        f"{client.base_url}/v1/entityInstances/{client.entity_type}/"
         f"{instance_id}/actions/SaveVeriskAPlusReport?trackingId={shared_data['aplus_tracking']}"
     )
 
-    resp = client._request("POST", url, headers=client.headers())
+    resp = poll_until(client, "POST", url, (200,), "Waiting saveVeriskAPlusReport", headers=client.headers(),
+                      idempotency_key=idempotency_key)
     logger.info(f"A+ SAVE RESPONSE: {resp.text}")
-    while resp.status_code != 200:
-        logger.info(f"Waiting saveVeriskAPlusReport... {resp.status_code}")
-        time.sleep(3)
-        resp = client._request("POST", url, headers=client.headers())
 
     try:
         data = resp.json()
@@ -125,17 +144,19 @@ def step1_1_4_verisk_aplus_save(client: ThoreAPIClient, instance_id: int):
 
 def step1_2_patch_pending(client: ThoreAPIClient, step3_data: Dict[str, Any], user_input: Dict[str, Any]) -> None:
     """PATCH policy to Pending status."""
-    global shared_data
-    shared_data = {}
+    shared_data = _local.data = {}
     instance_id = step3_data["instanceId"]
     resource_id = step3_data["resourceIdentifier"]
     policy_no = step3_data["policyNumber"]
     txn_no = step3_data["transactionNumber"]
-    effective_date_only = step3_data.get("effectiveDate", user_input["effectiveDate"])
     # effective_date_with_time = f"{effective_date_only}T05:00:00.000-05:00"
-    effective_date_with_time = f"{effective_date_only}T06:00:00Z"
+    effective_date_with_time = (
+        f"{step3_data['effectiveDate']}T06:00:00Z" if "effectiveDate" in step3_data
+        else user_input["effectiveDateTime"]
+    )
 
-    url = f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX/{instance_id}"
+    url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}"
+    prop = property_of(user_input)
 
     # patch_body = {
     #     "id": instance_id,
@@ -281,7 +302,7 @@ def step1_2_patch_pending(client: ThoreAPIClient, step3_data: Dict[str, Any], us
     patch_body = {
     "id": instance_id,
     "resourceIdentifier": resource_id,
-    "versionNumber": 1,
+    "versionNumber": step3_data.get("versionNumber") or 1,
     "data": {
         "policyNumber": policy_no,
         "transactionNumber": txn_no,
@@ -292,14 +313,14 @@ def step1_2_patch_pending(client: ThoreAPIClient, step3_data: Dict[str, Any], us
         "preSubmittedStatus": None,
         "effectiveDate": effective_date_with_time,
         "keyDates": {
-            "quoteDate": _utc_now_iso(),
+            "quoteDate": _utc_now_iso(client),
             "convertDate": None,
             "declineDate": None,
             "bindDate": None,
             "issueDate": None,
             "archiveDate": None,
             "obsoleteDate": None,
-            "accountingDate": datetime.now(timezone.utc).strftime("%Y-%m-%dT00:00:00.000-05:00"),
+            "accountingDate": _today_iso(client),
             "submitDate": None
         },
         "accounting": {
@@ -333,13 +354,13 @@ def step1_2_patch_pending(client: ThoreAPIClient, step3_data: Dict[str, Any], us
                         "middleName": None,
                         "lastName": user_input["lastName"],
                         "suffix": None,
-                        "displayName": f"{user_input['firstName']} {user_input['lastName']}"
+                        "displayName": user_input["displayName"]
                     },
                     "phones": [{"type": "Mobile", "number": user_input["phone"]}],
                     "emails": [{"address": user_input["email"]}],
                     "addresses": [{"type": "Mailing"}],
                     "hasCompanionPolicy": True,
-                    "birthDate": "1980-01-01T00:00:00.000-06:00"
+                    "birthDate": user_input.get("birthDate", DEFAULT_BIRTH_DATE)
                 },
             }
         ],
@@ -351,24 +372,24 @@ def step1_2_patch_pending(client: ThoreAPIClient, step3_data: Dict[str, Any], us
                         {
                             "type": "Physical",
                             "subType": "Primary",
-                            "state": "TX",
-                            "city": "RICHMOND",
-                            "address": "17426 STRALOCH LN",
-                            "postalCode": "77407",
-                            "county": "FORT BEND"
+                            "state": prop["state"],
+                            "city": prop["city"],
+                            "address": prop["address"],
+                            "postalCode": prop["postalCode"],
+                            "county": prop["county"]
                         }
                     ],
                     "limits": {
                         "otherStructures": 250,
-                        "personalProperty": 0.25,
-                        "lossOfUse": 0.1,
-                        "personalLiability": 25000,
+                        "personalProperty": prop["personalProperty"],
+                        "lossOfUse": prop["lossOfUse"],
+                        "personalLiability": prop["personalLiability"],
                         "medicalPaymentsToOthers": 500,
                         "waterDamage": 5000,
                         "additionalWaterDamage": 0,
                         "unscheduledJewelryWatchesFurs": 500,
                         "animalLiability": 0,
-                        "dwelling": 740000
+                        "dwelling": prop["dwelling"]
                     },
                     "modifier": {
                         "hasPersonalPropertyReplacementCost": True,
@@ -390,29 +411,29 @@ def step1_2_patch_pending(client: ThoreAPIClient, step3_data: Dict[str, Any], us
                             "burglarAlarmType": "None",
                             "fireAlarmType": "None",
                             "isRoofStandardConstructionCompliant": False,
-                            "constructedDate": "2018-01-01T00:00:00.000-06:00",
-                            "roofInstallationDate": "2018-01-01T00:00:00.000-06:00",
-                            "type": "BrickVeneer",
-                            "squareFootage": 3748,
-                            "numberOfFloors": "1.5Story",
+                            "constructedDate": prop["constructedDate"],
+                            "roofInstallationDate": prop["roofInstallationDate"],
+                            "type": prop["constructionType"],
+                            "squareFootage": prop["squareFootage"],
+                            "numberOfFloors": prop["numberOfFloors"],
                             "hasFireExtinguisher": False,
                             "groundLevelWaterAppliances": False,
                             "steepRoof": False
                         },
                         "usage": {
                             "occupancy": "OwnerPrimary",
-                            "numberOfResidents": 2
+                            "numberOfResidents": prop["numberOfResidents"]
                         }
                     },
                     "geolocation": {
                         "hasCommunitySecurity": False,
                         "isFireStationWithin": "UnderEqualTo5Miles",
-                        "fireProtectionClass": "2",
+                        "fireProtectionClass": prop["fireProtectionClass"],
                         "isFireHydrantWithin": "UnderEqualTo1000FT",
-                        "fireStationName": "NORTH EAST FORT BEND FS 2",
-                        "longitude": "-95.689794",
+                        "fireStationName": prop["fireStationName"],
+                        "longitude": prop["longitude"],
                         # "longitude": "",
-                        "latitude": "29.646506"
+                        "latitude": prop["latitude"]
                         # "latitude": ""
                     },
                     "property": {
@@ -421,7 +442,7 @@ def step1_2_patch_pending(client: ThoreAPIClient, step3_data: Dict[str, Any], us
                         "priorInsurancePolicyEffectiveDate": None,
                         "priorInsurancePolicyExpirationDate": None,
                         "hasPoolOnPremises": False,
-                        "newPurchaseClosingDate": "2018-11-29T00:00:00.000-06:00"
+                        "newPurchaseClosingDate": prop["purchaseDate"]
                     },
                     "displayDescription": "TX"
                 },
@@ -440,7 +461,7 @@ def step1_2_patch_pending(client: ThoreAPIClient, step3_data: Dict[str, Any], us
             "renewalTerm": 0,
             "isVeriskAPlusRequested": False,
             "veriskAPlusTransactionId": None,
-            "veriskLocationData": "29.646506 | -95.689794 | NORTH EAST FORT BEND FS 2 | UnderEqualTo5Miles | 2",
+            "veriskLocationData": verisk_location_data(prop),
             # "veriskLocationData": "",
             "veriskLocationAddressInfo": "Verified",
             # "veriskLocationTrackingId": shared_data["tracking_id"],
@@ -451,7 +472,7 @@ def step1_2_patch_pending(client: ThoreAPIClient, step3_data: Dict[str, Any], us
             "quadrINS": {
                 "result": "Unverified"
             },
-            "veriskLocationActualDistanceToCoast": "51.88"
+            "veriskLocationActualDistanceToCoast": prop["distanceToCoast"]
             # "veriskLocationActualDistanceToCoast": ""
         },
         "termLength": 525600,
@@ -460,9 +481,9 @@ def step1_2_patch_pending(client: ThoreAPIClient, step3_data: Dict[str, Any], us
             "reverseAllLedgerTransactions": None
         }
     },
-    "entityType": "PolicyTermTransaction.HOATX",
-    "createDate": _utc_now_iso(),
-    "changeDate": _utc_now_iso(),
+    "entityType": client.entity_type,
+    "createDate": _utc_now_iso(client),
+    "changeDate": _utc_now_iso(client),
     "createdById": 9742,
     "changedById": 9742
     }
@@ -473,15 +494,12 @@ def step1_2_patch_pending(client: ThoreAPIClient, step3_data: Dict[str, Any], us
         "createdate": patch_body["createDate"],
     })
 
-    resp = client._request("PATCH", url, headers=client.headers(), json=patch_body)
-    while resp.status_code != 204:
-        logger.info(f"Waiting for PATCH (Pending)... {resp.status_code}")
-        time.sleep(3)
-        resp = client._request("PATCH", url, headers=client.headers(), json=patch_body)
+    versioned_patch(client, url, instance_id, patch_body, "Waiting for PATCH (Pending)")
 
     logger.info(f"✅ Step 1.2 completed (Pending updated).")
 
-def step1_2_1rule_overrides(client: ThoreAPIClient, instance_id: int, resource_identifier: str):
+def step1_2_1rule_overrides(client: ThoreAPIClient, instance_id: int, resource_identifier: str,
+                            idempotency_key: Optional[str] = None):
     base_url = f"{client.base_url}/v1/entityInstanceRuleViolationOverrides"
     payloads = [
         {
@@ -495,11 +513,8 @@ def step1_2_1rule_overrides(client: ThoreAPIClient, instance_id: int, resource_i
     # this is to override the address verification through verisk
 
     for i, body in enumerate(payloads, start=1):
-        resp = client._request("POST", base_url, headers=client.headers(), json=body)
-        while resp.status_code != 201:
-            logger.info(f"Waiting RuleOverride number {i}... {resp.status_code}")
-            time.sleep(3)
-            resp = client._request("POST", base_url, headers=client.headers(), json=body)
+        poll_until(client, "POST", base_url, (201,), f"Waiting RuleOverride number {i}", headers=client.headers(), json=body,
+                   idempotency_key=f"{idempotency_key}-{i}" if idempotency_key else None, body="ignore")
         # logger.info(f"✅ Step {i} RuleOverride completed.")
         # logger.info(f"✅ Step 3 RuleOverride completed.")
 
@@ -508,34 +523,18 @@ def step1_2_1rule_overrides(client: ThoreAPIClient, instance_id: int, resource_i
 # Step 2 – Convert Quote to Application
 # ----------------------------
 
-def step2_convert_quote(client: ThoreAPIClient, instance_id: int):
-    global shared_data
-    url = f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX/{instance_id}/actions/ConvertQuoteToApplication"
+def step2_convert_quote(client: ThoreAPIClient, instance_id: int, idempotency_key: Optional[str] = None):
+    shared_data = _shared()
+    url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}/actions/ConvertQuoteToApplication"
     # resp = client._request("POST", url, headers=client.headers(), allow_500=True)
-    resp = client._request("POST", url, headers=client.headers())
+    instance_url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}"
+    resp = poll_until(client, "POST", url, (200,), "Waiting ConvertQuoteToApplication", headers=client.headers(),
+                      idempotency_key=idempotency_key,
+                      recover=status_recovery(client, instance_url, "Application") if idempotency_key else None)
     logger.info(f"ConvertQuoteToApplication RESPONSE: {resp.text}")
-    # while resp.status_code not in (200, 500):
-    while resp.status_code not in 200:
-        logger.info(f"Waiting ConvertQuoteToApplication... {resp.status_code}")
-        time.sleep(3)
-        resp = client._request("POST", url, headers=client.headers(), allow_500=True)
-        logger.info(f"response1... {resp.json()}")
-    date_header = resp.headers.get("Date")
-    if date_header:
-        # Parse it into a datetime object
-        dt = email.utils.parsedate_to_datetime(date_header)
-        # Make sure it's timezone aware in UTC
-        dt_utc = dt.astimezone(timezone.utc)
-        # Format like your _utc_now_iso() style
-        formatted_utc = dt_utc.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "-05:00"
-        logger.info("Server Date in UTC format: %s", formatted_utc)
-        shared_data.update({
-            "convertdate": formatted_utc,
-        })
-        # return formatted_utc
-    else:
-        logger.info("Date header not found in response")
-        # return None
+    # the server clock has just seen this response's Date header
+    shared_data["convertdate"] = _utc_now_iso(client)
+    logger.info("Convert date: %s", shared_data["convertdate"])
     logger.info("✅ Step 2 ConvertQuoteToApplication completed.")
 
 
@@ -544,23 +543,26 @@ def step2_convert_quote(client: ThoreAPIClient, instance_id: int):
 # ----------------------------
 
 def step2_1_patch_application(client: ThoreAPIClient, step3_data: Dict[str, Any], user_input: Dict[str, Any]):
-    global shared_data
+    shared_data = _shared()
     logger.info("Data in shared_data: %s", shared_data)
     instance_id = step3_data["instanceId"]
     resource_id = step3_data["resourceIdentifier"]
     policy_no = step3_data["policyNumber"]
     txn_no = step3_data["transactionNumber"]
-    effective_date_only = step3_data.get("effectiveDate", user_input["effectiveDate"])
     # effective_date_with_time = f"{effective_date_only}T05:00:00.000-05:00"
-    effective_date_with_time = f"{effective_date_only}T06:00:00Z"
+    effective_date_with_time = (
+        f"{step3_data['effectiveDate']}T06:00:00Z" if "effectiveDate" in step3_data
+        else user_input["effectiveDateTime"]
+    )
 
-    url = f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX/{instance_id}"
+    url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}"
+    prop = property_of(user_input)
 
 
     patch_body = {
         "id": instance_id,
         "resourceIdentifier": resource_id,
-        "versionNumber": 1,
+        "versionNumber": step3_data.get("versionNumber") or 1,
         "data": {
             "policyNumber": policy_no,
             "transactionNumber": txn_no,
@@ -583,7 +585,7 @@ def step2_1_patch_application(client: ThoreAPIClient, step3_data: Dict[str, Any]
                             "type": "Individual",
                             "firstName": user_input["firstName"],
                             "lastName": user_input["lastName"],
-                            "displayName": f"{user_input['firstName']} {user_input['lastName']}",
+                            "displayName": user_input["displayName"],
                         },
                         "phones": [{"type": "Mobile", "number": user_input["phone"]}],
                         "emails": [{"address": user_input["email"]}],
@@ -591,16 +593,16 @@ def step2_1_patch_application(client: ThoreAPIClient, step3_data: Dict[str, Any]
                             {
                                 "type": "Mailing",
                                 "country": "USA",
-                                "city": "RICHMOND",
-                                "state": "TX",
-                                "postalCode": "77407",
-                                "address": "17426 STRALOCH LN",
+                                "city": prop["city"],
+                                "state": prop["state"],
+                                "postalCode": prop["postalCode"],
+                                "address": prop["address"],
                             }
                         ],
                         "hasCompanionPolicy": True,
                         "hasConvictionArsonFelonyOrFraud": False,
                         "hasCoverageCancelledDeclinedNonRenewed": False,
-                        "birthDate": "1980-01-01T00:00:00.000-06:00"
+                        "birthDate": user_input.get("birthDate", DEFAULT_BIRTH_DATE)
                     },
                 }
             ],
@@ -612,24 +614,24 @@ def step2_1_patch_application(client: ThoreAPIClient, step3_data: Dict[str, Any]
                         {
                             "type": "Physical",
                             "subType": "Primary",
-                            "state": "TX",
-                            "address": "17426 STRALOCH LN",
-                            "city": "RICHMOND",
-                            "postalCode": "77407",
-                            "county": "FORT BEND",
+                            "state": prop["state"],
+                            "address": prop["address"],
+                            "city": prop["city"],
+                            "postalCode": prop["postalCode"],
+                            "county": prop["county"],
                         }
                     ],
                     "limits": {
                         "otherStructures": 250,
-                        "personalProperty": 0.25,
-                        "lossOfUse": 0.1,
-                        "personalLiability": 25000,
+                        "personalProperty": prop["personalProperty"],
+                        "lossOfUse": prop["lossOfUse"],
+                        "personalLiability": prop["personalLiability"],
                         "medicalPaymentsToOthers": 500,
                         "waterDamage": 5000,
                         "additionalWaterDamage": 0,
                         "unscheduledJewelryWatchesFurs": 500,
                         "animalLiability": 0,
-                        "dwelling": 740000,
+                        "dwelling": prop["dwelling"],
                     },
                     "modifier": {
                         "hasPersonalPropertyReplacementCost": True,
@@ -651,11 +653,11 @@ def step2_1_patch_application(client: ThoreAPIClient, step3_data: Dict[str, Any]
                             "burglarAlarmType": "None",
                             "fireAlarmType": "None",
                             "isRoofStandardConstructionCompliant": False,
-                            "constructedDate": "2018-01-01T00:00:00.000-06:00",
-                            "roofInstallationDate": "2018-01-01T00:00:00.000-06:00",
-                            "type": "BrickVeneer",
-                            "squareFootage": 3748,
-                            "numberOfFloors": "1.5Story",
+                            "constructedDate": prop["constructedDate"],
+                            "roofInstallationDate": prop["roofInstallationDate"],
+                            "type": prop["constructionType"],
+                            "squareFootage": prop["squareFootage"],
+                            "numberOfFloors": prop["numberOfFloors"],
                             "hasFireExtinguisher": False,
                             "groundLevelWaterAppliances": False,
                             "steepRoof": False,
@@ -671,23 +673,23 @@ def step2_1_patch_application(client: ThoreAPIClient, step3_data: Dict[str, Any]
                         },
                         "usage": {
                             "occupancy": "OwnerPrimary",
-                            "numberOfResidents": 2,
+                            "numberOfResidents": prop["numberOfResidents"],
                             "isOccupancyExpectedWithinNumberOfDays": False,
                         }
                     },
                     "geolocation": {
                         "hasCommunitySecurity": False,
                         "isFireStationWithin": "UnderEqualTo5Miles",
-                        "fireProtectionClass": "2",
+                        "fireProtectionClass": prop["fireProtectionClass"],
                         "isFireHydrantWithin": "UnderEqualTo1000FT",
-                        "fireStationName": "NORTH EAST FORT BEND FS 2",
-                        "latitude": "29.646506",
-                        "longitude": "-95.689794",
+                        "fireStationName": prop["fireStationName"],
+                        "latitude": prop["latitude"],
+                        "longitude": prop["longitude"],
                     },
                     "property": {
                         "hasHadPriorInsuranceOnProperty": False,
                         "hasPoolOnPremises": False,
-                        "newPurchaseClosingDate": "2018-11-29T00:00:00.000-06:00",
+                        "newPurchaseClosingDate": prop["purchaseDate"],
                         "isPropertyForSale": False,
                         "hasLargeAcreage": False,
                         "isPropertyOwnedByBusiness": False,
@@ -696,37 +698,33 @@ def step2_1_patch_application(client: ThoreAPIClient, step3_data: Dict[str, Any]
                         "hasSolarPanel": False
 
                     },
-                    "displayDescription": "17426 STRALOCH LN RICHMOND, TX 77407",
+                    "displayDescription": f"{prop['address']} {prop['city']}, {prop['state']} {prop['postalCode']}",
                 },
             }
         ],
         "characteristics": {
             "nonEligibilityAcknowledgement": True,
-            "purchaseDate": "2018-11-29T00:00:00.000-06:00",
-            "termEffectiveDate": "2025-10-24T00:00:00.000-05:00",
+            "purchaseDate": prop["purchaseDate"],
+            "termEffectiveDate": f"{user_input['effectiveDate']}T00:00:00.000-05:00",
             "renewalTerm": 0,
             "isVeriskAPlusRequested": True,
-            "veriskLocationData": "29.646506 | -95.689794 | NORTH EAST FORT BEND FS 2 | UnderEqualTo5Miles | 2",
+            "veriskLocationData": verisk_location_data(prop),
             "veriskLocationAddressInfo": "Verified",
             "isVeriskLocationAccepted": True,
             "veriskLocationOverride": True,
             "quadrINS": {"result": "Unverified"},
-            "veriskLocationActualDistanceToCoast": "51.88",
+            "veriskLocationActualDistanceToCoast": prop["distanceToCoast"],
         },
             "termLength": 525600,
         },
-        "entityType": "PolicyTermTransaction.HOATX",
+        "entityType": client.entity_type,
         "createDate": shared_data["createdate"],
-        "changeDate": _utc_now_iso(),
+        "changeDate": _utc_now_iso(client),
         "createdById": 9742,
         "changedById": 9742,
     }
 
-    resp = client._request("PATCH", url, headers=client.headers(), json=patch_body)
-    while resp.status_code != 204:
-        logger.info(f"Waiting PATCH (Application)... {resp.status_code}")
-        time.sleep(3)
-        resp = client._request("PATCH", url, headers=client.headers(), json=patch_body)
+    versioned_patch(client, url, instance_id, patch_body, "Waiting PATCH (Application)")
     logger.info("✅ Step2.1 completed (Application PATCH).")
 
 
@@ -734,7 +732,8 @@ def step2_1_patch_application(client: ThoreAPIClient, step3_data: Dict[str, Any]
 # Steps 3 – Rule Violation Overrides or run quadrins
 # ------------------------------------------------
 
-def step3_rule_overrides(client: ThoreAPIClient, instance_id: int, resource_identifier: str):
+def step3_rule_overrides(client: ThoreAPIClient, instance_id: int, resource_identifier: str,
+                         idempotency_key: Optional[str] = None):
     base_url = f"{client.base_url}/v1/entityInstanceRuleViolationOverrides"
     payloads = [
         # {
@@ -769,32 +768,22 @@ def step3_rule_overrides(client: ThoreAPIClient, instance_id: int, resource_iden
     #rule definition id 567 is required only when enforcer is hit and then to override rejected response
 
     for i, body in enumerate(payloads, start=1):
-        resp = client._request("POST", base_url, headers=client.headers(), json=body)
-        while resp.status_code != 201:
-            logger.info(f"Waiting RuleOverride number {i}... {resp.status_code}")
-            time.sleep(3)
-            resp = client._request("POST", base_url, headers=client.headers(), json=body)
+        poll_until(client, "POST", base_url, (201,), f"Waiting RuleOverride number {i}", headers=client.headers(), json=body,
+                   idempotency_key=f"{idempotency_key}-{i}" if idempotency_key else None, body="ignore")
         # logger.info(f"✅ Step {i} RuleOverride completed.")
         # logger.info(f"✅ Step 3 RuleOverride completed.")
 
-def step3_run_enforcer(client: ThoreAPIClient, instance_id: int):
-    url = f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX/{instance_id}/actions/RequestThoreQuadrinsValidation"
-    while True:
-        # resp = client._request("POST", url, headers=client.headers(), allow_500=True)
-        resp = client._request("POST", url, headers=client.headers())
-        # if resp.status_code in (200, 500):
-        if resp.status_code in 200:
-            logger.info("Quadrins Enforcer response returned successfully.")
-            try:
-                data = resp.json()
-                return data  # return parsed response JSON
-            except Exception as e:
-                logger.warning(f"⚠️ Could not parse enforcer response JSON: {e}")
-                return None
-        
-        else:
-            logger.info(f"Waiting Run_Enforcer... {resp.status_code}")
-            time.sleep(3)
+def step3_run_enforcer(client: ThoreAPIClient, instance_id: int, idempotency_key: Optional[str] = None):
+    url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}/actions/RequestThoreQuadrinsValidation"
+    resp = poll_until(client, "POST", url, (200,), "Waiting Run_Enforcer", headers=client.headers(),
+                      idempotency_key=idempotency_key)
+    logger.info("Quadrins Enforcer response returned successfully.")
+    try:
+        data = resp.json()
+        return data  # return parsed response JSON
+    except Exception as e:
+        logger.warning(f"⚠️ Could not parse enforcer response JSON: {e}")
+        return None
 
         # while resp.status_code != 200:
         #     logger.info(f"Waiting Run_Enforcer... {resp.status_code}")
@@ -807,13 +796,16 @@ def step3_run_enforcer(client: ThoreAPIClient, instance_id: int):
 # Step 3.1 – Transaction Bind
 # ----------------------------
 
-def step3_1_transaction_bind(client: ThoreAPIClient, instance_id: int):
-    url = f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX/{instance_id}/actions/TransactionBind"
+def step3_1_transaction_bind(client: ThoreAPIClient, instance_id: int, idempotency_key: Optional[str] = None):
+    url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}/actions/TransactionBind"
 
 
     try:
         logger.info(f"Request: POST {url}")
-        resp = client._request("POST", url, headers=client.headers())
+        instance_url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}"
+        resp = client._request("POST", url, headers=client.headers(), idempotency_key=idempotency_key,
+                               recover=status_recovery(client, instance_url, "Bound") if idempotency_key else None,
+                               body="ignore")
         resp.raise_for_status()
         logger.info("✅ Step 3.1 TransactionBind completed successfully.")
         return {"success": True, "message": "Transaction successfully bound."}
@@ -837,19 +829,23 @@ def step3_1_transaction_bind(client: ThoreAPIClient, instance_id: int):
                 friendly_message = "The transaction could not be bound due to invalid status or business rule."
 
             logger.warning(f"⚠️ TransactionBind blocked: {friendly_message}")
-            return {"success": False, "message": friendly_message}
+            return {"success": False, "message": friendly_message, **http_failure(e.response)}
 
         elif e.response.status_code == 500:
             logger.error("❌ Server error during transaction bind.")
-            return {"success": False, "message": "A server error occurred. Please try again later."}
+            return {"success": False, "message": "A server error occurred. Please try again later.",
+                    **http_failure(e.response)}
 
         else:
             logger.error(f"❌ Unexpected HTTP error: {e}")
-            return {"success": False, "message": "An unexpected error occurred. Please contact support."}
+            return {"success": False, "message": "An unexpected error occurred. Please contact support.",
+                    **http_failure(e.response)}
 
+    except DeadlineExceeded:
+        raise  # cut off by the run budget or a step deadline, not a bind failure
     except Exception as e:
         logger.exception("❌ Unexpected failure in step3_1_transaction_bind")
-        return {"success": False, "message": "An unexpected system error occurred."}
+        return {"success": False, "message": "An unexpected system error occurred.", **exception_failure(e)}
 
 
 
@@ -866,13 +862,14 @@ def step3_1_transaction_bind(client: ThoreAPIClient, instance_id: int):
 
 
 
-def step3_1_1_transaction_update_binder(client: ThoreAPIClient, instance_id: int):
-    url = f"{client.base_url}/v1/entityInstances/PolicyTermTransaction.HOATX/{instance_id}/actions/UpdateBinder"
+def step3_1_1_transaction_update_binder(client: ThoreAPIClient, instance_id: int, idempotency_key: Optional[str] = None):
+    url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}/actions/UpdateBinder"
 
 
     try:
         logger.info(f"Request: POST {url}")
-        resp = client._request("POST", url, headers=client.headers())
+        resp = client._request("POST", url, headers=client.headers(), idempotency_key=idempotency_key,
+                               body="ignore")
         resp.raise_for_status()
         logger.info("✅ Step 3.1 UpdateBinder completed successfully.")
         return {"success": True, "message": "Transaction update binder successful."}
@@ -896,28 +893,45 @@ def step3_1_1_transaction_update_binder(client: ThoreAPIClient, instance_id: int
                 friendly_message = "The transaction could not execute update binder due to invalid status or business rule."
 
             logger.warning(f"⚠️ Transactionupdatebinder blocked: {friendly_message}")
-            return {"success": False, "message": friendly_message}
+            return {"success": False, "message": friendly_message, **http_failure(e.response)}
 
         elif e.response.status_code == 500:
             logger.error("❌ Server error during transaction update binder.")
-            return {"success": False, "message": "A server error occurred. Please try again later."}
+            return {"success": False, "message": "A server error occurred. Please try again later.",
+                    **http_failure(e.response)}
 
         else:
             logger.error(f"❌ Unexpected HTTP error: {e}")
-            return {"success": False, "message": "An unexpected error occurred. Please contact support."}
+            return {"success": False, "message": "An unexpected error occurred. Please contact support.",
+                    **http_failure(e.response)}
 
+    except DeadlineExceeded:
+        raise  # cut off by the run budget or a step deadline, not a binder failure
     except Exception as e:
         logger.exception("❌ Unexpected failure in step3_1_1_transaction_update_binder")
-        return {"success": False, "message": "An unexpected system error occurred."}
+        return {"success": False, "message": "An unexpected system error occurred.", **exception_failure(e)}
 
 
 
-def step3_2_transaction_issue(client: ThoreAPIClient, instance_id: int):
+def step3_2_transaction_issue(client: ThoreAPIClient, instance_id: int, idempotency_key: Optional[str] = None,
+                              transaction_id: Optional[int] = None):
+    """
+    IssueNewBusiness on the PolicyTerm instance_id. With transaction_id (the
+    bound transaction), a retry after a lost response first checks whether
+    that transaction is already Issued.
+    """
     url = f"{client.base_url}/v1/entityInstances/PolicyTerms/{instance_id}/actions/IssueNewBusiness"
 
     try:
-        resp = client._request("POST", url, headers=client.headers())
+        recover = None
+        if idempotency_key and transaction_id:
+            transaction_url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{transaction_id}"
+            recover = status_recovery(client, transaction_url, "Issued")
+        resp = client._request("POST", url, headers=client.headers(), idempotency_key=idempotency_key,
+                               recover=recover, body="ignore")
         resp.raise_for_status()  # Raises HTTPError for non-2xx
+        if transaction_id and response_version(resp) is None:
+            bump_version(transaction_id)  # issuing wrote the transaction; a recovered GET already tracked it
         logger.info("✅ Step 3.2 TransactionIssue completed successfully.")
         return {"success": True, "message": "Policy issued successfully."}
 
@@ -938,19 +952,23 @@ def step3_2_transaction_issue(client: ThoreAPIClient, instance_id: int):
                 friendly_message = "The policy could not be issued due to a validation rule."
 
             logger.warning(f"⚠️ IssueNewBusiness blocked: {friendly_message}")
-            return {"success": False, "message": friendly_message}
+            return {"success": False, "message": friendly_message, **http_failure(e.response)}
 
         elif e.response.status_code == 500:
             logger.error("❌ Server error during policy issue.")
-            return {"success": False, "message": "A server error occurred. Please try again later."}
+            return {"success": False, "message": "A server error occurred. Please try again later.",
+                    **http_failure(e.response)}
 
         else:
             logger.error(f"❌ Unexpected error: {e}")
-            return {"success": False, "message": "An unexpected error occurred. Please contact support."}
+            return {"success": False, "message": "An unexpected error occurred. Please contact support.",
+                    **http_failure(e.response)}
 
+    except DeadlineExceeded:
+        raise  # cut off by the run budget or a step deadline, not an issue failure
     except Exception as e:
         logger.exception("❌ Unexpected failure in step3_2_transaction_issue")
-        return {"success": False, "message": "An unexpected system error occurred."}
+        return {"success": False, "message": "An unexpected system error occurred.", **exception_failure(e)}
 
 
     
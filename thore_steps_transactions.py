@@ -0,0 +1,195 @@
+# file: thore_steps_transactions.py
+import logging
+import re
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+import requests
+from thore_client import (ThoreAPIClient, DeadlineExceeded, poll_until, build_response, server_now, status_recovery,
+                          bump_version, response_version)
+from thore_failures import http_failure, exception_failure
+from thore_steps import iter_children
+from thore_versions import versioned_patch
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Follow-on transactions on an issued PolicyTerm
+# ----------------------------
+# An endorsement or cancellation starts as an action on the PolicyTerm that
+# creates a new PolicyTermTransaction.HOATX (Location header), is bound
+# with TransactionBind like new business and is issued on the PolicyTerm.
+
+TRANSACTION_ACTIONS = {
+    # kind -> (start action, issue action)
+    "endorsement": ("CreateEndorsement", "IssueEndorsement"),
+    "cancellation": ("CreateCancellation", "IssueCancellation"),
+}
+CANCELLATION_REASON = "InsuredRequest"
+
+
+def step_start_transaction(client: ThoreAPIClient, policyterm_id: int, kind: str, body: Dict[str, Any],
+                           idempotency_key: Optional[str] = None) -> int:
+    """
+    Start an endorsement or cancellation on a PolicyTerm.
+    Returns the instance ID of the new PolicyTermTransaction.
+    With an idempotency_key, a retried POST first looks for the transaction
+    an earlier (timed out) attempt may already have started.
+    """
+    action = TRANSACTION_ACTIONS[kind][0]
+    url = f"{client.base_url}/v1/entityInstances/PolicyTerms/{policyterm_id}/actions/{action}"
+
+    recover = None
+    if idempotency_key:
+        started = server_now(client.base_url)
+
+        def recover():
+            existing_id = find_started_transaction(client, policyterm_id, started)
+            if existing_id is None:
+                return None
+            location = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{existing_id}"
+            return build_response(201, {"Location": location}, url=url)
+
+    resp = client._request("POST", url, headers=client.headers(), json=body, idempotency_key=idempotency_key,
+                           recover=recover, body="ignore")
+
+    location = resp.headers.get("Location") or resp.headers.get("location")
+    match = re.search(r"/(\d+)$", location or "")
+    if not match:
+        raise RuntimeError(f"{action} on PolicyTerm {policyterm_id} returned no transaction Location "
+                           f"(status {resp.status_code})")
+    instance_id = int(match.group(1))
+    client.known_instances.add(instance_id)
+
+    logger.info(f"✅ {action} started on PolicyTerm {policyterm_id}: instanceId={instance_id}")
+    return instance_id
+
+
+def find_started_transaction(client: ThoreAPIClient, policyterm_id: int, created_after: datetime) -> Optional[int]:
+    """
+    The one transaction of the PolicyTerm created at or after created_after
+    and not already owned by this client, or None (see find_created_policy).
+    """
+    url = (
+        f"{client.base_url}/v1/entityInstances/PolicyTerms/{policyterm_id}/children"
+        f"?childTypeGroup={client.entity_type}"
+    )
+    matches = []
+    try:
+        for item in iter_children(client, url):
+            try:
+                created = datetime.fromisoformat(item["createDate"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if created >= created_after.replace(microsecond=0) and item.get("id") not in client.known_instances:
+                matches.append(item["id"])
+    except Exception as e:
+        logger.warning(f"Could not look up transactions of PolicyTerm {policyterm_id}: {e}")
+        return None
+
+    if len(matches) == 1 and client.claim_instance(matches[0]):
+        logger.info(f"Found transaction {matches[0]} started by an earlier attempt")
+        return matches[0]
+    if matches:
+        logger.warning(f"{len(matches)} candidate transactions for a retried start; starting a new one")
+    return None
+
+
+def step_start_endorsement(client: ThoreAPIClient, policyterm_id: int, user_input: Dict[str, Any],
+                           idempotency_key: Optional[str] = None) -> int:
+    body = {"effectiveDate": user_input["effectiveDateIso"]}
+    return step_start_transaction(client, policyterm_id, "endorsement", body, idempotency_key)
+
+
+def step_start_cancellation(client: ThoreAPIClient, policyterm_id: int, user_input: Dict[str, Any],
+                            idempotency_key: Optional[str] = None) -> int:
+    body = {"effectiveDate": user_input["effectiveDateIso"], "reasons": [{"code": CANCELLATION_REASON}]}
+    return step_start_transaction(client, policyterm_id, "cancellation", body, idempotency_key)
+
+
+# ----------------------------
+# Endorsement change
+# ----------------------------
+
+def step_patch_endorsement(client: ThoreAPIClient, instance_id: int, user_input: Dict[str, Any]) -> None:
+    """
+    PATCH the endorsement with the run's contact details: the transaction is
+    read back and the primary named insured's phone and email are replaced,
+    everything else is sent unchanged.
+    """
+    url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{instance_id}"
+    instance = poll_until(client, "GET", url, (200,), "Waiting for endorsement", headers=client.headers()).json()
+
+    interests = instance.get("data", {}).get("interests") or []
+    insured = next((i for i in interests if i.get("type") == "NamedInsured"), None)
+    if insured is None:
+        raise RuntimeError(f"No named insured on endorsement instance_id={instance_id}")
+    characteristics = insured.setdefault("characteristics", {})
+    characteristics["phones"] = [{"type": "Mobile", "number": user_input["phone"]}]
+    characteristics["emails"] = [{"address": user_input["email"]}]
+
+    versioned_patch(client, url, instance_id, instance, "Waiting PATCH (Endorsement)")
+    logger.info(f"✅ Endorsement {instance_id} updated (contact details).")
+
+
+# ----------------------------
+# Issue
+# ----------------------------
+
+def step_issue_transaction(client: ThoreAPIClient, policyterm_id: int, kind: str,
+                           idempotency_key: Optional[str] = None,
+                           transaction_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Issue the bound endorsement or cancellation of a PolicyTerm; returns
+    {"success", "message"}. With transaction_id, a retry first checks
+    whether that transaction is already Issued.
+    """
+    action = TRANSACTION_ACTIONS[kind][1]
+    url = f"{client.base_url}/v1/entityInstances/PolicyTerms/{policyterm_id}/actions/{action}"
+
+    try:
+        recover = None
+        if idempotency_key and transaction_id:
+            transaction_url = f"{client.base_url}/v1/entityInstances/{client.entity_type}/{transaction_id}"
+            recover = status_recovery(client, transaction_url, "Issued")
+        resp = client._request("POST", url, headers=client.headers(), idempotency_key=idempotency_key,
+                               recover=recover, body="ignore")
+        resp.raise_for_status()
+        if transaction_id and response_version(resp) is None:
+            bump_version(transaction_id)  # issuing wrote the transaction; a recovered GET already tracked it
+        logger.info(f"✅ {action} completed successfully.")
+        return {"success": True, "message": f"{kind.capitalize()} issued successfully."}
+
+    except requests.exceptions.HTTPError as e:
+        if e.response.status_code == 409:
+            try:
+                error_json = e.response.json()
+                description = error_json.get("description", "Action could not be completed.")
+                rule_message = (
+                    error_json.get("messages", [{}])[0]
+                    .get("description", "")
+                    .replace("PLEASE IGNORE. INTERNAL.", "")
+                    .strip()
+                )
+                friendly_message = f"{description} {rule_message}".strip()
+            except Exception:
+                friendly_message = f"The {kind} could not be issued due to a validation rule."
+
+            logger.warning(f"⚠️ {action} blocked: {friendly_message}")
+            return {"success": False, "message": friendly_message, **http_failure(e.response)}
+
+        elif e.response.status_code == 500:
+            logger.error(f"❌ Server error during {kind} issue.")
+            return {"success": False, "message": "A server error occurred. Please try again later.",
+                    **http_failure(e.response)}
+
+        else:
+            logger.error(f"❌ Unexpected error: {e}")
+            return {"success": False, "message": "An unexpected error occurred. Please contact support.",
+                    **http_failure(e.response)}
+
+    except DeadlineExceeded:
+        raise  # cut off by the run budget or a step deadline, not an issue failure
+    except Exception as e:
+        logger.exception(f"❌ Unexpected failure in {action}")
+        return {"success": False, "message": "An unexpected system error occurred.", **exception_failure(e)}
@@ -0,0 +1,253 @@
+# file: thore_synthetic.py
+import argparse
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Any, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Synthetic applicants and properties
+# ----------------------------
+# With the same dwelling on every policy the server answers rating, Verisk
+# and rule lookups from warm caches and load numbers come out too good. A
+# seeded generator varies the applicant and the property of each policy
+# within valid ranges instead; the same seed always yields the same batch.
+# Columns are drawn with numpy for the whole batch at once (100k rows in
+# about a second) and become per-policy "birthDate" and "property" fields of
+# the applicant rows (see thore_precompute), which the PATCH builders in
+# thore_steps_extended read instead of DEFAULT_PROPERTY.
+
+# The dwelling every policy used before the generator
+DEFAULT_PROPERTY: Dict[str, Any] = {
+    "address": "17426 STRALOCH LN",
+    "city": "RICHMOND",
+    "state": "TX",
+    "postalCode": "77407",
+    "county": "FORT BEND",
+    "latitude": "29.646506",
+    "longitude": "-95.689794",
+    "distanceToCoast": "51.88",
+    "fireStationName": "NORTH EAST FORT BEND FS 2",
+    "fireProtectionClass": "2",
+    "isFireStationWithin": "UnderEqualTo5Miles",
+    "isFireHydrantWithin": "UnderEqualTo1000FT",
+    "dwelling": 740000,
+    "personalProperty": 0.25,
+    "lossOfUse": 0.1,
+    "personalLiability": 25000,
+    "constructionType": "BrickVeneer",
+    "squareFootage": 3748,
+    "numberOfFloors": "1.5Story",
+    "constructedDate": "2018-01-01T00:00:00.000-06:00",
+    "roofInstallationDate": "2018-01-01T00:00:00.000-06:00",
+    "purchaseDate": "2018-11-29T00:00:00.000-06:00",
+    "numberOfResidents": 2,
+}
+DEFAULT_BIRTH_DATE = "1980-01-01T00:00:00.000-06:00"
+
+# (city, county, postal codes, latitude, longitude, miles to the coast, phone area codes)
+CITIES = (
+    ("RICHMOND", "FORT BEND", ("77406", "77407", "77469"), 29.5822, -95.7608, 52.0, ("281", "832")),
+    ("SUGAR LAND", "FORT BEND", ("77478", "77479", "77498"), 29.6197, -95.6349, 49.0, ("281", "832")),
+    ("KATY", "HARRIS", ("77449", "77450", "77494"), 29.7858, -95.8245, 68.0, ("281", "832", "346")),
+    ("HOUSTON", "HARRIS", ("77024", "77055", "77079", "77082"), 29.7604, -95.3698, 50.0, ("713", "832", "346")),
+    ("CYPRESS", "HARRIS", ("77429", "77433"), 29.9691, -95.6972, 74.0, ("281", "832")),
+    ("THE WOODLANDS", "MONTGOMERY", ("77380", "77381", "77382"), 30.1658, -95.4613, 85.0, ("281", "936")),
+    ("SAN ANTONIO", "BEXAR", ("78230", "78249", "78258"), 29.4241, -98.4936, 140.0, ("210", "726")),
+    ("AUSTIN", "TRAVIS", ("78731", "78745", "78759"), 30.2672, -97.7431, 160.0, ("512", "737")),
+    ("PLANO", "COLLIN", ("75023", "75024", "75093"), 33.0198, -96.6989, 280.0, ("972", "469")),
+    ("FRISCO", "COLLIN", ("75033", "75034"), 33.1507, -96.8236, 290.0, ("972", "469")),
+)
+STREETS = (
+    "STRALOCH", "OAK HOLLOW", "CEDAR RIDGE", "WILLOW BEND", "MAPLE BROOK", "PECAN GROVE", "BLUEBONNET",
+    "RIVER BIRCH", "SHADOW CREEK", "STONE MEADOW", "AUTUMN TRAIL", "HIGHLAND PARK", "LAUREL OAKS",
+    "MEADOW LARK", "SUMMIT RIDGE", "FALCON POINT", "HERITAGE", "LAKE FOREST", "PRAIRIE VIEW", "SILVER SAGE",
+    "TIMBER LINE", "WESTHEIMER", "BRAZOS", "SPRING CYPRESS", "MOCKINGBIRD", "CANYON GATE", "RED OAK",
+)
+STREET_SUFFIXES = ("LN", "DR", "CT", "WAY", "ST", "TRL", "BLVD", "CIR")
+FIRST_NAMES = (
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Carlos", "Maria",
+    "Daniel", "Karen", "Matthew", "Nancy", "Anthony", "Lisa", "Mark", "Sandra", "Luis", "Ana", "Kevin",
+    "Ashley", "Brian", "Emily", "Jose", "Michelle", "Nguyen", "Priya", "Wei", "Fatima",
+)
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson",
+    "Walker", "Young", "Allen", "King", "Tran", "Patel", "Nguyen", "Kim", "Chen", "Hill",
+)
+
+# Value ranges and the choices the product accepts
+DWELLING_RANGE = (150000, 1500000)        # Coverage A, rounded to 1000
+DWELLING_MEDIAN = 420000
+COST_PER_SQFT_RANGE = (140.0, 260.0)      # replacement cost, gives squareFootage from the dwelling limit
+SQUARE_FOOTAGE_RANGE = (900, 7500)
+CONSTRUCTION_TYPES = (("BrickVeneer", 0.55), ("Frame", 0.3), ("Masonry", 0.15))
+FLOORS = (("1Story", 0.45), ("1.5Story", 0.2), ("2Story", 0.35))
+PERSONAL_PROPERTY = (0.25, 0.5)           # fraction of the dwelling limit
+LOSS_OF_USE = (0.1, 0.2)
+PERSONAL_LIABILITY = (25000, 50000, 100000, 300000)
+FIRE_PROTECTION_CLASSES = (("1", 0.1), ("2", 0.35), ("3", 0.3), ("4", 0.2), ("5", 0.05))
+OLDEST_YEAR_BUILT = 1960
+APPLICANT_AGES = (25, 80)
+GEO_JITTER = 0.04                         # degrees around the city center
+COAST_JITTER = 6.0                        # miles
+
+
+def _choice(rng: np.random.Generator, weighted, n: int) -> np.ndarray:
+    values, weights = zip(*weighted)
+    return rng.choice(np.array(values, dtype=object), size=n, p=np.array(weights) / sum(weights))
+
+
+def _dates(years: np.ndarray, months: np.ndarray, days: np.ndarray) -> List[str]:
+    return [f"{y:04d}-{m:02d}-{d:02d}T00:00:00.000-06:00"
+            for y, m, d in zip(years.tolist(), months.tolist(), days.tolist())]
+
+
+def synthetic_columns(base: Dict[str, Any], num_policies: int, seed: int) -> Dict[str, List[Any]]:
+    """
+    Applicant columns for num_policies policies (see thore_precompute), with
+    the effective date fields of the derived form row `base` and a
+    generated applicant (name, phone, email, birthDate) and property per
+    policy. Deterministic for a seed.
+    """
+    n = num_policies
+    rng = np.random.default_rng(seed)
+    effective_year = int(base["effectiveDate"][:4])
+
+    # -- location --
+    city_index = rng.integers(0, len(CITIES), n)
+    zip_pick = rng.random(n)
+    house = rng.integers(100, 29999, n)
+    street = rng.integers(0, len(STREETS), n)
+    suffix = rng.integers(0, len(STREET_SUFFIXES), n)
+    centers = np.array([(c[3], c[4], c[5]) for c in CITIES])[city_index]
+    latitude = centers[:, 0] + rng.uniform(-GEO_JITTER, GEO_JITTER, n)
+    longitude = centers[:, 1] + rng.uniform(-GEO_JITTER, GEO_JITTER, n)
+    coast = np.maximum(5.0, centers[:, 2] + rng.uniform(-COAST_JITTER, COAST_JITTER, n))
+    station = rng.integers(1, 12, n)
+    fire_class = _choice(rng, FIRE_PROTECTION_CLASSES, n)
+
+    # -- limits and construction --
+    dwelling = np.exp(rng.normal(np.log(DWELLING_MEDIAN), 0.45, n))
+    dwelling = np.clip(np.round(dwelling, -3), *DWELLING_RANGE).astype(np.int64)
+    sqft = np.clip(dwelling / rng.uniform(*COST_PER_SQFT_RANGE, n), *SQUARE_FOOTAGE_RANGE).astype(np.int64)
+    construction = _choice(rng, CONSTRUCTION_TYPES, n)
+    floors = _choice(rng, FLOORS, n)
+    personal_property = rng.choice(PERSONAL_PROPERTY, n)
+    loss_of_use = rng.choice(LOSS_OF_USE, n)
+    liability = rng.choice(PERSONAL_LIABILITY, n)
+    residents = rng.integers(1, 7, n)
+
+    # -- dates: roof and purchase not before construction, all before the effective year --
+    built = rng.integers(OLDEST_YEAR_BUILT, effective_year, n)
+    roof = np.minimum(effective_year - 1, built + rng.integers(0, 25, n))
+    purchase = np.minimum(effective_year - 1, built + rng.integers(0, 30, n))
+    months = rng.integers(1, 13, (4, n))
+    days = rng.integers(1, 29, (4, n))
+
+    # -- applicant --
+    first = np.array(FIRST_NAMES, dtype=object)[rng.integers(0, len(FIRST_NAMES), n)].tolist()
+    last = np.array(LAST_NAMES, dtype=object)[rng.integers(0, len(LAST_NAMES), n)].tolist()
+    area_pick = rng.random(n)
+    line = rng.integers(2000000, 9999999, n)
+    born = effective_year - rng.integers(APPLICANT_AGES[0], APPLICANT_AGES[1] + 1, n)
+
+    city_index = city_index.tolist()
+    postal = [CITIES[c][2][int(p * len(CITIES[c][2]))] for c, p in zip(city_index, zip_pick.tolist())]
+    phone = [f"{CITIES[c][6][int(p * len(CITIES[c][6]))]}{l}"
+             for c, p, l in zip(city_index, area_pick.tolist(), line.tolist())]
+    constructed = _dates(built, months[0], days[0])
+    # ISO dates compare as strings; a roof or purchase in the year built is not before construction
+    roof_installed = [max(c, r) for c, r in zip(constructed, _dates(roof, months[1], days[1]))]
+    purchased = [max(c, p) for c, p in zip(constructed, _dates(purchase, months[2], days[2]))]
+    properties = [
+        {
+            "address": f"{h} {STREETS[s]} {STREET_SUFFIXES[x]}",
+            "city": CITIES[c][0],
+            "state": "TX",
+            "postalCode": z,
+            "county": CITIES[c][1],
+            "latitude": f"{lat:.6f}",
+            "longitude": f"{lon:.6f}",
+            "distanceToCoast": f"{miles:.2f}",
+            "fireStationName": f"{CITIES[c][0]} FS {fs}",
+            "fireProtectionClass": fc,
+            "isFireStationWithin": "UnderEqualTo5Miles",
+            "isFireHydrantWithin": "UnderEqualTo1000FT",
+            "dwelling": dw,
+            "personalProperty": pp,
+            "lossOfUse": lou,
+            "personalLiability": pl,
+            "constructionType": ct,
+            "squareFootage": sq,
+            "numberOfFloors": fl,
+            "constructedDate": cd,
+            "roofInstallationDate": rd,
+            "purchaseDate": pd,
+            "numberOfResidents": nr,
+        }
+        for h, s, x, c, z, lat, lon, miles, fs, fc, dw, pp, lou, pl, ct, sq, fl, cd, rd, pd, nr in zip(
+            house.tolist(), street.tolist(), suffix.tolist(), city_index, postal, latitude.tolist(),
+            longitude.tolist(), coast.tolist(), station.tolist(), fire_class.tolist(), dwelling.tolist(),
+            personal_property.tolist(), loss_of_use.tolist(), liability.tolist(), construction.tolist(),
+            sqft.tolist(), floors.tolist(), constructed, roof_installed, purchased, residents.tolist())
+    ]
+
+    columns = {name: [base[name]] * n for name in ("effectiveDate", "effectiveDateIso", "effectiveDateTime")}
+    columns.update(
+        firstName=first,
+        lastName=last,
+        displayName=[f"{f} {l}" for f, l in zip(first, last)],
+        phone=phone,
+        # policy numbers keep emails distinct across the batch
+        email=[f"{f.lower()}.{l.lower()}{i + 1}@example.com" for i, (f, l) in enumerate(zip(first, last))],
+        birthDate=_dates(born, months[3], days[3]),
+        property=properties,
+    )
+    return columns
+
+
+# ----------------------------
+# Payload helpers
+# ----------------------------
+
+def property_of(user_input: Dict[str, Any]) -> Dict[str, Any]:
+    """The policy's generated property, or DEFAULT_PROPERTY."""
+    return user_input.get("property") or DEFAULT_PROPERTY
+
+
+def verisk_location_data(prop: Dict[str, Any]) -> str:
+    """characteristics.veriskLocationData as Verisk reports it: lat | long | station | distance | class."""
+    return (f"{prop['latitude']} | {prop['longitude']} | {prop['fireStationName']} | "
+            f"{prop['isFireStationWithin']} | {prop['fireProtectionClass']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic applicants and properties")
+    parser.add_argument("--policies", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--effective-date", default=datetime.now().strftime("%Y-%m-%d"))
+    parser.add_argument("--show", type=int, default=3, help="rows to print")
+    args = parser.parse_args()
+
+    from thore_precompute import applicant_row
+    base = applicant_row({"effectiveDate": args.effective_date, "firstName": "-", "lastName": "-",
+                          "email": "x@example.com", "phone": "0000000000"})
+    start = time.perf_counter()
+    columns = synthetic_columns(base, args.policies, args.seed)
+    seconds = time.perf_counter() - start
+    rows = [{name: column[i] for name, column in columns.items()} for i in range(min(args.show, args.policies))]
+    print(json.dumps(rows, indent=2))
+    distinct = len({p["address"] + p["postalCode"] for p in columns["property"]})
+    print(f"{args.policies} records ({distinct} distinct addresses) in {seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
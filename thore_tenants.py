@@ -0,0 +1,266 @@
+# file: thore_tenants.py
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+from typing import Dict, Any, List, Iterator, Optional, Callable, Tuple
+
+import streamlit as st
+
+from thore_client import (ThoreAPIClient, BASE_URL, USERNAME, PASSWORD, APPLICATION_KEY, AGENCY_ID, PRODUCT)
+from thore_failures import classify_failure
+from thore_precompute import precompute_batch
+from thore_runner import run_policy, run_jobs
+from thore_runs import bind
+from thore_workflow import DEFAULT_WORKFLOW, get_compiled_workflow
+
+logger = logging.getLogger(__name__)
+
+# JSON list of tenants, used when st.secrets has no [[tenants]] tables
+TENANTS_FILE = os.getenv("THORE_TENANTS_FILE", "thore_tenants.json")
+
+# Product the bundled workflows (workflows/hoatx_*.json) build payloads for
+WORKFLOW_PRODUCT = "HOATX"
+
+# ----------------------------
+# Tenants
+# ----------------------------
+# A tenant is one environment (base URL), credential set and agency/product
+# policies are created under, with its own rate budget: how many policies
+# it may have in flight. Configured as [[tenants]] tables in
+# .streamlit/secrets.toml (or the JSON file above), e.g.
+#
+#   [[tenants]]
+#   name = "sandbox-49"
+#   agency_id = 49
+#   concurrency = 8
+#
+#   [[tenants]]
+#   name = "sandbox-52-dp3"
+#   agency_id = 52
+#   product = "DP3TX"
+#   workflow = "workflows/dp3tx_new_business.json"
+#   username = "..."
+#   password_env = "THORE_DP3_PASSWORD"   # read from the environment instead
+#
+# Fields left out fall back to the top-level secrets (BASE_URL, USERNAME,
+# PASSWORD, APPLICATION_KEY, AGENCY_ID, PRODUCT). A tenant with a workflow
+# runs it instead of the batch's; the bundled workflows are HOATX-only, so
+# any other product needs one.
+
+
+class Tenant:
+    """One environment/credential/agency/product and its concurrency budget."""
+
+    def __init__(self, name: str, base_url: str = BASE_URL, username: str = USERNAME, password: str = PASSWORD,
+                 application_key: str = APPLICATION_KEY, agency_id: int = AGENCY_ID, product: str = PRODUCT,
+                 concurrency: int = 4, workflow: Optional[str] = None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.username = username
+        self.password = password
+        self.application_key = application_key
+        self.agency_id = int(agency_id)
+        self.product = product
+        self.concurrency = max(1, int(concurrency))
+        self.workflow = os.path.abspath(workflow) if workflow else None
+
+    @property
+    def key(self) -> Tuple[str, str, int, str]:
+        """Tenants with the same key share one client (and its connection pool and token)."""
+        return self.base_url, self.username, self.agency_id, self.product
+
+    @classmethod
+    def from_dict(cls, entry: Dict[str, Any]) -> "Tenant":
+        entry = dict(entry)
+        if entry.get("password_env"):
+            entry["password"] = os.environ[entry.pop("password_env")]
+        known = ("name", "base_url", "username", "password", "application_key", "agency_id", "product",
+                 "concurrency", "workflow")
+        unknown = set(entry) - set(known)
+        if unknown:
+            raise ValueError(f"Unknown tenant field(s) {sorted(unknown)} in {entry.get('name')!r}")
+        product = entry.get("product", PRODUCT)
+        entry.setdefault("name", f"{product}-{entry.get('agency_id', AGENCY_ID)}")
+        if product != WORKFLOW_PRODUCT and not entry.get("workflow"):
+            raise ValueError(f"Tenant {entry['name']!r} is for {product} but has no workflow; "
+                             f"the bundled workflows build {WORKFLOW_PRODUCT} payloads")
+        return cls(**entry)
+
+    def describe(self) -> Dict[str, Any]:
+        """The tenant without its secrets."""
+        return {"name": self.name, "baseUrl": self.base_url, "username": self.username,
+                "agencyId": self.agency_id, "product": self.product, "concurrency": self.concurrency,
+                "workflow": self.workflow}
+
+
+def load_tenants(path: str = TENANTS_FILE) -> List[Tenant]:
+    """Tenants from st.secrets [[tenants]], else from the JSON file; empty when neither is configured."""
+    entries = st.secrets.get("tenants")
+    if entries is None and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    tenants = [Tenant.from_dict(entry) for entry in entries or []]
+    names = [tenant.name for tenant in tenants]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Tenant names must be unique, got {names}")
+    return tenants
+
+
+# ----------------------------
+# Client registry
+# ----------------------------
+
+class ClientRegistry:
+    """
+    One pooled, authenticated client per tenant key, created on first use
+    and shared by every thread asking for it (thread-safe).
+    """
+
+    def __init__(self, http2: Optional[bool] = None):
+        self.http2 = http2
+        self._clients: Dict[Tuple[str, str, int, str], ThoreAPIClient] = {}
+        self._locks: Dict[Tuple[str, str, int, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def client(self, tenant: Tenant, pool_size: Optional[int] = None) -> ThoreAPIClient:
+        with self._lock:
+            lock = self._locks.setdefault(tenant.key, threading.Lock())
+        # authenticate outside the registry lock so tenants log in in parallel
+        with lock:
+            client = self._clients.get(tenant.key)
+            if client is None:
+                client = ThoreAPIClient(pool_size=pool_size or tenant.concurrency, http2=self.http2,
+                                        base_url=tenant.base_url, username=tenant.username,
+                                        password=tenant.password, application_key=tenant.application_key,
+                                        agency_id=tenant.agency_id, product=tenant.product)
+                client.authenticate()
+                self._clients[tenant.key] = client
+                logger.info(f"🏢 Client ready for tenant {tenant.name} ({tenant.product} agency {tenant.agency_id} "
+                            f"on {tenant.base_url})")
+        return client
+
+    def clients(self) -> Dict[Tuple[str, str, int, str], ThoreAPIClient]:
+        with self._lock:
+            return dict(self._clients)
+
+    def close(self) -> None:
+        for client in self.clients().values():
+            client.close()
+        with self._lock:
+            self._clients.clear()
+
+
+# ----------------------------
+# Scheduling across tenants
+# ----------------------------
+
+def split_policies(tenants: List[Tenant], num_policies: int) -> List[int]:
+    """Policies per tenant in proportion to their concurrency (largest remainder)."""
+    total = sum(tenant.concurrency for tenant in tenants)
+    shares = [num_policies * tenant.concurrency / total for tenant in tenants]
+    counts = [int(share) for share in shares]
+    by_remainder = sorted(range(len(tenants)), key=lambda i: shares[i] - counts[i], reverse=True)
+    for i in by_remainder[:num_policies - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+def _tenant_failed(job: Dict[str, Any], tenant: Tenant, e: Exception) -> Dict[str, Any]:
+    outcome = {"policyRun": job["policy_run"], "status": "error", "result": None, "step": "authenticate",
+               "message": f"Tenant {tenant.name} unavailable: {e}", "tenant": tenant.name, "timings": {}}
+    outcome["failure"] = classify_failure(outcome, e)
+    # nothing ran yet: a re-drive starts the policy from the beginning on the same tenant
+    outcome["resume"] = {"userInput": job["user_input"], "stepsToRun": list(job["steps_to_run"]),
+                         "workflowPath": job["workflow_path"], "step": None, "state": {}, "scratch": {},
+                         "tenant": tenant.name}
+    return outcome
+
+
+def run_tenants(registry: ClientRegistry, tenants: List[Tenant], user_input: Dict[str, Any],
+                steps_to_run: List[str], num_policies: int, workflow_path: str = DEFAULT_WORKFLOW,
+                policy_fn: Callable[..., Dict[str, Any]] = run_policy,
+                run_deadline: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Spread a batch over the tenants in proportion to their concurrency and
+    run every tenant's share at the same time, each on its own client with
+    up to tenant.concurrency policies in flight (see run_jobs). A tenant
+    with its own workflow runs that one, with the same stage names, instead
+    of workflow_path; it is checked for the batch's stages before any
+    policy starts. Outcomes carry the tenant's name and are yielded as they
+    finish, from whichever tenant. A tenant that cannot authenticate fails its own share only.
+    Failed outcomes name the tenant in their resume state too, so a
+    dead-letter re-drive runs them on the same tenant (see thore_deadletter).
+    """
+    if not tenants:
+        raise ValueError("run_tenants needs at least one tenant")
+    for tenant in tenants:
+        # a tenant workflow without the batch's stages fails here, not in every policy of the tenant
+        if tenant.workflow:
+            stages = {step.stage for step in get_compiled_workflow(tenant.workflow, tuple(steps_to_run))}
+            missing = [stage for stage in steps_to_run if stage not in stages]
+            if missing:
+                raise ValueError(f"Workflow {tenant.workflow} of tenant {tenant.name} has no {', '.join(missing)}")
+    applicants = precompute_batch(user_input, num_policies)
+    outcomes: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+
+    def drive(tenant: Tenant, jobs: List[Dict[str, Any]]) -> None:
+        try:
+            try:
+                client = registry.client(tenant)
+            except Exception as e:
+                logger.error(f"❌ Tenant {tenant.name} could not authenticate: {e}")
+                for job in jobs:
+                    outcomes.put(_tenant_failed(job, tenant, e))
+                return
+            for outcome in run_jobs(client, jobs, tenant.concurrency, policy_fn):
+                outcome["tenant"] = tenant.name
+                if outcome.get("resume"):
+                    outcome["resume"]["tenant"] = tenant.name
+                outcomes.put(outcome)
+        finally:
+            outcomes.put(None)
+
+    drivers = []
+    start = 0
+    for tenant, count in zip(tenants, split_policies(tenants, num_policies)):
+        if not count:
+            continue
+        jobs = [
+            {"user_input": applicants.row(i), "steps_to_run": steps_to_run, "policy_run": i + 1,
+             "workflow_path": tenant.workflow or workflow_path, "run_deadline": run_deadline}
+            for i in range(start, start + count)
+        ]
+        start += count
+        logger.info(f"🏢 Tenant {tenant.name}: policies #{jobs[0]['policy_run']}-#{jobs[-1]['policy_run']}, "
+                    f"{tenant.concurrency} at a time")
+        drivers.append(threading.Thread(target=bind(drive), args=(tenant, jobs), name=f"thore-tenant-{tenant.name}",
+                                        daemon=True))
+    for driver in drivers:
+        driver.start()
+
+    running = len(drivers)
+    while running:
+        outcome = outcomes.get()
+        if outcome is None:
+            running -= 1
+        else:
+            yield outcome
+    for driver in drivers:
+        driver.join()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="List the configured tenants and how a batch would be spread")
+    parser.add_argument("--file", default=TENANTS_FILE)
+    parser.add_argument("--policies", type=int, default=0, help="show the split of this many policies")
+    args = parser.parse_args()
+    tenants = load_tenants(args.file)
+    split = split_policies(tenants, args.policies) if tenants and args.policies else [0] * len(tenants)
+    print(json.dumps([dict(tenant.describe(), policies=count) for tenant, count in zip(tenants, split)], indent=2))
+
+
+if __name__ == "__main__":
+    main()
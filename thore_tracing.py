@@ -0,0 +1,266 @@
+# file: thore_tracing.py
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import re
+import secrets
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = "traces.jsonl"
+SERVICE_NAME = "thore-policy-automation"
+
+# ----------------------------
+# Spans
+# ----------------------------
+# Spans are written as OTLP/JSON (one ExportTraceServiceRequest per line),
+# the format of the OpenTelemetry collector's file exporter, so the files
+# load with the otlpjsonfile receiver or any OTLP-aware viewer.
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else ""
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 3 if self.name.startswith("HTTP ") else 1,  # CLIENT / INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Tracer:
+    """Buffers finished spans and appends them to a JSON Lines file (thread-safe)."""
+
+    def __init__(self, path: str, flush_every: int = 200):
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer: List[Span] = []
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def finish(self, span: Span) -> None:
+        span.end_ns = time.time_ns()
+        with self._lock:
+            self._buffer.append(span)
+            if len(self._buffer) >= self.flush_every or not span.parent_id:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._buffer:
+            return
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [
+                _attribute("service.name", SERVICE_NAME),
+                _attribute("process.pid", os.getpid()),
+                _attribute("host.name", socket.gethostname()),
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": "thore_tracing"},
+                "spans": [span.to_otlp() for span in self._buffer],
+            }],
+        }]}, separators=(",", ":"))
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        self._buffer = []
+
+
+# Tracer of the current run (see thore_runs.bind for pool threads); falls
+# back to the process tracer set by THORE_TRACE_FILE or set_process_tracer.
+TRACER: ContextVar[Optional[Tracer]] = ContextVar("thore_tracer", default=None)
+CURRENT_SPAN: ContextVar[Optional[Span]] = ContextVar("thore_span", default=None)
+_process_tracer: Optional[Tracer] = None
+
+
+def set_process_tracer(path: Optional[str]) -> Optional[Tracer]:
+    """Trace everything in this process to `path` (None turns it off)."""
+    global _process_tracer
+    if _process_tracer is not None:
+        _process_tracer.flush()
+    if path and multiprocessing.parent_process() is not None:
+        # worker processes write their own shard next to the main file
+        stem, ext = os.path.splitext(path)
+        path = f"{stem}.{os.getpid()}{ext}"
+    _process_tracer = Tracer(path) if path else None
+    return _process_tracer
+
+
+def current_tracer() -> Optional[Tracer]:
+    return TRACER.get() or _process_tracer
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Record the enclosed work as a child of the current span (a new trace at
+    the top level). Yields the Span, or None while tracing is off.
+    """
+    tracer = current_tracer()
+    if tracer is None:
+        yield None
+        return
+    current = Span(name, CURRENT_SPAN.get(), attributes)
+    token = CURRENT_SPAN.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        CURRENT_SPAN.reset(token)
+        tracer.finish(current)
+
+
+@contextmanager
+def tracing_to(path: str):
+    """Trace the enclosed run (and pool threads bound to it) to `path`."""
+    tracer = Tracer(path)
+    token = TRACER.set(tracer)
+    try:
+        yield tracer
+    finally:
+        TRACER.reset(token)
+        tracer.flush()
+
+
+def redact_url(url: str) -> str:
+    return re.sub(r"(application=)[^&]*", r"\1REDACTED", url)
+
+
+def record_response(request_span: Optional[Span], resp, started: float) -> None:
+    """
+    Add status and timing phases to a request span once the body was handled.
+    ttfb is requests' elapsed (send until headers) minus the connection setup
+    of this request; transfer is the rest of the time spent on the body.
+    """
+    if request_span is None:
+        return
+    total_ms = (time.perf_counter() - started) * 1000
+    elapsed_ms = resp.elapsed.total_seconds() * 1000 if resp.elapsed else total_ms
+    setup_ms = sum(request_span.attributes.get(k, 0) for k in ("thore.dns_ms", "thore.connect_ms", "thore.tls_ms"))
+    request_span.set("http.status_code", resp.status_code)
+    request_span.set("thore.new_connection", request_span.attributes.get("thore.new_connection", False))
+    request_span.set("thore.ttfb_ms", round(max(0.0, elapsed_ms - setup_ms), 2))
+    request_span.set("thore.transfer_ms", round(max(0.0, total_ms - elapsed_ms), 2))
+
+
+# ----------------------------
+# Connection phase timing
+# ----------------------------
+# The traced connection classes time DNS, TCP connect and the TLS handshake
+# of new connections and add them to the request span that opened them.
+# Without a current span they behave exactly like urllib3's.
+
+class _TracedConnectionMixin:
+    def _new_conn(self):
+        request_span = CURRENT_SPAN.get()
+        if request_span is None:
+            return super()._new_conn()
+        host = self._dns_host
+        start = time.perf_counter()
+        try:
+            address = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+        except socket.gaierror:
+            return super()._new_conn()  # raises urllib3's NameResolutionError
+        resolved = time.perf_counter()
+        self._dns_host = address
+        try:
+            sock = super()._new_conn()
+        finally:
+            self._dns_host = host
+        request_span.set("net.peer.ip", address)
+        request_span.set("thore.dns_ms", round((resolved - start) * 1000, 2))
+        request_span.set("thore.connect_ms", round((time.perf_counter() - resolved) * 1000, 2))
+        return sock
+
+    def connect(self):
+        request_span = CURRENT_SPAN.get()
+        start = time.perf_counter()
+        super().connect()
+        if request_span is not None:
+            total_ms = (time.perf_counter() - start) * 1000
+            socket_ms = request_span.attributes.get("thore.dns_ms", 0) + request_span.attributes.get("thore.connect_ms", 0)
+            request_span.set("thore.new_connection", True)
+            if isinstance(self, HTTPSConnection):
+                request_span.set("thore.tls_ms", round(max(0.0, total_ms - socket_ms), 2))
+
+
+class TracedHTTPConnection(_TracedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TracedHTTPSConnection(_TracedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TracedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TracedHTTPConnection
+
+
+class TracedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TracedHTTPSConnection
+
+
+class TracingHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools use the traced connection classes."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TracedHTTPConnectionPool,
+            "https": TracedHTTPSConnectionPool,
+        }
+
+
+if os.getenv("THORE_TRACE_FILE"):
+    set_process_tracer(os.getenv("THORE_TRACE_FILE"))
+atexit.register(lambda: _process_tracer and _process_tracer.flush())
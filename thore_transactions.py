@@ -0,0 +1,154 @@
+# file: thore_transactions.py
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict, Any, List, Iterator, Optional, Callable
+
+from thore_client import ThoreAPIClient
+from thore_runner import run_policy, run_concurrent, run_sharded
+from thore_runs import RunOutput
+from thore_workflow import workflow_stages
+from thore_preflight import preflight, standin_client
+from summary_utils import ResultStore, read_results
+
+logger = logging.getLogger(__name__)
+
+WORKFLOW_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workflows")
+TRANSACTION_WORKFLOWS = {
+    "endorsement": os.path.join(WORKFLOW_DIR, "hoatx_endorsement.json"),
+    "cancellation": os.path.join(WORKFLOW_DIR, "hoatx_cancellation.json"),
+}
+
+# ----------------------------
+# Seeds from a run summary
+# ----------------------------
+
+def load_policy_terms(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Seeds (instanceId, policytermId) of the policies in a run summary (see
+    summary_utils.read_results), one per PolicyTerm. Summaries written
+    before policytermId was recorded only give the instanceId; the
+    workflow's get_policyterm_id step then looks the PolicyTerm up.
+    """
+    seeds: List[Dict[str, Any]] = []
+    seen: set = set()
+    for row in read_results(path):
+        key = row.policytermId or row.instanceId
+        if key is None or key in seen:
+            continue
+        seen.add(key)
+        seed = {"instanceId": row.instanceId, "sourcePolicyNumber": row.policyNumber}
+        if row.policytermId is not None:
+            seed["policytermId"] = row.policytermId
+        seeds.append(seed)
+        if limit is not None and len(seeds) >= limit:
+            break
+    logger.info(f"Loaded {len(seeds)} policy terms from {path}")
+    return seeds
+
+
+# ----------------------------
+# Bulk transactions
+# ----------------------------
+
+def run_transactions(client: ThoreAPIClient, kind: str, seeds: List[Dict[str, Any]], user_input: Dict[str, Any],
+                     concurrency: int = 1, workers: int = 1,
+                     policy_fn: Callable[..., Dict[str, Any]] = run_policy,
+                     run_dir: Optional[str] = None,
+                     run_deadline: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Drive one endorsement or cancellation per seed through the same runners
+    as new business: threads sharing client (concurrency), or worker
+    processes with their own clients (workers > 1). user_input supplies the
+    transaction effective date and, for endorsements, the new contact details.
+    Yields each outcome (see run_policy) as it finishes.
+    """
+    workflow_path = TRANSACTION_WORKFLOWS[kind]
+    stages = workflow_stages(workflow_path)
+    logger.info(f"Running {len(seeds)} {kind} transactions")
+    if workers > 1 and len(seeds) > 1:
+        yield from run_sharded(user_input, stages, len(seeds), workers, workflow_path, run_dir=run_dir,
+                               run_deadline=run_deadline, seeds=seeds)
+    elif concurrency > 1 and len(seeds) > 1:
+        yield from run_concurrent(client, user_input, stages, len(seeds), concurrency, workflow_path,
+                                  policy_fn=policy_fn, run_deadline=run_deadline, seeds=seeds)
+    else:
+        for i, seed in enumerate(seeds):
+            yield policy_fn(client, user_input, stages, i + 1, workflow_path=workflow_path,
+                            run_deadline=run_deadline, seed=seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk endorsements or cancellations of the policies in a run summary")
+    parser.add_argument("kind", choices=sorted(TRANSACTION_WORKFLOWS))
+    parser.add_argument("--summary", required=True,
+                        help="run summary: a run's thore_run_results.jsonl or a json/jsonl/csv export")
+    parser.add_argument("--limit", type=int, default=None, help="only the first N policy terms")
+    parser.add_argument("--effective-date", default=time.strftime("%Y-%m-%d"), help="YYYY-MM-DD")
+    parser.add_argument("--phone", default="5555555555", help="endorsed phone number")
+    parser.add_argument("--email", default="endorsed@example.com", help="endorsed email address")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--queue", default=None, help="enqueue into this work queue database instead of running")
+    parser.add_argument("--budget", type=float, default=None, help="run time budget in seconds")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="run against the local stand-in instead of the API (see thore_standin.py)")
+    args = parser.parse_args()
+
+    seeds = load_policy_terms(args.summary, args.limit)
+    user_input = {
+        "effectiveDate": args.effective_date,
+        "firstName": "Bulk",
+        "lastName": args.kind.capitalize(),
+        "email": args.email,
+        "phone": args.phone,
+        "numPolicies": len(seeds),
+    }
+    run_deadline = time.time() + args.budget if args.budget else None
+
+    check = preflight(user_input, workflow_stages(TRANSACTION_WORKFLOWS[args.kind]), len(seeds),
+                      TRANSACTION_WORKFLOWS[args.kind], seeds)
+    if not check["ok"]:
+        print(json.dumps(check, indent=2))
+        raise SystemExit(1)
+
+    with RunOutput() as run:
+        if args.queue:
+            from thore_queue import SQLiteWorkQueue, enqueue_run
+            workflow_path = TRANSACTION_WORKFLOWS[args.kind]
+            run_id = enqueue_run(SQLiteWorkQueue(args.queue), user_input, workflow_stages(workflow_path), len(seeds),
+                                 run_id=run.run_id, workflow_path=workflow_path, run_dir=run.dir,
+                                 run_deadline=run_deadline, seeds=seeds)
+            print(json.dumps({"queued": len(seeds), "runId": run_id, "queue": args.queue}, indent=2))
+            return
+
+        if args.dry_run:
+            # worker processes would build their own (real) clients
+            client, args.workers = standin_client(max(1, args.concurrency)), 1
+        else:
+            client = ThoreAPIClient(pool_size=max(1, args.concurrency))
+            if args.workers <= 1:
+                client.authenticate()
+        store = ResultStore(run.results_path)
+        counts: Dict[str, int] = {}
+        start = time.perf_counter()
+        for outcome in run_transactions(client, args.kind, seeds, user_input, args.concurrency, args.workers,
+                                        run_dir=run.dir, run_deadline=run_deadline):
+            counts[outcome["status"]] = counts.get(outcome["status"], 0) + 1
+            if outcome["result"]:
+                store.append(outcome["result"])
+        elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        "kind": args.kind,
+        "policyTerms": len(seeds),
+        "statuses": counts,
+        "seconds": round(elapsed, 3),
+        "results": run.results_path,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# file: thore_versions.py
+import copy
+import logging
+import os
+from typing import Dict, Any, List, Optional
+
+import requests
+
+from thore_client import ThoreAPIClient, VERSIONS, build_response, known_version, poll_until, response_version
+
+logger = logging.getLogger(__name__)
+
+# Statuses a stale versionNumber is rejected with
+CONFLICT_STATUSES = (409, 412)
+# Refetch-and-re-PATCH rounds before a conflict is given up on
+MAX_CONFLICTS = 3
+# THORE_JSON_PATCH=1 sends re-PATCHes as RFC 6902 JSON Patch documents
+JSON_PATCH = os.getenv("THORE_JSON_PATCH", "").lower() in ("1", "true", "yes", "on")
+JSON_PATCH_CONTENT_TYPE = "application/json-patch+json"
+
+# ----------------------------
+# Optimistic concurrency
+# ----------------------------
+# Every write to an instance (a PATCH, a Verisk save, a rule override)
+# bumps its versionNumber, and a PATCH carrying an older one is rejected
+# with a conflict. Instead of re-sending the same stale body until retries
+# run out, versioned_patch sends the version the policy last saw (see
+# thore_client.VERSIONS) and on a conflict refetches the instance and
+# re-PATCHes only the fields that still differ, at the current version.
+
+
+def is_version_conflict(resp: Optional[requests.Response]) -> bool:
+    """A 412, or a 409 whose messages are about the version rather than a business rule or status."""
+    if resp is None or resp.status_code not in CONFLICT_STATUSES:
+        return False
+    if resp.status_code == 412:
+        return True
+    try:
+        error_json = resp.json()
+    except ValueError:
+        return False
+    messages = error_json.get("messages") if isinstance(error_json, dict) else None
+    texts = [str(error_json.get("description", ""))] if isinstance(error_json, dict) else []
+    for message in messages if isinstance(messages, list) else []:
+        if isinstance(message, dict):
+            if str(message.get("code", "")).upper() in ("VERSION", "CONCURRENCY"):
+                return True
+            texts.append(str(message.get("description", "")))
+    return any(word in text.lower() for text in texts for word in ("version", "concurren", "modified by"))
+
+
+# ----------------------------
+# JSON Patch
+# ----------------------------
+
+def _pointer(path: str, key: Any) -> str:
+    return f"{path}/{str(key).replace('~', '~0').replace('/', '~1')}"
+
+
+def diff(current: Any, desired: Any, path: str = "") -> List[Dict[str, Any]]:
+    """
+    RFC 6902 operations turning current into desired for the fields desired
+    sets. Fields only the server has are left alone (no removes); lists are
+    replaced whole.
+    """
+    if isinstance(current, dict) and isinstance(desired, dict):
+        ops: List[Dict[str, Any]] = []
+        for key, value in desired.items():
+            if key not in current:
+                ops.append({"op": "add", "path": _pointer(path, key), "value": value})
+            else:
+                ops.extend(diff(current[key], value, _pointer(path, key)))
+        return ops
+    if current == desired and type(current) is type(desired):
+        return []
+    return [{"op": "replace", "path": path, "value": desired}]
+
+
+def _parts(path: str) -> List[str]:
+    return [part.replace("~1", "/").replace("~0", "~") for part in path.split("/")[1:]]
+
+
+def apply_patch(document: Any, ops: List[Dict[str, Any]]) -> Any:
+    """A copy of document with add/replace/test operations applied (ValueError when a test fails)."""
+    document = copy.deepcopy(document)
+    for op in ops:
+        parts = _parts(op["path"])
+        if not parts:
+            if op["op"] == "test":
+                if document != op["value"]:
+                    raise ValueError(f"test failed at {op['path']!r}")
+                continue
+            document = copy.deepcopy(op["value"])
+            continue
+        parent = document
+        for part in parts[:-1]:
+            parent = parent[int(part)] if isinstance(parent, list) else parent[part]
+        key = int(parts[-1]) if isinstance(parent, list) else parts[-1]
+        if op["op"] == "test":
+            if parent[key] != op["value"]:
+                raise ValueError(f"test failed at {op['path']!r}")
+        elif op["op"] in ("add", "replace"):
+            parent[key] = copy.deepcopy(op["value"])
+        else:
+            raise ValueError(f"Unsupported JSON Patch operation {op['op']!r}")
+    return document
+
+
+# ----------------------------
+# Versioned PATCH
+# ----------------------------
+
+def _own_fields(body: Dict[str, Any]) -> Dict[str, Any]:
+    """What a PATCH body sets on the instance; the version is the server's to bump."""
+    return {key: value for key, value in body.items() if key not in ("versionNumber", "changeDate")}
+
+
+def versioned_patch(client: ThoreAPIClient, url: str, instance_id: int, body: Dict[str, Any], label: str,
+                    max_conflicts: int = MAX_CONFLICTS, json_patch: Optional[bool] = None) -> requests.Response:
+    """
+    PATCH an instance at the version this policy last saw, polling for the
+    204 like poll_until. On a version conflict the instance is refetched,
+    and only the fields that still differ from body are re-sent at the
+    current version: as a JSON Patch with a versionNumber test when
+    json_patch (default THORE_JSON_PATCH), otherwise merged into the
+    refetched instance. Nothing left to change counts as applied. Other
+    errors, and conflicts after max_conflicts refetches, raise as before.
+    """
+    json_patch = JSON_PATCH if json_patch is None else json_patch
+    version = known_version(instance_id) or body.get("versionNumber")
+    payload: Any = dict(body, versionNumber=version)
+    headers = client.headers()
+    conflicts = 0
+    while True:
+        try:
+            resp = poll_until(client, "PATCH", url, (204,), label, headers=headers, json=payload, body="ignore",
+                              final_statuses=CONFLICT_STATUSES)
+            break
+        except requests.HTTPError as e:
+            if not is_version_conflict(e.response) or conflicts >= max_conflicts:
+                raise
+            conflicts += 1
+
+        # a plain GET: the step's poll policy (success codes, interval) is for the PATCH
+        latest = client._request("GET", url, headers=client.headers()).json()
+        version = latest.get("versionNumber")
+        ops = diff(_own_fields(latest), _own_fields(body))
+        if not ops:
+            logger.info(f"🔁 {label}: instance {instance_id} already at the wanted state (v{version})")
+            return build_response(204, url=url)
+        logger.info(f"🔁 {label}: version conflict on instance {instance_id}, now v{version}; "
+                    f"re-PATCHing {len(ops)} changed field(s)")
+        if json_patch:
+            payload = [{"op": "test", "path": "/versionNumber", "value": version}] + ops
+            headers = dict(client.headers(), **{"Content-Type": JSON_PATCH_CONTENT_TYPE})
+        else:
+            payload = dict(apply_patch(latest, ops), versionNumber=version)
+
+    versions = VERSIONS.get()
+    if versions is not None and version is not None:
+        # the 204 has no body; without an ETag the server is assumed to have bumped the version once
+        versions[str(instance_id)] = response_version(resp) or version + 1
+    return resp
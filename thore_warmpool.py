@@ -0,0 +1,164 @@
+# file: thore_warmpool.py
+import logging
+import queue
+import threading
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+
+from thore_client import ThoreAPIClient
+from thore_precompute import applicant_row
+from thore_runs import RUN_ID
+from thore_steps import step1_create_policy, step_get_policyterm_id, step1_1_get_policy_details
+
+logger = logging.getLogger(__name__)
+
+# Seconds without a run using the pool after which its producers stop creating quotes
+IDLE_TIMEOUT = 900
+
+# ----------------------------
+# Warm pool of pre-created quotes
+# ----------------------------
+
+class QuoteWarmPool:
+    """
+    Keeps up to `size` freshly created quote-stage PolicyTermTransaction.HOATX
+    instances ready, with instanceId, policytermId and details resolved.
+
+    Producer threads create quotes with the pool's applicant and effective
+    date; the Pending PATCH of the policy that claims one writes the run's
+    applicant over it. Only a claimed quote is replaced: quotes older than
+    max_age seconds are dropped without a refill (they stay on the server as
+    abandoned quotes), and once no run has used the pool (touch/claim) for
+    idle_timeout seconds the producers stop for good. Producers log into the
+    run that last used the pool. Attach the pool as client.warm_pool and the
+    create/lookup steps of the workflow take a claimed quote instead of
+    calling the API.
+    """
+
+    def __init__(self, client: ThoreAPIClient, user_input: Dict[str, Any], size: int = 5,
+                 producers: int = 1, max_age: Optional[float] = 3600,
+                 idle_timeout: Optional[float] = IDLE_TIMEOUT):
+        self.client = client
+        self.user_input = applicant_row(user_input)
+        self.size = size
+        self.max_age = max_age
+        self.idle_timeout = idle_timeout
+        self._last_used = time.monotonic()
+        self._run_id = RUN_ID.get()
+        self._ready: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._slots = threading.Semaphore(size)
+        self._stop = threading.Event()
+        self._producers = [
+            threading.Thread(target=self._produce, name=f"thore-warmpool-{i}", daemon=True)
+            for i in range(max(1, producers))
+        ]
+        self.stats = {"created": 0, "claimed": 0, "expired": 0, "misses": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def effective_date(self) -> str:
+        return self.user_input["effectiveDate"]
+
+    def start(self) -> "QuoteWarmPool":
+        for thread in self._producers:
+            thread.start()
+        logger.info(f"🔥 Warm pool started: {self.size} quotes for effective date {self.effective_date}")
+        return self
+
+    def stop(self) -> List[Dict[str, Any]]:
+        """Stop producing; returns the quotes that were never claimed."""
+        self._stop.set()
+        for _ in self._producers:
+            self._slots.release()  # wake producers waiting for a free slot
+        for thread in self._producers:
+            thread.join(timeout=90)
+        unused = []
+        while True:
+            try:
+                unused.append(self._ready.get_nowait())
+            except queue.Empty:
+                break
+        if unused:
+            logger.warning(f"Warm pool stopped with {len(unused)} unclaimed quotes: "
+                           f"{', '.join(str(q['instanceId']) for q in unused)}")
+        logger.info(f"Warm pool stats: {self.stats}")
+        return unused
+
+    def ready(self) -> int:
+        return self._ready.qsize()
+
+    @property
+    def stopped(self) -> bool:
+        """Stopped, or idle for longer than idle_timeout (its producers no longer create quotes)."""
+        return self._stop.is_set()
+
+    def touch(self) -> "QuoteWarmPool":
+        """A run is using the pool: keep it from going idle and log its producers into that run."""
+        self._last_used = time.monotonic()
+        self._run_id = RUN_ID.get()
+        return self
+
+    def _idle(self) -> bool:
+        return self.idle_timeout is not None and time.monotonic() - self._last_used > self.idle_timeout
+
+    def claim(self, user_input: Dict[str, Any], timeout: float = 0) -> Optional[Dict[str, Any]]:
+        """
+        Take a ready quote for a policy of user_input, waiting up to timeout
+        seconds. Returns None when none is ready or the effective date differs,
+        so the caller creates the policy itself.
+        """
+        if user_input.get("effectiveDate") != self.effective_date:
+            self._count("misses")
+            return None
+        self._last_used = time.monotonic()
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                remaining = max(0.0, deadline - time.monotonic())
+                quote = self._ready.get(timeout=remaining) if remaining else self._ready.get_nowait()
+            except queue.Empty:
+                self._count("misses")
+                return None
+            if self.max_age is not None and time.monotonic() - quote["createdAt"] > self.max_age:
+                # its slot stays taken: an expired quote is not replaced, only a claimed one
+                self._count("expired")
+                logger.info(f"Dropping expired warm quote {quote['instanceId']}")
+                continue
+            self._slots.release()
+            self._count("claimed")
+            logger.info(f"♨️ Claimed warm quote instanceId={quote['instanceId']} ({self.ready()} left)")
+            return quote
+
+    def _produce(self) -> None:
+        while not self._stop.is_set():
+            if self._idle():
+                logger.info(f"💤 Warm pool unused for {self.idle_timeout:.0f}s; no longer creating quotes")
+                self._stop.set()
+                return
+            if not self._slots.acquire(timeout=min(5.0, self.idle_timeout or 5.0)):
+                continue
+            if self._stop.is_set() or self._idle():
+                self._slots.release()
+                continue
+            RUN_ID.set(self._run_id)
+            try:
+                instance_id = step1_create_policy(self.client, self.user_input, uuid.uuid4().hex)
+                quote = {
+                    "instanceId": instance_id,
+                    "policytermId": step_get_policyterm_id(self.client, instance_id),
+                    "details": step1_1_get_policy_details(self.client, instance_id),
+                    "createdAt": time.monotonic(),
+                }
+            except Exception as e:
+                self._count("errors")
+                self._slots.release()
+                logger.warning(f"⚠️ Warm pool could not pre-create a quote: {e}")
+                self._stop.wait(5)
+                continue
+            self._count("created")
+            self._ready.put(quote)
+
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self.stats[name] += 1
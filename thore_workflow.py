@@ -0,0 +1,387 @@
+# file: thore_workflow.py
+import json
+import logging
+import os
+import time
+import uuid
+from functools import lru_cache
+from typing import Dict, Any, List, Callable, Optional, Tuple
+
+from thore_client import ThoreAPIClient, POLL_POLICY, DeadlineExceeded, deadline, time_left
+from thore_tracing import span
+from thore_steps import step1_create_policy, step_get_policyterm_id, step1_1_get_policy_details
+from thore_steps_extended import (
+    step1_1_1_verisk_location,
+    step1_1_2_verisk_location,
+    step1_1_3_verisk_aplus_request,
+    step1_1_4_verisk_aplus_save,
+    step1_2_patch_pending,
+    step1_2_1rule_overrides,
+    step2_convert_quote,
+    step2_1_patch_application,
+    step3_rule_overrides,
+    step3_run_enforcer,
+    step3_1_transaction_bind,
+    step3_1_1_transaction_update_binder,
+    step3_2_transaction_issue
+)
+from thore_steps_transactions import (
+    step_start_endorsement,
+    step_start_cancellation,
+    step_patch_endorsement,
+    step_issue_transaction
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKFLOW = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workflows", "hoatx_new_business.json")
+
+# ----------------------------
+# Step registry
+# ----------------------------
+# Every workflow step name maps to an adapter taking (client, ctx), where ctx
+# is the per-policy context dict (userInput, instanceId, policytermId,
+# details, idempotencyKeys). Lookups already in ctx (e.g. from a warm-pool
+# quote, see thore_warmpool, or a seed from a run summary, see
+# thore_transactions) are not repeated. An adapter returning {"success": False, ...}
+# fails the policy with the step's "on_failure" status.
+
+STEP_REGISTRY: Dict[str, Callable[[ThoreAPIClient, Dict[str, Any]], Any]] = {}
+
+
+def workflow_step(name: str):
+    def register(fn):
+        STEP_REGISTRY[name] = fn
+        return fn
+    return register
+
+
+def op_key(ctx: Dict[str, Any], operation: str) -> str:
+    """Idempotency key of one operation of this policy, stable across retries and resumes."""
+    keys = ctx.setdefault("idempotencyKeys", {})
+    if operation not in keys:
+        keys[operation] = uuid.uuid4().hex
+    return keys[operation]
+
+
+@workflow_step("create_policy")
+def _create_policy(client, ctx):
+    quote = client.warm_pool.claim(ctx["userInput"]) if client.warm_pool else None
+    if quote:
+        # pre-created quote with its PolicyTerm ID and details already resolved
+        ctx.update(instanceId=quote["instanceId"], policytermId=quote["policytermId"], details=quote["details"])
+        client.known_instances.add(quote["instanceId"])
+        return
+    ctx["instanceId"] = step1_create_policy(client, ctx["userInput"], op_key(ctx, "create_policy"))
+
+
+@workflow_step("get_policyterm_id")
+def _get_policyterm_id(client, ctx):
+    if "policytermId" in ctx:
+        return
+    if client.batch_resolver:
+        ctx["policytermId"] = client.batch_resolver.policyterm_id(ctx["instanceId"])
+    else:
+        ctx["policytermId"] = step_get_policyterm_id(client, ctx["instanceId"])
+
+
+@workflow_step("get_policy_details")
+def _get_policy_details(client, ctx):
+    if "details" in ctx:
+        return
+    if client.batch_resolver:
+        ctx["details"] = client.batch_resolver.details(ctx["instanceId"])
+    else:
+        ctx["details"] = step1_1_get_policy_details(client, ctx["instanceId"])
+
+
+@workflow_step("verisk_location_request")
+def _verisk_location_request(client, ctx):
+    step1_1_1_verisk_location(client, ctx["instanceId"], op_key(ctx, "verisk_location_request"),
+                              ctx["userInput"].get("property"))
+
+
+@workflow_step("verisk_location_save")
+def _verisk_location_save(client, ctx):
+    step1_1_2_verisk_location(client, ctx["instanceId"], op_key(ctx, "verisk_location_save"))
+
+
+@workflow_step("verisk_aplus_request")
+def _verisk_aplus_request(client, ctx):
+    step1_1_3_verisk_aplus_request(client, ctx["instanceId"], op_key(ctx, "verisk_aplus_request"))
+
+
+@workflow_step("verisk_aplus_save")
+def _verisk_aplus_save(client, ctx):
+    step1_1_4_verisk_aplus_save(client, ctx["instanceId"], op_key(ctx, "verisk_aplus_save"))
+
+
+@workflow_step("patch_pending")
+def _patch_pending(client, ctx):
+    step1_2_patch_pending(client, ctx["details"], ctx["userInput"])
+
+
+@workflow_step("address_rule_overrides")
+def _address_rule_overrides(client, ctx):
+    step1_2_1rule_overrides(client, ctx["instanceId"], ctx["details"]["resourceIdentifier"],
+                            op_key(ctx, "address_rule_overrides"))
+
+
+@workflow_step("convert_quote")
+def _convert_quote(client, ctx):
+    step2_convert_quote(client, ctx["instanceId"], op_key(ctx, "convert_quote"))
+
+
+@workflow_step("patch_application")
+def _patch_application(client, ctx):
+    step2_1_patch_application(client, ctx["details"], ctx["userInput"])
+
+
+@workflow_step("enforcer_or_overrides")
+def _enforcer_or_overrides(client, ctx):
+    """Run the Quadrins enforcer and fall back to rule overrides unless it accepted."""
+    enforcer_data = step3_run_enforcer(client, ctx["instanceId"], op_key(ctx, "run_enforcer"))
+    run_overrides = False  # default to no overrides
+
+    if not enforcer_data:
+        logger.warning("⚠️ No valid enforcer response — running rule overrides as fallback.")
+        run_overrides = True
+    else:
+        try:
+            item = enforcer_data["value"]["item"]
+            http_status = item.get("httpStatusCode")
+            type_value = item.get("type", "").lower()
+
+            # Conditions to trigger overrides
+            if http_status != 200 or type_value in ["accept+", "reject", "reject+"]:
+                logger.info(
+                    f"ℹ️ Enforcer returned httpStatusCode={http_status}, type={type_value}. Triggering RuleOverrides."
+                )
+                run_overrides = True
+            else:
+                logger.info(
+                    f"✅ Enforcer success: httpStatusCode={http_status}, type={type_value}. Skipping RuleOverrides."
+                )
+                logger.info("✅ Step 3 Quadrins Enforcer completed successfully.")
+
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to parse Enforcer response structure: {e}")
+            run_overrides = True  # fail-safe
+
+    if run_overrides:
+        step3_rule_overrides(client, ctx["instanceId"], ctx["details"]["resourceIdentifier"],
+                             op_key(ctx, "rule_overrides"))
+        logger.info(f"✅ Step 3 RuleOverride completed.")
+
+
+@workflow_step("transaction_bind")
+def _transaction_bind(client, ctx):
+    return step3_1_transaction_bind(client, ctx["instanceId"], op_key(ctx, "transaction_bind"))
+
+
+@workflow_step("update_binder")
+def _update_binder(client, ctx):
+    return step3_1_1_transaction_update_binder(client, ctx["instanceId"], op_key(ctx, "update_binder"))
+
+
+@workflow_step("transaction_issue")
+def _transaction_issue(client, ctx):
+    return step3_2_transaction_issue(client, ctx["policytermId"], op_key(ctx, "transaction_issue"),
+                                     ctx["instanceId"])
+
+
+# Follow-on transactions: the seed's instanceId is the issued policy; the
+# start step replaces it with the new transaction, whose details are then
+# looked up by get_policy_details.
+
+def _start(ctx: Dict[str, Any], instance_id: int) -> None:
+    ctx.setdefault("sourceInstanceId", ctx.get("instanceId"))
+    ctx["instanceId"] = instance_id
+    ctx.pop("details", None)
+
+
+@workflow_step("start_endorsement")
+def _start_endorsement(client, ctx):
+    if "sourceInstanceId" not in ctx:
+        _start(ctx, step_start_endorsement(client, ctx["policytermId"], ctx["userInput"],
+                                           op_key(ctx, "start_endorsement")))
+
+
+@workflow_step("start_cancellation")
+def _start_cancellation(client, ctx):
+    if "sourceInstanceId" not in ctx:
+        _start(ctx, step_start_cancellation(client, ctx["policytermId"], ctx["userInput"],
+                                            op_key(ctx, "start_cancellation")))
+
+
+@workflow_step("patch_endorsement")
+def _patch_endorsement(client, ctx):
+    step_patch_endorsement(client, ctx["instanceId"], ctx["userInput"])
+
+
+@workflow_step("issue_endorsement")
+def _issue_endorsement(client, ctx):
+    return step_issue_transaction(client, ctx["policytermId"], "endorsement", op_key(ctx, "issue_endorsement"),
+                                  ctx["instanceId"])
+
+
+@workflow_step("issue_cancellation")
+def _issue_cancellation(client, ctx):
+    return step_issue_transaction(client, ctx["policytermId"], "cancellation", op_key(ctx, "issue_cancellation"),
+                                  ctx["instanceId"])
+
+
+# ----------------------------
+# Loading and compiling
+# ----------------------------
+
+class CompiledStep:
+    __slots__ = ("name", "stage", "fn", "poll", "attempts", "delay", "on_failure", "deadline")
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.name = spec["name"]
+        self.stage = spec.get("stage")
+        self.fn = STEP_REGISTRY[self.name]
+        self.poll = spec.get("poll") or {}
+        retry = spec.get("retry") or {}
+        self.attempts = max(1, int(retry.get("attempts", 1)))
+        self.delay = float(retry.get("delay", 3))
+        self.on_failure = spec.get("on_failure", "failed")
+        # SLA in seconds for the whole step, retries and polls included
+        self.deadline = spec.get("deadline")
+
+
+def load_workflow(path: str = DEFAULT_WORKFLOW) -> Dict[str, Any]:
+    """Read a workflow definition from a .json or .yaml/.yml file."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("PyYAML is required for YAML workflow definitions (pip install pyyaml)")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def workflow_stages(path: str = DEFAULT_WORKFLOW) -> List[str]:
+    """Stages of a workflow definition in file order."""
+    stages: List[str] = []
+    for spec in load_workflow(path).get("steps") or []:
+        if spec.get("stage") and spec["stage"] not in stages:
+            stages.append(spec["stage"])
+    return stages
+
+
+def compile_workflow(definition: Dict[str, Any], stages: Optional[List[str]] = None) -> List[CompiledStep]:
+    """
+    Resolve a workflow definition into an ordered list of steps.
+    Disabled steps are dropped (dependencies on them count as met), steps
+    outside `stages` are dropped, and the rest are ordered so that every
+    step runs after its "after" dependencies (file order breaks ties).
+    """
+    specs = definition.get("steps") or []
+    by_name = {spec["name"]: spec for spec in specs}
+    unknown = [name for name in by_name if name not in STEP_REGISTRY]
+    if unknown:
+        raise ValueError(f"Unknown workflow steps: {', '.join(unknown)}")
+
+    disabled = {spec["name"] for spec in specs if not spec.get("enabled", True)}
+    selected = [
+        spec for spec in specs
+        if spec["name"] not in disabled and (stages is None or spec.get("stage") in stages)
+    ]
+    selected_names = {spec["name"] for spec in selected}
+
+    deps: Dict[str, set] = {}
+    for spec in selected:
+        deps[spec["name"]] = set()
+        for dep in spec.get("after", []):
+            if dep not in by_name:
+                raise ValueError(f"Step {spec['name']} depends on unknown step {dep}")
+            if dep in disabled:
+                continue
+            if dep not in selected_names:
+                raise ValueError(f"Step {spec['name']} needs {dep} ({by_name[dep].get('stage')}), which is not selected")
+            deps[spec["name"]].add(dep)
+
+    ordered: List[CompiledStep] = []
+    done: set = set()
+    remaining = list(selected)
+    while remaining:
+        ready = [spec for spec in remaining if deps[spec["name"]] <= done]
+        if not ready:
+            raise ValueError(f"Cycle in workflow steps: {', '.join(spec['name'] for spec in remaining)}")
+        spec = ready[0]
+        ordered.append(CompiledStep(spec))
+        done.add(spec["name"])
+        remaining.remove(spec)
+    return ordered
+
+
+@lru_cache(maxsize=32)
+def get_compiled_workflow(path: str, stages: Tuple[str, ...]) -> List[CompiledStep]:
+    """Load and compile once per (definition file, stage selection)."""
+    workflow = compile_workflow(load_workflow(path), list(stages))
+    logger.info(f"Compiled workflow {path}: {' -> '.join(step.name for step in workflow)}")
+    return workflow
+
+
+# ----------------------------
+# Executor
+# ----------------------------
+
+def execute_workflow(client: ThoreAPIClient, workflow: List[CompiledStep], ctx: Dict[str, Any],
+                     checkpoint: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                     resume_from: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Run compiled steps in order against one policy's ctx, starting at step
+    resume_from if given (ctx then holds the state of the earlier steps).
+    Returns None when every step succeeded, otherwise a failure dict with
+    status, message, step and the step's httpStatus/ruleIds/error if it
+    reported them (see thore_failures). Exceptions escape once a step's retry
+    attempts are used up; ctx["step"] names the step that raised.
+    Wall and CPU seconds of each step are kept in ctx["timings"].
+    Each step runs under its "deadline" (capped by any outer run budget);
+    running out raises thore_client.DeadlineExceeded. While tracing, every
+    step is a span with its requests as children.
+    """
+    timings = ctx.setdefault("timings", {})
+    if resume_from is not None:
+        names = [step.name for step in workflow]
+        if resume_from not in names:
+            raise ValueError(f"Cannot resume at {resume_from}: not a step of this workflow selection")
+        workflow = workflow[names.index(resume_from):]
+        logger.info(f"Resuming at step {resume_from}")
+    for step in workflow:
+        ctx["step"] = step.name
+        token = POLL_POLICY.set(step.poll)
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            with span(step.name, **{"thore.step": step.name, "thore.stage": step.stage or ""}), \
+                    deadline(step.deadline, f"{step.name} deadline"):
+                for attempt in range(1, step.attempts + 1):
+                    try:
+                        result = step.fn(client, ctx)
+                        break
+                    except DeadlineExceeded:
+                        raise
+                    except Exception as e:
+                        if attempt == step.attempts:
+                            raise
+                        logger.warning(f"⚠️ Step {step.name} failed (attempt {attempt}/{step.attempts}): {e}. Retrying...")
+                        left = time_left()
+                        time.sleep(step.delay if left is None else max(0.0, min(step.delay, left)))
+        finally:
+            POLL_POLICY.reset(token)
+            timings[step.name] = [
+                round(time.perf_counter() - wall_start, 4),
+                round(time.thread_time() - cpu_start, 4),
+            ]
+
+        if isinstance(result, dict) and result.get("success") is False:
+            failure = {"status": step.on_failure, "message": result.get("message", ""), "step": step.name}
+            failure.update((k, result[k]) for k in ("httpStatus", "ruleIds", "error") if k in result)
+            return failure
+        if checkpoint:
+            checkpoint(step.name, {k: v for k, v in ctx.items() if k != "userInput"})
+    return None